@@ -32,6 +32,75 @@ VAR_RUN_DIR = BASE_DIR
 VAR_LIB_DIR = BASE_DIR
 LOG_DIR = os.path.join(BASE_DIR, 'log')
 
+# Directory for the multi-resolution stores of time-series aggregates
+# of file datasets, built by "manage.py build_pyramid".
+# If None, they are placed in a .ncharts_pyramid directory next
+# to the data files.
+PYRAMID_DIR = None
+
+# SQLite database of the files in the datasets, shared by
+# all server processes. If None, each process scans the
+# dataset directories itself.
+FILESET_INDEX = os.path.join(VAR_LIB_DIR, 'fileset_index.sqlite3')
+
+# Directory of the variables and attributes of the datasets, as read
+# from the NetCDF file headers, shared by all server processes.
+# If None, each process reads the headers itself.
+DATASET_INFO_DIR = os.path.join(VAR_LIB_DIR, 'dataset_info')
+
+# Seconds between checks of the newest files of a real-time dataset
+# for new or modified variables. The files of archival datasets, whose
+# end time has passed, are not checked again once they are scanned.
+DATASET_INFO_TTL = 60
+
+# Maximum number of NetCDF files kept open by each server process,
+# so that files read repeatedly, such as the newest file of a real-time
+# dataset, aren't re-opened on every request. A file is re-opened when
+# it changes. If 0, files are closed after every read.
+NETCDF_OPEN_FILES = 32
+
+# Number of separate processes which read NetCDF files for each server
+# process, so that a corrupt file which crashes the NetCDF library does
+# not take down the server. A file which crashes a reader is not read
+# again until it is modified. If 0, files are read in the server process.
+NETCDF_READER_PROCESSES = 0
+
+# Database of the NetCDF files which can't be opened, shared by all server
+# processes, so that they are skipped until they are modified, rather than
+# being tried on every request. List them with the list_quarantine
+# management command. If None, each process keeps its own list.
+NETCDF_QUARANTINE = os.path.join(VAR_LIB_DIR, 'netcdf_quarantine.sqlite3')
+
+# Watch the dataset directories with inotify, so that unchanged
+# directories are not checked on every request. Only directories on
+# local filesystems are watched, those on others, such as NFS, are
+# checked by their modification times.
+FILESET_WATCH = False
+
+# Maximum number of threads of a server process scanning the
+# sub-directories of a dataset in parallel, which shortens cold scans
+# of directory trees on NFS. If 1, directories are scanned sequentially.
+FILESET_SCAN_THREADS = 1
+
+# Limits of the in-memory caches of each server process: the maximum
+# number of entries, and their approximate maximum size in bytes.
+# The least recently used entries are removed when a limit is exceeded.
+#   fileset_dirs: directory listings of the datasets
+#   filesets: datasets' file sets, by path
+#   dataset_info: variables and attributes of the datasets
+#   tail_buffers: newest records of the variables polled by clients
+NCHARTS_CACHE_LIMITS = {
+    'fileset_dirs': {'entries': 20000, 'bytes': 200 * 1000 * 1000},
+    'filesets': {'entries': 1000},
+    'dataset_info': {'entries': 500, 'bytes': 100 * 1000 * 1000},
+    'tail_buffers': {'entries': 1000, 'bytes': 500 * 1000 * 1000},
+}
+
+# Seconds of the newest records of each variable polled by real-time
+# clients which are kept in memory, so that each poll is answered from
+# the records read for all clients. If 0, each poll reads the data.
+TAIL_BUFFER_LENGTH = 3 * 3600
+
 # ALLOWED_HOSTS are the server's IP names, NOT the names of allowed client hosts
 # (seems like an unfortunate variable name).
 # You may see log errors such as:
@@ -22,6 +22,10 @@ VAR_LIB_DIR = os.path.join(VAR_DIR, 'lib/django')
 if 'sqlite' in DATABASES['default']['ENGINE']:
     DATABASES['default']['NAME'] = os.path.join(VAR_LIB_DIR, 'db.sqlite3')
 
+FILESET_INDEX = os.path.join(VAR_LIB_DIR, 'fileset_index.sqlite3')
+DATASET_INFO_DIR = os.path.join(VAR_LIB_DIR, 'dataset_info')
+NETCDF_QUARANTINE = os.path.join(VAR_LIB_DIR, 'netcdf_quarantine.sqlite3')
+
 SECRET_KEY = os.environ.get('EOL_DATAVIS_SECRET_KEY')
 
 if SECRET_KEY is None:
@@ -0,0 +1,387 @@
+# -*- mode: python; indent-tabs-mode: nil; c-basic-offset: 4; tab-width: 4; -*-
+# vim: set shiftwidth=4 softtabstop=4 expandtab:
+
+"""Size-bounded, least-recently-used caches, for the metadata kept
+in memory by the server processes.
+
+Each cache has a name, by which its limits can be set, typically
+from the NCHARTS_CACHE_LIMITS django setting, and keeps counters
+of its hits, misses and evictions.
+
+Also SingleFlight, which shares the result of a call between the
+threads which make it concurrently.
+
+2014 Copyright University Corporation for Atmospheric Research
+
+This file is part of the "django-ncharts" package.
+The license and distribution terms for this file may be found in the
+file LICENSE in this package.
+"""
+
+import collections
+import logging
+import sys
+import threading
+
+import numpy as np
+
+_logger = logging.getLogger(__name__)   # pylint: disable=invalid-name
+
+def approx_sizeof(obj, maxdepth=6):
+    """Return the approximate size in bytes of an object, including
+    the contents of dicts, lists, tuples and sets, and the data
+    of numpy arrays, to a maximum depth.
+
+    Objects which are shared between containers are counted
+    each time they are found, so this may be an overestimate.
+    """
+
+    size = sys.getsizeof(obj)
+    if isinstance(obj, np.ndarray):
+        if obj.base is None:
+            return size
+        return size + obj.nbytes
+    if maxdepth <= 0:
+        return size
+    if isinstance(obj, dict):
+        for (key, val) in obj.items():
+            size += approx_sizeof(key, maxdepth - 1) + \
+                approx_sizeof(val, maxdepth - 1)
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        for val in obj:
+            size += approx_sizeof(val, maxdepth - 1)
+    return size
+
+class LRUCache(object):
+    """A thread-safe cache, which removes its least recently used
+    entries when it exceeds a maximum number of entries, or an
+    approximate maximum size in bytes.
+
+    Attributes:
+        name: A str, name of the cache in LRUCache.configure().
+        max_entries: Maximum number of entries. 0 for no limit.
+        max_bytes: Maximum of the total sizes of the entries. 0 for
+            no limit. The most recently used entry is kept, even
+            if it exceeds max_bytes on its own.
+        sizeof: Function returning the approximate size in bytes of
+            a value in the cache.
+        on_evict: Function called with a value removed because of
+            the limits, replaced by put(), or removed by clear(),
+            or None.
+        hits, misses, evictions: Counters of the lookups of the
+            cache, and of the entries removed because of the limits.
+        nbytes: Total size in bytes of the entries.
+        lock: Mutex for the entries and counters.
+    """
+
+    __caches = {}
+    __limits = {}
+    __caches_lock = threading.Lock()
+
+    def __init__(
+            self, name, max_entries=0, max_bytes=0,
+            sizeof=approx_sizeof, on_evict=None):
+        """Construct a LRUCache, with limits which may be replaced
+        by those configured for name.
+
+        Args:
+            name: A str, name of the cache.
+            max_entries: Default maximum number of entries.
+            max_bytes: Default maximum size in bytes.
+            sizeof: Function of a value, returning its size in bytes.
+            on_evict: Function of a value, called without the lock of
+                the cache held, after the value is removed because of
+                the limits, replaced by another with put(), or removed
+                by clear(), so that it can release its resources if it
+                is still referenced elsewhere.
+        """
+
+        self.name = name
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.on_evict = on_evict
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.nbytes = 0
+        self.__entries = collections.OrderedDict()
+        self.__sizes = {}
+        self.lock = threading.Lock()
+
+        with LRUCache.__caches_lock:
+            LRUCache.__caches[name] = self
+            limits = LRUCache.__limits.get(name)
+        if limits:
+            self.set_limits(**limits)
+
+    @staticmethod
+    def configure(limits):
+        """Set the limits of caches by their names, including
+        those which are created later.
+
+        Args:
+            limits: dict by cache name, of dicts with optional
+                'entries' and 'bytes' elements, the maximum number
+                of entries and maximum size in bytes of the cache.
+        """
+        with LRUCache.__caches_lock:
+            LRUCache.__limits = {
+                name: {
+                    'max_entries': lims.get('entries'),
+                    'max_bytes': lims.get('bytes')}
+                for (name, lims) in (limits or {}).items()}
+            caches = [
+                (cache, LRUCache.__limits[name])
+                for (name, cache) in LRUCache.__caches.items()
+                if name in LRUCache.__limits]
+        for (cache, lims) in caches:
+            cache.set_limits(**lims)
+
+    @staticmethod
+    def get_stats():
+        """Return a list of the stats() of all caches."""
+        with LRUCache.__caches_lock:
+            caches = list(LRUCache.__caches.values())
+        return [cache.stats() for cache in caches]
+
+    def set_limits(self, max_entries=None, max_bytes=None):
+        """Change the limits of this cache, removing entries if
+        necessary. A limit of None is not changed."""
+        with self.lock:
+            if max_entries is not None:
+                self.max_entries = int(max_entries)
+            if max_bytes is not None:
+                self.max_bytes = int(max_bytes)
+            evicted = self.__evict()
+        self.__evicted(evicted)
+
+    def stats(self):
+        """Return a dict of the name, limits, size and counters
+        of this cache."""
+        with self.lock:
+            return {
+                'name': self.name,
+                'entries': len(self.__entries),
+                'bytes': self.nbytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+    def __len__(self):
+        with self.lock:
+            return len(self.__entries)
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.__entries
+
+    def get(self, key, default=None):
+        """Return the value of key, marking it as most recently
+        used, or default if it is not in the cache."""
+        with self.lock:
+            try:
+                value = self.__entries[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self.__entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def get_or_create(self, key, create):
+        """Return the value of key, or if it is not in the cache,
+        add and return the value returned by create().
+
+        create is called with the lock of the cache held, so that
+        only one value is created for a key, and it should not
+        use the cache.
+        """
+        with self.lock:
+            try:
+                value = self.__entries[key]
+            except KeyError:
+                self.misses += 1
+                value = create()
+                evicted = self.__set(key, value)
+            else:
+                self.__entries.move_to_end(key)
+                self.hits += 1
+                return value
+        self.__evicted(evicted)
+        return value
+
+    def put(self, key, value):
+        """Add or replace the value of key, as most recently used."""
+        with self.lock:
+            prev = self.__entries.get(key)
+            evicted = self.__set(key, value)
+        if prev is not None and prev is not value:
+            evicted.append(prev)
+        self.__evicted(evicted)
+
+    def resize(self, key):
+        """Update the size of the value of key, after it has been
+        modified in place, without marking it as used."""
+        with self.lock:
+            if key not in self.__entries:
+                return
+            size = self.sizeof(self.__entries[key])
+            self.nbytes += size - self.__sizes[key]
+            self.__sizes[key] = size
+            evicted = self.__evict()
+        self.__evicted(evicted)
+
+    def pop(self, key, default=None):
+        """Remove key from the cache, returning its value,
+        or default if it is not in the cache."""
+        with self.lock:
+            if key not in self.__entries:
+                return default
+            self.nbytes -= self.__sizes.pop(key)
+            return self.__entries.pop(key)
+
+    def clear(self):
+        """Remove all entries, without changing the counters,
+        calling on_evict for each."""
+        with self.lock:
+            values = list(self.__entries.values())
+            self.__entries.clear()
+            self.__sizes.clear()
+            self.nbytes = 0
+        self.__evicted(values)
+
+    def __set(self, key, value):
+        """Add or replace a value. The lock must be held."""
+        size = self.sizeof(value)
+        self.nbytes += size - self.__sizes.get(key, 0)
+        self.__sizes[key] = size
+        self.__entries[key] = value
+        self.__entries.move_to_end(key)
+        return self.__evict()
+
+    def __evict(self):
+        """Remove the least recently used entries until the cache is
+        within its limits, keeping the most recently used entry.
+        The lock must be held.
+
+        Returns:
+            A list of the removed values.
+        """
+        evicted = []
+        while len(self.__entries) > 1 and (
+                (self.max_entries and len(self.__entries) > self.max_entries) or
+                (self.max_bytes and self.nbytes > self.max_bytes)):
+            (key, value) = self.__entries.popitem(last=False)
+            self.nbytes -= self.__sizes.pop(key)
+            evicted.append(value)
+            self.evictions += 1
+            if self.evictions % 1000 == 1:
+                _logger.info(
+                    "cache %s: evictions=%d, entries=%d, bytes=%d, "
+                    "hits=%d, misses=%d",
+                    self.name, self.evictions, len(self.__entries),
+                    self.nbytes, self.hits, self.misses)
+        return evicted
+
+    def __evicted(self, values):
+        """Call on_evict for the removed values, without the lock held."""
+        if self.on_evict:
+            for value in values:
+                self.on_evict(value)
+
+class SingleFlight(object):
+    """Coalesces concurrent calls with the same key, so that a call
+    is made once, by the first thread, and the other threads wait
+    for, and share its result, or its exception.
+
+    For example, the data read for clients which are polling the
+    same real-time dataset for the same variables and times.
+
+    The result is not kept after the call completes.
+
+    Attributes:
+        name: A str, name for log messages.
+        calls: Number of calls made.
+        shared: Number of calls which waited for another.
+        lock: Mutex for the calls in flight and the counters.
+    """
+
+    class Call(object):
+        """A call in flight.
+
+        Attributes:
+            done: threading.Event, set when the call completes.
+            value: The return value of the call.
+            exc: The exception raised by the call, or None.
+            waiters: Number of threads waiting for the call.
+        """
+        def __init__(self):
+            self.done = threading.Event()
+            self.value = None
+            self.exc = None
+            self.waiters = 0
+
+    def __init__(self, name):
+        """Construct a SingleFlight.
+
+        Args:
+            name: A str, name for log messages.
+        """
+        self.name = name
+        self.calls = 0
+        self.shared = 0
+        self.__flights = {}
+        self.lock = threading.Lock()
+
+    def do(self, key, func, copy=None):
+        """Return func(), or the result of a call of the same key
+        in progress in another thread.
+
+        Args:
+            key: A hashable value, identifying the result of func.
+            func: Function without arguments.
+            copy: Function of a result, returning a copy which can be
+                modified by one caller, or None if the result is
+                not modified. It is not called if the result is
+                not shared.
+
+        Raises:
+            The exception raised by func.
+        """
+        with self.lock:
+            call = self.__flights.get(key)
+            leader = call is None
+            if leader:
+                call = SingleFlight.Call()
+                self.__flights[key] = call
+                self.calls += 1
+            else:
+                call.waiters += 1
+                self.shared += 1
+                if self.shared % 1000 == 1:
+                    _logger.info(
+                        "single flight %s: calls=%d, shared=%d",
+                        self.name, self.calls, self.shared)
+
+        if not leader:
+            call.done.wait()
+            if call.exc is not None:
+                raise call.exc
+            return copy(call.value) if copy else call.value
+
+        try:
+            call.value = func()
+        except BaseException as exc:
+            call.exc = exc
+            raise
+        finally:
+            with self.lock:
+                del self.__flights[key]
+                waiters = call.waiters
+            call.done.set()
+
+        return copy(call.value) if copy and waiters else call.value
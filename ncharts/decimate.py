@@ -0,0 +1,268 @@
+# -*- mode: python; indent-tabs-mode: nil; c-basic-offset: 4; tab-width: 4; -*-
+# vim: set shiftwidth=4 softtabstop=4 expandtab:
+
+"""Decimation of time series for plotting.
+
+A plot is only so many pixels wide, so there is no point in sending
+many more points than that to the browser. These functions select
+a subset of the time indices of a series, such that the plotted
+shape of the data is preserved.
+
+Two methods are supported:
+    lttb: Largest-Triangle-Three-Buckets, from "Downsampling Time Series
+        for Visual Representation", Sveinn Steinarsson, 2013.
+        Selects one point per bucket, the one forming the largest
+        triangle with the point selected in the previous bucket
+        and the average of the next bucket.
+    minmax: Selects the points with the minimum and maximum value
+        in each bucket, preserving the envelope of the data.
+
+2014 Copyright University Corporation for Atmospheric Research
+
+This file is part of the "django-ncharts" package.
+The license and distribution terms for this file may be found in the
+file LICENSE in this package.
+"""
+
+import logging
+
+import numpy as np
+
+_logger = logging.getLogger(__name__)   # pylint: disable=invalid-name
+
+# decimation methods, (value, label)
+DECIMATION_METHODS = (
+    ('lttb', 'Largest-Triangle-Three-Buckets'),
+    ('minmax', 'Minimum and maximum of each bucket'),
+)
+
+def _as_columns(values, ntimes):
+    """Return values as a 2-D float64 array, one column for each
+    plotted line, for example one column per station.
+    """
+    return np.asarray(values, dtype=np.float64).reshape(ntimes, -1)
+
+def _gap_indices(valid, edges):
+    """Return indices of the first missing value of a gap in the data,
+    at most one per bucket, so that a plot still shows the gap.
+
+    Args:
+        valid: 2-D numpy array of bool, False where data is missing.
+        edges: numpy array of the starting index of each bucket.
+    """
+    # index of a missing value after a valid value, in any column
+    gaps = np.nonzero(np.any(valid[:-1] & ~valid[1:], axis=1))[0] + 1
+    if len(gaps) == 0:
+        return gaps
+    buckets = np.searchsorted(edges, gaps, side='right')
+    # first gap in each bucket
+    return gaps[np.unique(buckets, return_index=True)[1]]
+
+def minmax_indices(times, values, npts):
+    """Select indices of the minimum and maximum values in
+    npts / 2 buckets of equal numbers of points.
+
+    Args:
+        times: 1-D numpy array of times.
+        values: numpy array of data, whose first dimension is time.
+            Each remaining column is treated as a separate line in a plot.
+        npts: Target number of points for each column.
+
+    Returns:
+        A sorted numpy array of the selected time indices.
+    """
+
+    ntimes = len(times)
+    nbuckets = npts // 2
+    if nbuckets < 1 or ntimes <= npts:
+        return np.arange(ntimes)
+
+    vals = _as_columns(values, ntimes)
+    ncols = vals.shape[1]
+    valid = np.isfinite(vals)
+
+    # pad to a multiple of the bucket size, so that the values can be
+    # reshaped to (nbuckets, bucket size, ncols)
+    bsize = -(-ntimes // nbuckets)
+    nbuckets = -(-ntimes // bsize)
+    npad = nbuckets * bsize - ntimes
+
+    vmin = np.where(valid, vals, np.inf)
+    vmax = np.where(valid, vals, -np.inf)
+    if npad:
+        vmin = np.concatenate((vmin, np.full((npad, ncols), np.inf)))
+        vmax = np.concatenate((vmax, np.full((npad, ncols), -np.inf)))
+
+    vmin = vmin.reshape(nbuckets, bsize, ncols)
+    vmax = vmax.reshape(nbuckets, bsize, ncols)
+
+    offsets = (np.arange(nbuckets) * bsize)[:, np.newaxis]
+    imin = np.argmin(vmin, axis=1) + offsets
+    imax = np.argmax(vmax, axis=1) + offsets
+
+    # exclude buckets with no valid data in a column
+    imin = imin[np.isfinite(np.min(vmin, axis=1))]
+    imax = imax[np.isfinite(np.max(vmax, axis=1))]
+
+    edges = np.arange(nbuckets) * bsize
+    return np.unique(np.concatenate(
+        ([0, ntimes - 1], imin, imax, _gap_indices(valid, edges))))
+
+def lttb_indices(times, values, npts):
+    """Select indices with the Largest-Triangle-Three-Buckets algorithm.
+
+    The first and last points are always selected. The remaining
+    points are split into npts - 2 buckets, and one point is
+    selected from each. The algorithm is sequential over buckets,
+    but the computations within a bucket are done with numpy,
+    for all columns at once, so the python loop is over the
+    number of output points, not the number of input points.
+
+    Missing (non-finite) values are not selected, except for the
+    first missing value of a gap, so that the plot still shows the gap.
+
+    Args:
+        times: 1-D numpy array of times.
+        values: numpy array of data, whose first dimension is time.
+            Each remaining column is treated as a separate line in a plot.
+        npts: Target number of points for each column.
+
+    Returns:
+        A sorted numpy array of the selected time indices.
+    """
+
+    ntimes = len(times)
+    if npts < 3 or ntimes <= npts:
+        return np.arange(ntimes)
+
+    times = np.asarray(times, dtype=np.float64)
+    vals = _as_columns(values, ntimes)
+    ncols = vals.shape[1]
+    cols = np.arange(ncols)
+    valid = np.isfinite(vals)
+    vzero = np.where(valid, vals, 0.0)
+
+    # bucket boundaries, between the first and last points
+    edges = np.linspace(1, ntimes - 1, npts - 1).astype(int)
+
+    # previously selected point, for each column
+    a_t = np.full(ncols, times[0])
+    a_y = vals[0].copy()
+
+    selected = [np.array([0, ntimes - 1])]
+
+    for ibucket in range(npts - 2):
+        blo = edges[ibucket]
+        bhi = edges[ibucket + 1]
+        if bhi <= blo:
+            continue
+
+        # average of next bucket, or the last point
+        nlo = bhi
+        nhi = edges[ibucket + 2] if ibucket + 2 < len(edges) else ntimes
+        nhi = max(nhi, nlo + 1)
+        c_t = times[nlo:nhi].mean()
+        cnt = valid[nlo:nhi].sum(axis=0)
+        c_y = np.where(
+            cnt > 0, vzero[nlo:nhi].sum(axis=0) / np.maximum(cnt, 1), a_y)
+
+        b_t = times[blo:bhi, np.newaxis]
+        b_y = vals[blo:bhi]
+        b_valid = valid[blo:bhi]
+
+        # twice the area of the triangles
+        area = np.abs(
+            (a_t - c_t) * (b_y - a_y) - (a_t - b_t) * (c_y - a_y))
+        # a_y is nan until a valid value is selected in a column
+        area = np.where(b_valid, np.nan_to_num(area, nan=0.0), -1.0)
+
+        imax = np.argmax(area, axis=0)
+        ok = b_valid[imax, cols]
+        if not np.any(ok):
+            continue
+
+        isel = blo + imax
+        selected.append(isel[ok])
+        a_t = np.where(ok, times[isel], a_t)
+        a_y = np.where(ok, vals[isel, cols], a_y)
+
+    selected.append(_gap_indices(valid, edges))
+
+    return np.unique(np.concatenate(selected))
+
+def decimate_series(ser_data, npts, method="lttb", skip=()):
+    """Decimate the time and data arrays of a series, in place.
+
+    The indices are selected separately for each line of each
+    variable, for example each station of a variable with a
+    station dimension. The time array is shared by all variables,
+    so the union of the selected indices is kept for all of them.
+
+    Args:
+        ser_data: dict of a series, as returned by
+            NetCDFDataset.read_time_series, containing 'time', 'data'
+            and 'vmap' elements. If it was read from a Pyramid, its
+            'min', 'max' and 'count' elements are reduced to those of
+            the records from each selected time to the next, so that
+            they keep the envelope of the data.
+        npts: Target number of points for each line in a plot.
+        method: 'lttb' or 'minmax'.
+        skip: Names of variables which should not be used to
+            select indices, such as those plotted as heatmaps,
+            where the second dimension is not a separate line.
+            Their values are subsampled at the selected indices.
+
+    Returns:
+        True if the series was decimated, False if it was already
+        within npts.
+
+    Raises:
+        ValueError if method is not supported.
+    """
+
+    if method == "lttb":
+        select = lttb_indices
+    elif method == "minmax":
+        select = minmax_indices
+    else:
+        raise ValueError("unknown decimation method: {}".format(method))
+
+    times = ser_data['time']
+    ntimes = len(times)
+    if not npts or ntimes <= npts:
+        return False
+
+    indices = [np.array([0, ntimes - 1])]
+    for vname, vindex in ser_data['vmap'].items():
+        if vname in skip:
+            continue
+        vdata = ser_data['data'][vindex]
+        if vdata.ndim == 0 or vdata.shape[0] != ntimes:
+            continue
+        indices.append(select(times, vdata, npts))
+
+    if len(indices) == 1:
+        # nothing to select from, subsample evenly
+        indices.append(np.linspace(0, ntimes - 1, npts).astype(int))
+
+    indices = np.unique(np.concatenate(indices))
+    if len(indices) >= ntimes:
+        return False
+
+    ser_data['time'] = times[indices]
+    ser_data['data'] = [
+        (vdata[indices] if vdata.ndim > 0 and vdata.shape[0] == ntimes
+         else vdata) for vdata in ser_data['data']]
+
+    for (key, reduce) in (('min', np.fmin), ('max', np.fmax),
+                          ('count', np.add)):
+        if key in ser_data:
+            ser_data[key] = [
+                (reduce.reduceat(vdata, indices, axis=0)
+                 if vdata.ndim > 0 and vdata.shape[0] == ntimes
+                 else vdata) for vdata in ser_data[key]]
+
+    _logger.debug(
+        "decimated %d times to %d, method=%s, npts=%d",
+        ntimes, len(indices), method, npts)
+    return True
@@ -28,3 +28,9 @@ class NoDataException(Exception):
         # self.msg = msg
     # def __str__(self):
     #     return repr(self.msg)
+
+class UnreadableFileException(Exception):
+    """Exception subclass if a file can't be opened or read.
+    """
+    def __init__(self, msg):
+        super().__init__(msg)
@@ -10,11 +10,24 @@ The license and distribution terms for this file may be found in the
 file LICENSE in this package.
 """
 
-import os, glob, stat, re, sys, threading, logging
+import os, re, sys, threading, logging
+import calendar
+import concurrent.futures
+import ctypes
+import ctypes.util
+import fnmatch
+import functools
+import sqlite3
+import struct
 # from stat import *
 from datetime import datetime, timedelta, timezone
 import sre_constants
 import time
+import weakref
+
+import numpy as np
+
+from ncharts import cache as nc_cache
 
 _logger = logging.getLogger(__name__)   # pylint: disable=invalid-name
 
@@ -35,6 +48,219 @@ def globify_time_descriptors(path):
     path = path.replace('%S', '[0-5][0-9]')
     return path
 
+# Regular expressions of the time descriptors supported by parse_time(),
+# matching the same characters as globify_time_descriptors().
+_TIME_DESCRIPTOR_REGEXES = {
+    'Y': r'[12]\d{3}',
+    'y': r'\d{2}',
+    'm': r'[01]\d',
+    'd': r'[0-3]\d',
+    'j': r'[0-3]\d{2}',
+    'H': r'[0-2]\d',
+    'M': r'[0-5]\d',
+    'S': r'[0-5]\d',
+}
+
+_EPOCH = datetime(1970, 1, 1)
+
+# Default values of the fields of a time, which are appended to the
+# values of the groups of a match, in the order of _TIME_PARSER_FIELDS.
+_TIME_PARSER_DEFAULTS = ('1900', '1', '1', '0', '0', '0')
+_TIME_PARSER_FIELDS = ('Y', 'm', 'd', 'H', 'M', 'S')
+
+@functools.lru_cache(maxsize=256)
+def _get_time_parser(pathdesc):
+    """Compile a regular expression for the time descriptors in a path.
+
+    The first occurrence of a descriptor in pathdesc becomes a group
+    in the expression, and later occurrences become back references
+    to the group, so that repeated descriptors must have the same value.
+    The text between descriptors is matched literally.
+
+    Args:
+        pathdesc: A str, path with datetime descriptors.
+
+    Returns:
+        None if pathdesc contains a descriptor not supported here,
+        otherwise a tuple of the compiled expression, the indices
+        into the groups of a match, followed by _TIME_PARSER_DEFAULTS,
+        of the values of _TIME_PARSER_FIELDS, and the indices of the
+        %y and %j groups, or None if they are not in pathdesc, or
+        %y is not needed because %Y is in pathdesc.
+    """
+
+    pattern = []
+    groups = {}
+    for (i, part) in enumerate(re.split('(%.)', pathdesc)):
+        if i % 2 == 0:
+            pattern.append(re.escape(part))
+        elif part == '%%':
+            pattern.append('%')
+        elif part[1] in groups:
+            pattern.append('(?P={})'.format(part[1]))
+        elif part[1] in _TIME_DESCRIPTOR_REGEXES:
+            pattern.append('(?P<{}>{})'.format(
+                part[1], _TIME_DESCRIPTOR_REGEXES[part[1]]))
+            groups[part[1]] = len(groups)
+        else:
+            return None
+
+    ngroups = len(groups)
+    indices = tuple(
+        groups.get(field, ngroups + i)
+        for (i, field) in enumerate(_TIME_PARSER_FIELDS))
+    return (re.compile(''.join(pattern)), indices,
+            None if 'Y' in groups else groups.get('y'), groups.get('j'))
+
+def parse_time(path, pathdesc):
+    """Parse the time from a path, using the datetime descriptors in pathdesc.
+
+    This is equivalent to datetime.strptime(path, pathdesc), in UTC,
+    but the expression for a pathdesc is compiled once and cached,
+    which is much quicker when parsing the times of many files.
+    A descriptor can be repeated, as in '%Y/data_%Y%m%d.nc', in
+    which case all its values in path must be equal.
+
+    Args:
+        path: A str, path to a file or directory.
+        pathdesc: A str, same as path, but with datetime descriptors.
+
+    Returns:
+        The time, in seconds since 1970-01-01 00:00 UTC, or None if
+        pathdesc contains descriptors that are not supported here,
+        in which case strptime can be used.
+
+    Raises:
+        ValueError if path does not match pathdesc, or a time field
+        is out of range.
+    """
+
+    parser = _get_time_parser(pathdesc)
+    if not parser:
+        return None
+
+    (regex, (iyear, imonth, iday, ihour, iminute, isecond), i2year, iyday) = \
+        parser
+    match = regex.fullmatch(path)
+    if not match:
+        raise ValueError(
+            "path {} does not match format {}".format(path, pathdesc))
+
+    values = match.groups() + _TIME_PARSER_DEFAULTS
+    try:
+        year = int(values[iyear])
+        if i2year is not None:
+            # same convention as strptime for %y
+            year = int(values[i2year])
+            year += 2000 if year < 69 else 1900
+        ptime = datetime(
+            year, int(values[imonth]), int(values[iday]),
+            int(values[ihour]), int(values[iminute]), int(values[isecond]))
+        if iyday is not None:
+            yday = int(values[iyday])
+            if not 1 <= yday <= (366 if calendar.isleap(year) else 365):
+                raise ValueError("day of year is out of range")
+            ptime = ptime.replace(month=1, day=1) + timedelta(days=yday - 1)
+    except ValueError as exc:
+        raise ValueError("path {}: {}".format(path, exc))
+
+    return (ptime - _EPOCH).total_seconds()
+
+def _add_months(t, nmonths):
+    """Add a number of months, which may be negative, to a datetime
+    whose day is 1."""
+    month = t.month - 1 + nmonths
+    return t.replace(year=t.year + month // 12, month=month % 12 + 1)
+
+# Time descriptors in the order of decreasing period, with functions
+# to truncate a datetime to the start of a period, and to add a number
+# of periods to a datetime. %j, day of year, can be used in place
+# of %m and %d.
+_TIME_DESCRIPTOR_PERIODS = (
+    (('%Y', '%y'),
+     lambda t: t.replace(month=1, day=1, hour=0, minute=0, second=0, microsecond=0),
+     lambda t, n: t.replace(year=t.year + n)),
+    (('%m', '%j'),
+     lambda t: t.replace(day=1, hour=0, minute=0, second=0, microsecond=0),
+     _add_months),
+    (('%d', '%j'),
+     lambda t: t.replace(hour=0, minute=0, second=0, microsecond=0),
+     lambda t, n: t + timedelta(days=n)),
+    (('%H',),
+     lambda t: t.replace(minute=0, second=0, microsecond=0),
+     lambda t, n: t + timedelta(hours=n)),
+    (('%M',),
+     lambda t: t.replace(second=0, microsecond=0),
+     lambda t, n: t + timedelta(minutes=n)),
+    (('%S',),
+     lambda t: t.replace(microsecond=0),
+     lambda t, n: t + timedelta(seconds=n)),
+)
+
+def get_time_period(pathdesc):
+    """Return the period of the finest time descriptor in a path.
+
+    Args:
+        pathdesc: A str, path with datetime descriptors.
+
+    Returns:
+        None if the descriptors in pathdesc do not determine a
+        period, such as if there are none, there are gaps in their
+        periods, like '%Y/%d', or there are other descriptors.
+        Otherwise a tuple of a function to truncate a datetime
+        to the start of a period, and a function to add a
+        number of periods to a datetime.
+    """
+
+    period = None
+    for (descs, truncate, add) in _TIME_DESCRIPTOR_PERIODS:
+        if not any(desc in pathdesc for desc in descs):
+            break
+        period = (truncate, add)
+
+    if not period or re.search(
+            '%[^' + ''.join(d[1] for (ds, _, _) in _TIME_DESCRIPTOR_PERIODS
+                            for d in ds) + ']', pathdesc):
+        return None
+    return period
+
+def get_time_interval(path, pathdesc):
+    """Return the time interval covered by a path whose time descriptors
+    have been resolved.
+
+    For example the interval of path '/data/2014/07' with pathdesc
+    '/data/%Y/%m' is [2014-07-01, 2014-08-01).
+
+    If the descriptors in pathdesc do not determine an interval,
+    as described in get_time_period(), then the interval is unbounded.
+
+    Args:
+        path: A str, path to a file or directory.
+        pathdesc: A str, same as path, but with datetime descriptors.
+
+    Returns:
+        A tuple of the start and end datetime.datetime of the interval.
+    """
+
+    unbounded = (
+        datetime.min.replace(tzinfo=timezone.utc),
+        datetime.max.replace(tzinfo=timezone.utc))
+
+    period = get_time_period(pathdesc)
+    if not period:
+        return unbounded
+
+    try:
+        start_time = datetime.fromtimestamp(
+            parse_time(path, pathdesc), tz=timezone.utc)
+    except (ValueError, TypeError, OverflowError):
+        return unbounded
+
+    try:
+        return (start_time, period[1](start_time, 1))
+    except (ValueError, OverflowError):
+        return (start_time, unbounded[1])
+
 def pathsplit(path):
     """Like os.path.split, but the first value returned is the leading
     portion of the path.
@@ -70,7 +296,7 @@ class File(object):
 
     """
 
-    def __init__(self, path, pathdesc):
+    def __init__(self, path, pathdesc, ftime=None):
         """Construct a File, and parse its associated time from path
             using pathdesc.
 
@@ -78,13 +304,22 @@ class File(object):
             path: The path to the file.
             pathdesc: A str containing the path to the file, with possible
                 datetime strftime descriptors, such as '%Y'.
+            ftime: The time of the file, if already known, such as from
+                a FilesetIndex, in which case it is not parsed from path.
         """
 
         self.path = path
         self.pathdesc = pathdesc
-        try:
-            self.time = datetime.strptime(path, pathdesc).replace(tzinfo=timezone.utc)
+        if ftime is not None:
+            self.time = ftime
             return
+        try:
+            ftime = parse_time(path, pathdesc)
+            if ftime is None:
+                self.time = datetime.strptime(
+                    path, pathdesc).replace(tzinfo=timezone.utc)
+            else:
+                self.time = datetime.fromtimestamp(ftime, tz=timezone.utc)
         except (ValueError, sre_constants.error) as exc:
             _logger.error("fileset.File __init__: %s", exc)
             raise
@@ -94,68 +329,84 @@ class File(object):
                 sys.exc_info()[0])
             raise
 
-        # strptime chokes when there are two time descriptors for
-        # the same time quantity, e.g. two %Y in 'dir/data_%Y/file_%Y%m%d.dat'
-        # convert the first %Y, %m etc to '' in pathdesc, and use
-        # reg expressions to convert those characters to '' in path.
-
-        #   pathdesc = 'dir/data_%Y/file_%Y%m%d.dat'
-        #   path = 'dir/data_2013/file_20130715.dat'
-        #
-        #   want, for purposes of parsing:
-        #   pathdesc = 'dir/data_/file_%Y%m%d.dat'
-        #   path = 'dir/data_/file_20130715.dat'
-        #
-        #   convert
-        #   pathdesc = 'dir/data_%Y/file_%Y%m%d.dat'
-        #   to
-        #   pathdesc = 'dir/data_[12][0-9][0-9][0-9]/file_%Y%m%d.dat'
-        #   pat = '^(dir/data_)[12][0-9][0-9][0-9](.*)$'
-        #   i is index of '%Y' in pathdesc
-        #   pat is '^(' + pathdesc up to i + ')[12][0-9][0-9][0-9](.*)$'
-        #   path = re.sub(pat,'\1\2',path)
-        #   'dir/data_/file_20130715.dat'
-        #   try strptime,
-        #   cycle through replace dict {'%Y: '[12][0-9][0-9][0-9]',
-        #       trying strptime, and if you get sre_constants.error
-        #       keey trying
-        #   pathdesc is common to all files, is there a way
-        #   so that this process happens only once?
-        #   but path must be changed at the same time. Difficult
-        #   need a re that is applied to remove unneeded fields
-        #
-        # this still needs work...
-
-        pref = os.path.commonprefix([path, pathdesc])
-        path = path.replace(pref, '')
-        pathdesc = pathdesc.replace(pref, '')
-        while pathdesc.count('%Y') > 1:
-            pattern = pathdesc.replace('%Y', '[12][0-9][0-9][0-9]', 1)
-            path = re.sub(pattern, '', path, count=1)
-            pathdesc = pathdesc.replace('%Y', '')
-        if pathdesc.count('%y') > 1:
-            pattern = pathdesc.replace('%y', '[0-9][0-9]', 1)
-            path = re.sub(pattern, '', path, count=1)
-            pathdesc = pathdesc.replace('%y', '')
-        if pathdesc.count('%m') > 1:
-            pattern = pathdesc.replace("%m", "[01][0-9]")
-            path = re.sub(pattern, '', path, count=1)
-            pathdesc = pathdesc.replace('%m', '')
-        if pathdesc.count('%d') > 1:
-            pattern = pathdesc.replace("%d", "[0-3][0-9]")
-            path = re.sub(pattern, '', path, count=1)
-            pathdesc = pathdesc.replace('%d', '')
-        try:
-            # print('try again, path=', path, ', pathdesc=', pathdesc)
-            self.time = datetime.strptime(path, pathdesc).replace(tzinfo=timezone.utc)
-        except (ValueError, sre_constants.error) as exc:
-            _logger.error("fileset.File __init__ %s:", exc)
-            raise
-        except:
-            _logger.error(
-                "fileset.File __init__ unexpected error %s:",
-                sys.exc_info()[0])
-            raise
+class FileList(object):
+    """A listing of the files in a directory, sorted by time.
+
+    The names and times of the files are kept in numpy arrays, rather
+    than in a list of File objects, which are only created for the files
+    selected from the listing. This takes a fraction of the memory for
+    directories of many files, and the files within a time period are
+    found with a binary search.
+
+    A FileList is not modified after it is created, so it can be
+    shared between threads without copying.
+
+    Attributes:
+        dirpath: A str, path of the directory.
+        pathdesc: A str, path of the files, with datetime descriptors.
+        names: numpy array of bytes, the file names, without dirpath.
+        times: numpy array of float64, the times of the files, in
+            seconds since 1970-01-01 00:00 UTC, in increasing order.
+    """
+
+    def __init__(self, dirpath, pathdesc, names=(), times=()):
+        """Construct a FileList.
+
+        Args:
+            dirpath: A str, path of the directory.
+            pathdesc: A str, path of the files, with datetime descriptors.
+            names: Sequence of str, the file names, without dirpath.
+            times: Sequence of the times of the files, in seconds
+                since 1970-01-01 00:00 UTC, in any order.
+        """
+        self.dirpath = dirpath
+        self.pathdesc = pathdesc
+        times = np.asarray(times, dtype=np.float64)
+        order = np.argsort(times, kind='stable')
+        self.times = times[order]
+        self.names = np.array(
+            [os.fsencode(name) for name in names], dtype=np.bytes_)[order]
+
+    def __len__(self):
+        return len(self.times)
+
+    def path(self, i):
+        """Return the path of the i'th file."""
+        return os.path.join(self.dirpath, os.fsdecode(self.names[i]))
+
+    def paths(self):
+        """Return a list of the paths of the files."""
+        return [self.path(i) for i in range(len(self.times))]
+
+    def files(self, start=0, stop=None):
+        """Return a list of File objects for a slice of the listing."""
+        prefix = os.path.join(self.dirpath, '')
+        encoding = sys.getfilesystemencoding()
+        return [
+            File(prefix + name.decode(encoding, 'surrogateescape'),
+                 self.pathdesc, datetime.fromtimestamp(ftime, tz=timezone.utc))
+            for (name, ftime) in zip(
+                self.names[start:stop].tolist(),
+                self.times[start:stop].tolist())]
+
+    def select(self, start_time, end_time):
+        """Find the files within a time period, and the file
+        previous to the period.
+
+        Args:
+            start_time: A datetime.datetime, start of the time period.
+            end_time: A datetime.datetime, end of the time period.
+
+        Returns:
+            A tuple of the index of the last file whose time is
+            at or before start_time, and before end_time, or -1 if
+            there isn't one, and the start and stop indices of the
+            files whose times are after start_time and before end_time.
+        """
+        stop = int(np.searchsorted(self.times, end_time.timestamp(), 'left'))
+        first = min(stop, int(np.searchsorted(
+            self.times, start_time.timestamp(), 'right')))
+        return (first - 1, first, stop)
 
 class Dir(object):
     """A directory that can be scanned for files matching a
@@ -199,15 +450,28 @@ class Dir(object):
             then the cached values can be used.
         cached_subdirs: List of Dir objects scanned in this directory
             which match the head portion of pathrem.
-        cached_files: List of File objects in this directory which match
+        cached_files: FileList of the files in this directory which match
             the head portion of pathrem.
         do_double_check: Should we do a double check of the directory contents?
-        lock: Mutex for modtime, cached_subdirs, cached_files
+        index_path: Path of the FilesetIndex containing the current snapshot.
+        watcher: The DirWatcher watching this directory, if no changes
+            have been seen since the last snapshot, otherwise None.
+        start_time, end_time: The time interval [start_time, end_time)
+            implied by the descriptors that were resolved to create path.
+            For example, if pathdesc is '/data/%Y/%m', and path is
+            '/data/2014/07', the interval is July, 2014. Files in
+            this directory, and its sub-directories, are expected
+            to have times within the interval.
+        lock: Mutex for modtime, cached_subdirs, cached_files, watcher
     """
 
-    __cached_filesets = {}
-    __cached_dirs = {}
-    __cache_lock = threading.Lock()
+    # Dirs are also referenced by the Dirs of their parent directories,
+    # so when one is removed from the cache its snapshot is cleared.
+    # update_snapshot() adds it again if it is still in use.
+    __cached_dirs = nc_cache.LRUCache(
+        'fileset_dirs', max_entries=20000, max_bytes=200 * 1000 * 1000,
+        sizeof=lambda pdir: pdir.approx_size(),
+        on_evict=lambda pdir: pdir.clear_snapshot())
 
     # Filesystem cache latency. On an NFS filesystem, file and directory
     # attributes (such as modification time) are cached on the client.
@@ -237,9 +501,13 @@ class Dir(object):
         self.pathrem = pathrem
         self.modtime = datetime.min.replace(tzinfo=timezone.utc)
         self.cached_subdirs = []
-        self.cached_files = []
+        self.cached_files = FileList(
+            path, os.path.join(pathdesc, pathsplit(pathrem)[0]))
         self.do_double_check = False
+        self.index_path = None
+        self.watcher = None
         self.lock = threading.Lock()
+        (self.start_time, self.end_time) = get_time_interval(path, pathdesc)
 
     @staticmethod
     def get(path, pathdesc, pathrem):
@@ -247,15 +515,26 @@ class Dir(object):
         avoid repeated scans.
         """
 
-        with Dir.__cache_lock:
-            hashval = hash(path) + hash(pathrem)
-            if hashval in Dir.__cached_dirs:
-                ddir = Dir.__cached_dirs[hashval]
-            else:
-                ddir = Dir(path, pathdesc, pathrem)
-                Dir.__cached_dirs[hashval] = ddir
-
-        return ddir
+        return Dir.__cached_dirs.get_or_create(
+            (path, pathrem), lambda: Dir(path, pathdesc, pathrem))
+
+    def approx_size(self):
+        """Return the approximate size in bytes of this Dir
+        and its snapshot."""
+        cached_files = self.cached_files
+        return 1000 + cached_files.names.nbytes + cached_files.times.nbytes + \
+            100 * len(self.cached_subdirs)
+
+    def clear_snapshot(self):
+        """Release the snapshot of this Dir, so that it is
+        scanned again the next time it is used."""
+        with self.lock:
+            self.modtime = datetime.min.replace(tzinfo=timezone.utc)
+            self.cached_files = FileList(self.path, self.cached_files.pathdesc)
+            self.cached_subdirs = []
+            self.do_double_check = False
+            self.index_path = None
+            self.watcher = None
 
     def scan(
             self,
@@ -271,7 +550,10 @@ class Dir(object):
         If the directory has not been modified since the
         previous scan, then the previous list of files in the
         directory, if any is returned.  Scans are performed
-        on any subdirectories which match the head of pathrem.
+        on any subdirectories which match the head of pathrem,
+        and whose time interval intersects the time period.
+        Subdirectories before the time period are scanned, latest
+        first, only until the file previous to start_time is found.
 
         Args:
             start_time: A datetime.datetime, start of the time period.
@@ -285,27 +567,126 @@ class Dir(object):
             OSError
         """
 
-        files = []
+        segments = self.select(
+            start_time, end_time,
+            self.update_snapshots(start_time, end_time))
+
+        # the file previous to start_time, at the latest time
+        prev = None
+        for (flist, iprev, _, _) in segments:
+            if iprev >= 0 and (prev is None or \
+                    flist.times[iprev] > prev[0].times[prev[1]]):
+                prev = (flist, iprev)
+
+        files = prev[0].files(prev[1], prev[1] + 1) if prev else []
+        for (flist, _, first, stop) in segments:
+            files.extend(flist.files(first, stop))
+
+        files.sort(key=lambda x: x.time)
+        return files
+
+    def select(self, start_time, end_time, snapshots=None):
+        """Select the files of this Dir and its sub-directories
+        within a time period, and the candidates for the file
+        previous to start_time, without creating File objects.
+
+        Sub-directories are skipped as described in scan().
+
+        Args:
+            start_time: A datetime.datetime, start of the time period.
+            end_time: A datetime.datetime, end of the time period.
+            snapshots: dict of snapshots of Dirs, as returned by
+                update_snapshots(), which are used rather than
+                updating them again.
+
+        Returns:
+            A list of tuples of a FileList, and the indices
+            returned by FileList.select().
+
+        Raises:
+            OSError
+        """
+
+        if snapshots and self in snapshots:
+            (cached_files, cached_subdirs) = snapshots[self]
+        else:
+            (cached_files, cached_subdirs) = self.update_snapshot()
+
+        (in_range, earlier) = Dir.select_subdirs(
+            cached_subdirs, start_time, end_time)
+
+        segments = []
+        for pdir in in_range:
+            # recursive listing.
+            segments.extend(pdir.select(start_time, end_time, snapshots))
+
+        segments.append(
+            (cached_files,) + cached_files.select(start_time, end_time))
+
+        # Look for the file previous to start_time in the
+        # sub-directories before the time period, latest first.
+        for pdir in earlier:
+            if any(seg[1] >= 0 for seg in segments):
+                break
+            segments.extend(pdir.select(start_time, end_time))
+
+        return segments
+
+    def update_snapshot(self, index=None):
+        """Update the snapshot of this directory, if it has been
+        modified since the last one.
+
+        Args:
+            index: A FilesetIndex. If not None, and the index contains a
+                snapshot of the current version of the directory, then
+                it is used instead of scanning the directory. Otherwise
+                the new snapshot is saved in the index.
+
+        Returns:
+            A tuple of the FileList of the files in this directory which
+            match the head of pathrem, and the list of sub-directories,
+            as Dir objects.
+
+        Raises:
+            OSError
+            sqlite3.Error
+        """
 
         t1 = time.time()
 
-        try:
-            pstat = os.stat(self.path)
-        except OSError as exc:
-            _logger.error(exc)
-            raise
+        # Mark this Dir as recently used in the cache, adding it back
+        # if it had been removed, in which case its snapshot was cleared.
+        Dir.__cached_dirs.get_or_create(
+            (self.path, self.pathrem), lambda: self)
 
-        dirmodtime = datetime.fromtimestamp(
-            pstat.st_mtime, tz=timezone.utc)
+        watcher = DirWatcher.get()
 
         # get previous snapshot of this directory
         self.lock.acquire()
+        unchanged = watcher is not None and self.watcher is watcher
         prevmodtime = self.modtime
-        cached_files = self.cached_files.copy()
+        cached_files = self.cached_files
         cached_subdirs = self.cached_subdirs.copy()
         do_double_check = self.do_double_check
+        index_path = self.index_path
         self.lock.release()
 
+        if not unchanged:
+            # Start watching before checking the modification time.
+            # Until a double check is done, a change could have been
+            # missed, so keep checking.
+            if watcher and not do_double_check:
+                watcher.watch(self)
+
+            try:
+                pstat = os.stat(self.path)
+            except OSError as exc:
+                _logger.error(exc)
+                raise
+
+            dirmodtime = datetime.fromtimestamp(
+                pstat.st_mtime, tz=timezone.utc)
+
         # Check if modification time of directory is newer than it
         # was at the time of the last directory scan.
         # If the modification time was less than LATENCY ago
@@ -313,6 +694,8 @@ class Dir(object):
         # Without this double check there were a significant
         # number of times that a new file was not seen in a
         # directory.
+        # If the directory is watched, and unchanged, the snapshot
+        # is current.
         now = datetime.now(tz=timezone.utc)
 
         # It looks like rsync can cause directory modification
@@ -320,8 +703,8 @@ class Dir(object):
         # is (say)  13:47:52, and the next time it is 12:00:00.
         # So this check is simply for inequality, not for
         # dirmodtime > prevmodtime.
-        if dirmodtime != prevmodtime or \
-            (do_double_check and now > prevmodtime + Dir.LATENCY):
+        if not unchanged and (dirmodtime != prevmodtime or \
+            (do_double_check and now > prevmodtime + Dir.LATENCY)):
 
             _logger.debug(
                 "doing dir scan of %s, dirmodtime=%s, do_double_check=%s",
@@ -330,67 +713,776 @@ class Dir(object):
                 "%s, pstat.st_mtime=%f",
                 self.path, pstat.st_mtime)
 
-            cached_files = []
-            cached_subdirs = []
             prevmodtime = dirmodtime
-            do_double_check = now < dirmodtime + Dir.LATENCY
-
-            (nextpath, pathrem) = pathsplit(self.pathrem)
 
-            # next portion of path
-            globpath = globify_time_descriptors(nextpath)
+            snapshot = None
+            if index:
+                # Another process may have already scanned
+                # this version of the directory.
+                snapshot = index.get_dir(self, dirmodtime, now)
 
-            # search for directories
-            fullglobpath = os.path.join(self.path, globpath)
-            for subpath in glob.iglob(fullglobpath):
-                # print('subpath=', subpath)
-                try:
-                    pstat = os.stat(subpath)
-                except OSError as exc:
-                    _logger.error(exc)
-                    continue    # maybe it was (very) recently deleted
-                if stat.S_ISDIR(pstat.st_mode):
-                    pdir = Dir.get(
-                        subpath, os.path.join(self.pathdesc, nextpath), pathrem)
-                else:
-                    pfile = File(subpath, os.path.join(self.pathdesc, nextpath))
-                    cached_files.append(pfile)
+            if snapshot:
+                (do_double_check, cached_files, cached_subdirs) = snapshot
+            else:
+                (cached_files, cached_subdirs) = self.glob()
+                do_double_check = now < dirmodtime + Dir.LATENCY
+                if index:
+                    index.save_dir(
+                        self, dirmodtime, do_double_check,
+                        cached_files, cached_subdirs)
 
             if len(cached_files):
                 t2 = time.time()
                 _logger.debug(
-                    "scan of %s took %f seconds, total # of files=%d",
-                    fullglobpath, t2-t1, len(cached_files))
+                    "scan of %s took %f seconds, total # of files=%d, "
+                    "from index=%s",
+                    self.path, t2-t1, len(cached_files), bool(snapshot))
+
+            cached_subdirs = sorted(cached_subdirs, key=lambda x: x.start_time)
 
             # save snapshot
             self.lock.acquire()
             self.modtime = prevmodtime
             self.do_double_check = do_double_check
-            self.cached_files = sorted(cached_files, key=lambda x: x.time)
+            self.cached_files = cached_files
             self.cached_subdirs = cached_subdirs
+            self.index_path = index.path if index else None
+            if do_double_check:
+                self.watcher = None
             self.lock.release()
 
-        for pdir in cached_subdirs:
-            # recursive listing.
-            files.extend(pdir.scan(start_time, end_time))
+            # account for the new size of the snapshot
+            Dir.__cached_dirs.resize((self.path, self.pathrem))
+
+        elif index and index_path != index.path:
+            # current snapshot is not in the index
+            index.save_dir(
+                self, prevmodtime, do_double_check,
+                cached_files, cached_subdirs)
+            self.lock.acquire()
+            self.index_path = index.path
+            self.lock.release()
+
+        return (cached_files, cached_subdirs)
+
+    def glob(self):
+        """Search this directory for files and sub-directories
+        which match the head of pathrem.
 
-        files.extend(cached_files)
+        Returns:
+            A tuple of a FileList of the files, and the list of
+            sub-directories, as Dir objects.
+        """
 
-        # exclude files whose time is equal to or after end_time, then sort
-        files = sorted(
-            list(
-                [x for x in files if x.time < end_time]),
-            key=lambda x: x.time)
+        names = []
+        times = []
+        cached_subdirs = []
+
+        (nextpath, pathrem) = pathsplit(self.pathrem)
+        pathdesc = os.path.join(self.pathdesc, nextpath)
+
+        # match names against the next portion of path, with the
+        # expression compiled from its time descriptors, or as a glob
+        # if it has descriptors that are not supported by parse_time()
+        parser = _get_time_parser(nextpath)
+        if parser:
+            match = parser[0].fullmatch
+        else:
+            globpath = globify_time_descriptors(nextpath)
+            match = lambda name: fnmatch.fnmatchcase(name, globpath)
 
-        i = 0
-        for i in range(len(files)):
-            if files[i].time > start_time:
+        # One pass through the directory entries. The type of an entry
+        # is usually known from the directory, without a stat of
+        # the entry, unless it is a symbolic link.
+        try:
+            entries = os.scandir(self.path)
+        except FileNotFoundError as exc:
+            _logger.error(exc)
+            return (FileList(self.path, pathdesc), cached_subdirs)
+
+        # like glob, hidden names only match a hidden pattern
+        hidden = nextpath.startswith('.')
+        with entries:
+            for entry in entries:
+                if (entry.name.startswith('.') and not hidden) or \
+                        not match(entry.name):
+                    continue
+                try:
+                    isdir = entry.is_dir()
+                except OSError as exc:
+                    _logger.error(exc)
+                    continue    # maybe it was (very) recently deleted
+                if isdir:
+                    pdir = Dir.get(entry.path, pathdesc, pathrem)
+                    cached_subdirs.append(pdir)
+                elif parser:
+                    try:
+                        times.append(parse_time(entry.path, pathdesc))
+                    except ValueError as exc:
+                        _logger.error("fileset.Dir glob: %s", exc)
+                        raise
+                    names.append(entry.name)
+                else:
+                    pfile = File(entry.path, pathdesc)
+                    times.append(pfile.time.timestamp())
+                    names.append(entry.name)
+
+        return (FileList(self.path, pathdesc, names, times), cached_subdirs)
+
+    def refresh(
+            self, index,
+            start_time=datetime.min.replace(tzinfo=timezone.utc),
+            end_time=datetime.max.replace(tzinfo=timezone.utc),
+            snapshots=None):
+        """Update the snapshots of this directory and the
+        sub-directories needed for a time period, saving any changes
+        in a FilesetIndex.
+
+        As in scan(), sub-directories are skipped if their intervals
+        are outside the time period, except those needed to find
+        the file previous to start_time.
+
+        Args:
+            index: A FilesetIndex.
+            start_time: A datetime.datetime, start of the time period.
+            end_time: A datetime.datetime, end of the time period.
+            snapshots: dict of snapshots of Dirs, as returned by
+                update_snapshots(), which are used rather than
+                updating them again. If None, they are updated here.
+
+        Returns:
+            True if a file at or before start_time was found.
+
+        Raises:
+            OSError
+            sqlite3.Error
+        """
+        if snapshots is None:
+            snapshots = self.update_snapshots(start_time, end_time, index)
+
+        if snapshots and self in snapshots:
+            (cached_files, cached_subdirs) = snapshots[self]
+        else:
+            (cached_files, cached_subdirs) = self.update_snapshot(index)
+
+        (in_range, earlier) = Dir.select_subdirs(
+            cached_subdirs, start_time, end_time)
+
+        found = len(cached_files) > 0 and \
+            cached_files.times[0] <= start_time.timestamp()
+
+        for pdir in in_range:
+            if pdir.refresh(index, start_time, end_time, snapshots or {}):
+                found = True
+
+        # Refresh the sub-directories before the time period, latest
+        # first, until one contains the file previous to start_time.
+        for pdir in earlier:
+            if found:
                 break
+            found = pdir.refresh(index, start_time, end_time, {})
 
-        # we want to include the previous file
-        files = files[max(i-1, 0):]
-        # print("len(files)=", len(files))
-        return files
+        return found
+
+    def update_snapshots(self, start_time, end_time, index=None):
+        """Update the snapshots of this Dir and its sub-directories
+        whose intervals intersect a time period, in parallel, using
+        the threads of the ScanPool.
+
+        The directories are updated level by level, so that a cold
+        scan of a tree takes about the time of a directory scan
+        multiplied by the depth of the tree, rather than by the
+        number of directories, which matters when each stat and
+        read of a directory is a round trip to an NFS server.
+
+        The sub-directories before the time period, which may be
+        searched for the file previous to start_time, are not
+        updated here.
+
+        Args:
+            start_time: A datetime.datetime, start of the time period.
+            end_time: A datetime.datetime, end of the time period.
+            index: A FilesetIndex, passed to update_snapshot().
+
+        Returns:
+            None if a ScanPool has not been configured, otherwise
+            a dict of the snapshot of each Dir, as returned by
+            update_snapshot().
+
+        Raises:
+            OSError
+            sqlite3.Error
+        """
+
+        pool = ScanPool.get()
+        if not pool:
+            return None
+
+        snapshots = {}
+        level = [self]
+        while level:
+            if len(level) == 1:
+                results = [level[0].update_snapshot(index)]
+            else:
+                results = pool.map(
+                    lambda pdir: pdir.update_snapshot(index), level)
+            for (pdir, snapshot) in zip(level, results):
+                snapshots[pdir] = snapshot
+            level = [
+                subdir for pdir in level
+                for subdir in Dir.select_subdirs(
+                    snapshots[pdir][1], start_time, end_time)[0]]
+
+        return snapshots
+
+    @staticmethod
+    def select_subdirs(subdirs, start_time, end_time):
+        """Select the sub-directories that need to be scanned
+        for a time period.
+
+        Args:
+            subdirs: A list of Dir objects, sorted by start_time.
+            start_time: A datetime.datetime, start of the time period.
+            end_time: A datetime.datetime, end of the time period.
+
+        Returns:
+            A tuple of the list of Dirs whose intervals intersect the
+            time period, and the list of Dirs whose intervals are before
+            the time period, in reverse order, which are searched for
+            the file previous to start_time.
+        """
+        in_range = [
+            pdir for pdir in subdirs
+            if pdir.end_time > start_time and pdir.start_time < end_time]
+        earlier = [
+            pdir for pdir in reversed(subdirs)
+            if pdir.end_time <= start_time]
+        return (in_range, earlier)
+
+class ScanPool(object):
+    """A bounded pool of threads for scanning directories in parallel.
+
+    A pool is not shared with child processes, whose copy of it
+    would have no threads, so each process creates its own.
+
+    Attributes:
+        max_threads: The maximum number of threads.
+        pid: Id of the process which created the pool.
+        executor: A concurrent.futures.ThreadPoolExecutor.
+    """
+
+    __pool = None
+    __max_threads = 1
+    __pool_lock = threading.Lock()
+
+    def __init__(self, max_threads):
+        """Construct a ScanPool.
+
+        Args:
+            max_threads: The maximum number of threads.
+        """
+        self.max_threads = max_threads
+        self.pid = os.getpid()
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_threads, thread_name_prefix="fileset_scan")
+
+    @staticmethod
+    def configure(max_threads):
+        """Set the maximum number of threads scanning the directories
+        of a Fileset in parallel.
+
+        Args:
+            max_threads: If 1 or less, directories are scanned
+                sequentially.
+        """
+        with ScanPool.__pool_lock:
+            ScanPool.__max_threads = max_threads or 1
+            pool = ScanPool.__pool
+            ScanPool.__pool = None
+        if pool and pool.pid == os.getpid():
+            pool.executor.shutdown(wait=False)
+
+    @staticmethod
+    def get():
+        """Return the concurrent.futures.ThreadPoolExecutor of
+        the pool for this process, or None if directories are
+        scanned sequentially.
+        """
+        with ScanPool.__pool_lock:
+            if ScanPool.__max_threads <= 1:
+                return None
+            pool = ScanPool.__pool
+            if not pool or pool.pid != os.getpid():
+                pool = ScanPool(ScanPool.__max_threads)
+                ScanPool.__pool = pool
+            return pool.executor
+
+class DirWatcher(object):
+    """Watches directories with Linux inotify, so that the snapshot
+    of a Dir only needs to be updated after a change in the directory.
+
+    Without a watcher, Dir.update_snapshot() does an os.stat of
+    the directory on every scan, to check its modification time.
+    With a watcher, a thread of the process reads the inotify events
+    of the watched directories, and marks their Dirs as changed.
+    The snapshot of an unchanged directory is then used without
+    any system calls.
+
+    inotify only reports changes made through the local kernel, so
+    directories on network filesystems such as NFS, where files may
+    be written by other hosts, are not watched. Only directories on
+    the filesystem types in LOCAL_FSTYPES are watched. Others are
+    checked by their modification time, as are all directories if
+    inotify is not available.
+
+    Attributes:
+        fd: The inotify file descriptor.
+        pid: Id of the process which created the watcher. A watcher
+            is not shared with child processes.
+        running: False if the watcher thread has stopped.
+        wds: dict of the inotify watch descriptor of each path.
+        dirs: dict of the set of Dirs of each watch descriptor, as weak
+            references, which do not keep Dirs removed from the cache.
+        lock: Mutex for running, wds and dirs.
+    """
+
+    __watcher = None
+    __enabled = False
+    __watcher_lock = threading.Lock()
+
+    LOCAL_FSTYPES = frozenset((
+        'btrfs', 'ext2', 'ext3', 'ext4', 'f2fs', 'jfs', 'overlay',
+        'reiserfs', 'tmpfs', 'xfs', 'zfs'))
+
+    # from <sys/inotify.h>
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_MOVE_SELF = 0x00000800
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ONLYDIR = 0x01000000
+
+    MASK = IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | \
+        IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+
+    EVENT_HEADER = struct.Struct('iIII')
+
+    def __init__(self):
+        """Construct a DirWatcher, and start its thread.
+
+        Raises:
+            OSError if inotify is not available.
+        """
+        try:
+            self.libc = ctypes.CDLL(
+                ctypes.util.find_library('c'), use_errno=True)
+            self.fd = self.libc.inotify_init1(os.O_CLOEXEC)
+        except AttributeError as exc:
+            raise OSError("inotify not available: {}".format(exc))
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, "inotify_init1: " + os.strerror(errno))
+
+        self.pid = os.getpid()
+        self.running = True
+        self.wds = {}
+        self.dirs = {}
+        self.mounts = None
+        self.lock = threading.Lock()
+        threading.Thread(
+            target=self.run, name="DirWatcher", daemon=True).start()
+
+    @staticmethod
+    def configure(enable):
+        """Set whether directories are watched.
+
+        Args:
+            enable: If True, the directories of Filesets on local
+                filesystems are watched with inotify.
+        """
+        with DirWatcher.__watcher_lock:
+            DirWatcher.__enabled = bool(enable)
+
+    @staticmethod
+    def get():
+        """Return the DirWatcher of this process, creating it if
+        necessary, or None if watching is not enabled or not available.
+        """
+        with DirWatcher.__watcher_lock:
+            if not DirWatcher.__enabled:
+                return None
+            watcher = DirWatcher.__watcher
+            if not watcher or watcher.pid != os.getpid():
+                try:
+                    watcher = DirWatcher()
+                except OSError as exc:
+                    _logger.warning(
+                        "%s, checking directory modification times", exc)
+                    DirWatcher.__enabled = False
+                    watcher = None
+                DirWatcher.__watcher = watcher
+            return watcher
+
+    def is_local(self, path):
+        """Is path on a filesystem type in LOCAL_FSTYPES?"""
+
+        if self.mounts is None:
+            # mount points, with octal escapes of spaces, etc,
+            # longest first, and their filesystem types
+            mounts = []
+            try:
+                with open('/proc/self/mounts') as mfile:
+                    for line in mfile:
+                        fields = line.split()
+                        if len(fields) > 2:
+                            mpoint = re.sub(
+                                r'\\([0-7]{3})',
+                                lambda m: chr(int(m.group(1), 8)), fields[1])
+                            mounts.append((mpoint, fields[2]))
+            except OSError as exc:
+                _logger.warning("%s", exc)
+            self.mounts = sorted(mounts, key=lambda m: -len(m[0]))
+
+        path = os.path.realpath(path)
+        for (mpoint, fstype) in self.mounts:
+            if path == mpoint or \
+                    path.startswith(mpoint.rstrip(os.sep) + os.sep):
+                return fstype in DirWatcher.LOCAL_FSTYPES
+        return False
+
+    def watch(self, pdir):
+        """Watch the directory of a Dir, and mark the Dir as unchanged
+        until an event is read for the directory.
+
+        This should be called before the directory is checked for
+        changes, so that none are missed.
+
+        Args:
+            pdir: A Dir.
+
+        Returns:
+            True if the directory is watched, False if it is not on
+            a local filesystem, or could not be watched.
+        """
+
+        with self.lock:
+            if not self.running:
+                return False
+            wd = self.wds.get(pdir.path)
+            if wd is None:
+                if not self.is_local(pdir.path):
+                    # -1: not watched
+                    self.wds[pdir.path] = -1
+                    return False
+                wd = self.libc.inotify_add_watch(
+                    self.fd, os.fsencode(pdir.path), DirWatcher.MASK)
+                if wd < 0:
+                    errno = ctypes.get_errno()
+                    _logger.warning(
+                        "inotify_add_watch %s: %s",
+                        pdir.path, os.strerror(errno))
+                    return False
+                self.wds[pdir.path] = wd
+            elif wd < 0:
+                return False
+            self.dirs.setdefault(wd, weakref.WeakSet()).add(pdir)
+
+        with pdir.lock:
+            pdir.watcher = self
+        return True
+
+    def run(self):
+        """Read inotify events, marking the Dirs of the watched
+        directories as changed. If reading fails, the watcher is
+        stopped, and the Dirs are again checked by their
+        modification times.
+        """
+
+        while True:
+            try:
+                buf = os.read(self.fd, 65536)
+            except OSError as exc:
+                _logger.error("inotify read: %s", exc)
+                break
+            changed = set()
+            offset = 0
+            with self.lock:
+                while offset + DirWatcher.EVENT_HEADER.size <= len(buf):
+                    (wd, mask, _, namelen) = \
+                        DirWatcher.EVENT_HEADER.unpack_from(buf, offset)
+                    offset += DirWatcher.EVENT_HEADER.size + namelen
+                    if mask & DirWatcher.IN_Q_OVERFLOW:
+                        # events were lost
+                        for dirs in self.dirs.values():
+                            changed.update(dirs)
+                        continue
+                    changed.update(self.dirs.get(wd, ()))
+                    if mask & (DirWatcher.IN_MOVE_SELF | DirWatcher.IN_IGNORED):
+                        # Directory was moved or removed. Forget the
+                        # watch, so that the path is watched again
+                        # if it is re-created.
+                        if mask & DirWatcher.IN_MOVE_SELF:
+                            self.libc.inotify_rm_watch(self.fd, wd)
+                        self.dirs.pop(wd, None)
+                        self.wds = {
+                            path: pwd for (path, pwd) in self.wds.items()
+                            if pwd != wd}
+            self.mark_changed(changed)
+
+        with self.lock:
+            self.running = False
+            changed = set()
+            for dirs in self.dirs.values():
+                changed.update(dirs)
+            self.dirs = {}
+            self.wds = {}
+        self.mark_changed(changed)
+        os.close(self.fd)
+
+    def mark_changed(self, dirs):
+        """Mark Dirs as changed, so that their directories are checked
+        the next time they are scanned."""
+        for pdir in dirs:
+            with pdir.lock:
+                if pdir.watcher is self:
+                    pdir.watcher = None
+
+class FilesetIndex(object):
+    """An index of the files of Filesets, in an SQLite database,
+    which is shared between processes.
+
+    Without an index, each process must glob the directories of a
+    Fileset, and parse the times from the file names, the first time
+    it is scanned. With an index, a process can use the snapshot of
+    a directory saved by another process, if the modification time
+    of the directory has not changed. Scans of a Fileset then become
+    range queries of the file times in the index.
+
+    Tables:
+        dirs: The modification time of each directory at the time of
+            its last scan, and whether it should be checked again
+            after Dir.LATENCY.
+        subdirs: The sub-directories found in each directory.
+        files: The files in each directory, with their times, and
+            the path of the Fileset, for the range queries.
+
+    A directory is identified by its path and the pathrem of the Dir,
+    so that a directory can be in more than one Fileset.
+
+    Attributes:
+        path: Path of the SQLite database.
+    """
+
+    __index = None
+
+    __index_lock = threading.Lock()
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS dirs ("
+        "path TEXT, pathrem TEXT, mtime REAL, double_check INTEGER, "
+        "PRIMARY KEY (path, pathrem))",
+        "CREATE TABLE IF NOT EXISTS subdirs ("
+        "path TEXT, pathrem TEXT, "
+        "subpath TEXT, subpathdesc TEXT, subpathrem TEXT)",
+        "CREATE INDEX IF NOT EXISTS subdirs_path ON subdirs (path, pathrem)",
+        "CREATE TABLE IF NOT EXISTS files ("
+        "fileset TEXT, dirpath TEXT, pathrem TEXT, "
+        "path TEXT, pathdesc TEXT, time REAL)",
+        "CREATE INDEX IF NOT EXISTS files_dir ON files (dirpath, pathrem)",
+        "CREATE INDEX IF NOT EXISTS files_time ON files (fileset, time)",
+    )
+
+    def __init__(self, path):
+        """Construct a FilesetIndex.
+
+        Args:
+            path: Path of the SQLite database, which is created
+                if necessary.
+        """
+        self.path = path
+        self.local = threading.local()
+
+    @staticmethod
+    def configure(path):
+        """Set the path of the index used by all Filesets.
+
+        Args:
+            path: Path of the SQLite database. If None, an index
+                is not used.
+        """
+        with FilesetIndex.__index_lock:
+            if path:
+                FilesetIndex.__index = FilesetIndex(path)
+            else:
+                FilesetIndex.__index = None
+
+    @staticmethod
+    def get():
+        """Return the configured FilesetIndex, or None."""
+        with FilesetIndex.__index_lock:
+            return FilesetIndex.__index
+
+    def connection(self):
+        """Return a connection to the database for this thread.
+
+        sqlite3 connections should not be shared between
+        threads, or used in a child process after a fork.
+        """
+        conn = getattr(self.local, 'conn', None)
+        if conn is None or self.local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=60)
+            # Write-ahead logging, so that readers are not
+            # blocked by a writer.
+            conn.execute("PRAGMA journal_mode=WAL")
+            with conn:
+                for sql in FilesetIndex.SCHEMA:
+                    conn.execute(sql)
+            self.local.conn = conn
+            self.local.pid = os.getpid()
+        return conn
+
+    def get_dir(self, ddir, mtime, now):
+        """Fetch the snapshot of a directory from the index, if it
+        is current.
+
+        Args:
+            ddir: The Dir.
+            mtime: datetime.datetime, current modification time
+                of the directory.
+            now: datetime.datetime, the current time.
+
+        Returns:
+            None if the index doesn't have a snapshot of the directory
+            for mtime, or it needs to be double checked. Otherwise a tuple of
+            the double check flag, a FileList of the files, and the list
+            of Dir objects in the directory.
+
+        Raises:
+            sqlite3.Error
+        """
+
+        conn = self.connection()
+
+        row = conn.execute(
+            "SELECT mtime, double_check FROM dirs "
+            "WHERE path = ? AND pathrem = ?",
+            (ddir.path, ddir.pathrem)).fetchone()
+
+        if not row or row[0] != mtime.timestamp() or \
+                (row[1] and now > mtime + Dir.LATENCY):
+            return None
+
+        rows = conn.execute(
+            "SELECT path, time FROM files "
+            "WHERE dirpath = ? AND pathrem = ? ORDER BY time",
+            (ddir.path, ddir.pathrem)).fetchall()
+        files = FileList(
+            ddir.path, ddir.cached_files.pathdesc,
+            [os.path.basename(row[0]) for row in rows],
+            [row[1] for row in rows])
+
+        subdirs = [
+            Dir.get(subpath, subpathdesc, subpathrem)
+            for (subpath, subpathdesc, subpathrem) in conn.execute(
+                "SELECT subpath, subpathdesc, subpathrem FROM subdirs "
+                "WHERE path = ? AND pathrem = ?",
+                (ddir.path, ddir.pathrem))]
+
+        return (bool(row[1]), files, subdirs)
+
+    def save_dir(self, ddir, mtime, double_check, files, subdirs):
+        """Save the snapshot of a directory in the index.
+
+        Entries for sub-directories which no longer exist are removed.
+
+        Args:
+            ddir: The Dir.
+            mtime: datetime.datetime, modification time of the directory.
+            double_check: Whether the directory should be checked again.
+            files: FileList of the files in the directory.
+            subdirs: List of sub-directories, as Dir objects.
+
+        Raises:
+            sqlite3.Error
+        """
+
+        conn = self.connection()
+        fileset = os.path.join(ddir.pathdesc, ddir.pathrem)
+
+        with conn:
+            oldsubs = set(
+                row[0] for row in conn.execute(
+                    "SELECT subpath FROM subdirs "
+                    "WHERE path = ? AND pathrem = ?",
+                    (ddir.path, ddir.pathrem)))
+
+            for subpath in oldsubs - set(pdir.path for pdir in subdirs):
+                # everything at or below the removed directory
+                prefix = subpath + os.sep
+                for (table, col) in (
+                        ("dirs", "path"), ("subdirs", "path"),
+                        ("files", "dirpath")):
+                    conn.execute(
+                        "DELETE FROM {0} WHERE {1} = ? OR "
+                        "substr({1}, 1, ?) = ?".format(table, col),
+                        (subpath, len(prefix), prefix))
+
+            conn.execute(
+                "INSERT OR REPLACE INTO dirs VALUES (?, ?, ?, ?)",
+                (ddir.path, ddir.pathrem, mtime.timestamp(),
+                 int(double_check)))
+
+            conn.execute(
+                "DELETE FROM subdirs WHERE path = ? AND pathrem = ?",
+                (ddir.path, ddir.pathrem))
+            conn.executemany(
+                "INSERT INTO subdirs VALUES (?, ?, ?, ?, ?)",
+                [(ddir.path, ddir.pathrem, pdir.path, pdir.pathdesc,
+                  pdir.pathrem) for pdir in subdirs])
+
+            conn.execute(
+                "DELETE FROM files WHERE dirpath = ? AND pathrem = ?",
+                (ddir.path, ddir.pathrem))
+            conn.executemany(
+                "INSERT INTO files VALUES (?, ?, ?, ?, ?, ?)",
+                [(fileset, ddir.path, ddir.pathrem, path, files.pathdesc, ftime)
+                 for (path, ftime) in zip(files.paths(), files.times.tolist())])
+
+    def get_files(self, fileset, start_time, end_time):
+        """Return the files of a Fileset within a time period,
+        along with the file previous to the period.
+
+        Args:
+            fileset: path of the Fileset.
+            start_time: A datetime.datetime, start of the time period.
+            end_time: A datetime.datetime, end of the time period.
+
+        Returns:
+            A list of File objects sorted by time.
+
+        Raises:
+            sqlite3.Error
+        """
+
+        conn = self.connection()
+
+        rows = conn.execute(
+            "SELECT path, pathdesc, time FROM files "
+            "WHERE fileset = ? AND time <= ? AND time < ? "
+            "ORDER BY time DESC LIMIT 1",
+            (fileset, start_time.timestamp(), end_time.timestamp())).fetchall()
+
+        rows.extend(conn.execute(
+            "SELECT path, pathdesc, time FROM files "
+            "WHERE fileset = ? AND time > ? AND time < ? ORDER BY time",
+            (fileset, start_time.timestamp(), end_time.timestamp())))
+
+        return [
+            File(path, pathdesc, datetime.fromtimestamp(ftime, tz=timezone.utc))
+            for (path, pathdesc, ftime) in rows]
 
 class Fileset(object):
     """A set of files defined by a path, which usually contains
@@ -400,13 +1492,27 @@ class Fileset(object):
         path: A str, path with possible strptime descriptors.
         pdir: Dir corresponding to initial portion directory path up to
             a directory or file name with strptime descriptors.
+        period: If the time descriptors in path determine a fixed
+            period between files, such as daily for 'xxx_%Y%m%d.nc',
+            the functions returned by get_time_period() for the
+            finest descriptor. Otherwise None.
     """
 
-    __cached_filesets = {}
+    # Maximum number of file names to predict in a scan, before
+    # resorting to a directory scan.
+    MAX_PREDICTED_FILES = 200
 
-    __cached_dirs = {}
+    # Number of periods before start_time in which to look for the
+    # previous file, when predicting, before resorting to a scan.
+    MAX_PREVIOUS_PERIODS = 2
 
-    __cache_lock = threading.Lock()
+    # Names are not predicted for periods less than this, such as
+    # 'xxx_%Y%m%d_%H%M%S.nc', whose files are rarely every second.
+    MIN_PREDICTED_PERIOD = timedelta(minutes=1)
+
+    __cached_filesets = nc_cache.LRUCache(
+        'filesets', max_entries=1000,
+        sizeof=lambda fset: 1000 + 2 * len(fset.path))
 
     def __init__(self, path):
         """Construct a Fileset from a path, which may contain
@@ -431,9 +1537,75 @@ class Fileset(object):
 
         self.pdir = Dir.get(path, path, pathrem)
 
+        self.period = get_time_period(self.path)
+
     def __str__(self):
         return self.path
 
+    def predict(self, start_time, end_time):
+        """Find the files for a time period by generating their names
+        from the time descriptors in path, rather than by scanning
+        directories.
+
+        This is only possible if the descriptors determine a fixed
+        period between files, of at least MIN_PREDICTED_PERIOD, only
+        a few files are needed, such as for a short real-time request,
+        and the previous file is within MAX_PREVIOUS_PERIODS of
+        start_time.
+
+        Args:
+            start_time: A datetime.datetime, start of the time period.
+            end_time: A datetime.datetime, end of the time period.
+
+        Returns:
+            None if a scan of the directories is necessary. Otherwise
+            a list of File objects, as returned by scan(), with the file
+            previous to start_time, followed by those within the
+            time period.
+        """
+
+        if not self.period:
+            return None
+
+        (truncate, add) = self.period
+        maxfiles = Fileset.MAX_PREDICTED_FILES
+
+        try:
+            ftime = truncate(start_time)
+            if add(ftime, 1) - ftime < Fileset.MIN_PREDICTED_PERIOD:
+                return None
+            ftimes = []
+            while ftime < end_time and len(ftimes) < maxfiles:
+                ftimes.append(ftime)
+                ftime = add(ftime, 1)
+            if ftime < end_time:
+                return None
+
+            files = []
+            # the file previous to or at start_time, which may not exist
+            # if the files are not exactly on the period, in which case
+            # the directories are scanned.
+            ftime = ftimes[0] if ftimes else truncate(start_time)
+            for _ in range(Fileset.MAX_PREVIOUS_PERIODS):
+                path = ftime.strftime(self.path)
+                if os.path.exists(path):
+                    files.append(File(path, self.path, ftime))
+                    break
+                ftime = add(ftime, -1)
+            else:
+                return None
+        except (ValueError, OverflowError):
+            # beyond the range of datetime
+            return None
+
+        for ftime in ftimes:
+            if ftime > start_time:
+                path = ftime.strftime(self.path)
+                if os.path.exists(path):
+                    files.append(File(path, self.path, ftime))
+
+        return files
+
     @staticmethod
     def get(path):
         """Fetch a Fileset by path, which may be cached.
@@ -442,15 +1614,8 @@ class Fileset(object):
             path: A str, path describing the Fileset, which may
                 contain datetime strftime descriptors.
         """
-        Fileset.__cache_lock.acquire()
-        if path in Fileset.__cached_filesets:
-            fset = Fileset.__cached_filesets[path]
-        else:
-            fset = Fileset(path)
-            Fileset.__cached_filesets[path] = fset
-
-        Fileset.__cache_lock.release()
-        return fset
+        return Fileset.__cached_filesets.get_or_create(
+            path, lambda: Fileset(path))
 
     def scan(
             self,
@@ -469,6 +1634,24 @@ class Fileset(object):
         Raises:
             OSError
 
+        If the files can be found by predicting their names, see predict(),
+        then directories are not scanned. Otherwise, if a FilesetIndex has
+        been configured, the directories of this Fileset are checked for
+        modifications, and then the files are selected from the index.
         """
+        files = self.predict(start_time, end_time)
+        if files is not None:
+            return files
+
+        index = FilesetIndex.get()
+        if index:
+            try:
+                self.pdir.refresh(index, start_time, end_time)
+                return index.get_files(
+                    os.path.join(self.pdir.pathdesc, self.pdir.pathrem),
+                    start_time, end_time)
+            except sqlite3.Error as exc:
+                _logger.error("%s: %s: %s", self.path, index.path, exc)
+
         return self.pdir.scan(start_time, end_time)
 
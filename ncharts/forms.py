@@ -190,6 +190,12 @@ class DataSelectionForm(forms.Form):
         label='Variable to plot on Y axis in sounding plot',
         required=False)
 
+    # Maximum number of points per plotted line, set by javascript
+    # from the width of the browser window. Time series with
+    # more points are decimated.
+    max_points = forms.IntegerField(
+        required=False, min_value=0, widget=forms.HiddenInput())
+
     def __init__(self, *args, dataset=None, request=None, **kwargs):
         """Set choices for time zone from dataset.
 
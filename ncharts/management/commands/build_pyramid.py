@@ -0,0 +1,52 @@
+from django.core.management.base import BaseCommand
+
+from ncharts.models import FileDataset
+from ncharts import pyramid as nc_pyramid
+from ncharts import exceptions as nc_exc
+
+
+class Command(BaseCommand):
+    help = "Build or update the multi-resolution aggregates of file datasets. " \
+        "Run periodically, from cron for example, to keep the aggregates " \
+        "of real-time datasets current."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'project', nargs='?',
+            help='name of project, default: all projects')
+        parser.add_argument(
+            'dataset', nargs='?',
+            help='name of dataset, default: all datasets of the project')
+        parser.add_argument(
+            '--rebuild', action='store_true',
+            help='rebuild the aggregates from all the files')
+        parser.add_argument(
+            '--levels', type=int, nargs='+', default=list(nc_pyramid.LEVELS),
+            help='aggregation levels in seconds, default: %(default)s')
+
+    def handle(self, **options):
+
+        dsets = FileDataset.objects.exclude(dset_type="sounding")
+        if options['project']:
+            dsets = dsets.filter(project__name=options['project'])
+        if options['dataset']:
+            dsets = dsets.filter(name=options['dataset'])
+
+        for dset in dsets:
+            ncdset = dset.get_netcdf_dataset()
+            pyr = nc_pyramid.Pyramid(ncdset.pyramid_dir)
+            try:
+                nrecs = pyr.update(
+                    ncdset, levels=options['levels'],
+                    rebuild=options['rebuild'])
+            except BlockingIOError:
+                print("project=%s, dataset=%s: update in progress, skipped" % \
+                    (dset.project, dset))
+                continue
+            except (OSError, nc_exc.NoDataException) as exc:
+                print("project=%s, dataset=%s: %s" % \
+                    (dset.project, dset, exc))
+                continue
+
+            print("project=%s, dataset=%s, path=%s, #records=%d" % \
+                (dset.project, dset, pyr.path, nrecs))
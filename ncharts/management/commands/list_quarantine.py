@@ -0,0 +1,41 @@
+import sqlite3
+from datetime import datetime, timezone
+
+from django.core.management.base import BaseCommand
+
+from ncharts import netcdf as nc_netcdf
+
+
+class Command(BaseCommand):
+    help = "List the NetCDF files which are quarantined because they " \
+        "could not be opened, or crashed a reader process. A file is " \
+        "released from the quarantine when it is modified."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'paths', nargs='*',
+            help='paths of files to release from the quarantine')
+        parser.add_argument(
+            '--release-all', action='store_true',
+            help='release all files from the quarantine')
+
+    def handle(self, **options):
+
+        quarantine = nc_netcdf.FileQuarantine.get()
+        try:
+            if options['release_all']:
+                quarantine.release()
+            for path in options['paths']:
+                quarantine.release(path)
+
+            files = quarantine.get_files()
+        except sqlite3.Error as exc:
+            print("%s: %s" % (quarantine.path, exc))
+            return
+
+        for (path, error, qtime) in files:
+            print("%s: %s, since %s" % \
+                (path, error, datetime.fromtimestamp(
+                    qtime, tz=timezone.utc).strftime("%Y-%m-%d %H:%M:%S")))
+
+        print("#quarantined=%d" % len(files))
@@ -17,6 +17,7 @@ from copy import deepcopy
 from datetime import datetime, timezone, timedelta
 
 from django.db import models, transaction
+from django.conf import settings
 
 from django.core import exceptions as dj_exc
 from django.utils.translation import gettext_lazy
@@ -25,10 +26,32 @@ from django.core.validators import validate_comma_separated_integer_list
 
 from timezone_field import TimeZoneField
 
-from ncharts import netcdf, fileset, raf_database
+from ncharts import netcdf, fileset, raf_database, tail
+from ncharts import decimate as nc_decimate
+from ncharts import pyramid as nc_pyramid
+from ncharts import cache as nc_cache
 
 _logger = logging.getLogger(__name__)   # pylint: disable=invalid-name
 
+# limits of the in-memory caches of metadata
+nc_cache.LRUCache.configure(getattr(settings, 'NCHARTS_CACHE_LIMITS', None))
+
+# index of dataset files, shared between server processes
+fileset.FilesetIndex.configure(getattr(settings, 'FILESET_INDEX', None))
+
+fileset.DirWatcher.configure(getattr(settings, 'FILESET_WATCH', False))
+fileset.ScanPool.configure(getattr(settings, 'FILESET_SCAN_THREADS', 1))
+
+# dataset info read from NetCDF headers, shared between server processes
+netcdf.DatasetInfoStore.configure(getattr(settings, 'DATASET_INFO_DIR', None))
+netcdf.NetCDFDataset.configure(getattr(settings, 'DATASET_INFO_TTL', 60))
+netcdf.FilePool.configure(getattr(settings, 'NETCDF_OPEN_FILES', 0))
+netcdf.ReaderPool.configure(getattr(settings, 'NETCDF_READER_PROCESSES', 0))
+netcdf.FileQuarantine.configure(getattr(settings, 'NETCDF_QUARANTINE', None))
+
+# newest records of the variables polled by real-time clients
+tail.TailBuffer.configure(getattr(settings, 'TAIL_BUFFER_LENGTH', 0))
+
 # Categories of ISFS variables. Used in creating tabs
 ISFS_VARIABLE_TYPES = {
     "Met": ["T", "RH", "P", "Spd", "Spd_max", "Dir", "U", "V", "Ifan", "Rainr", "Raina", "Tc", "q", "mr"],
@@ -349,6 +372,19 @@ class Dataset(models.Model):
     variables = models.ManyToManyField(
         Variable, related_name='+')
 
+    max_points = models.IntegerField(
+        default=0,
+        help_text=gettext_lazy(
+            'Maximum number of points per plotted line sent to a browser. ' +
+            'Longer time series are decimated. ' +
+            '0: only decimate if the browser requests it'))
+
+    decimation = models.CharField(
+        max_length=16,
+        choices=nc_decimate.DECIMATION_METHODS,
+        default=nc_decimate.DECIMATION_METHODS[0][0],
+        help_text=gettext_lazy('Method of decimating time series for plotting'))
+
     # netcdf_time_series, raf_postgres
     # dstype = models.CharField(max_length=64, blank=True)
 
@@ -512,13 +548,22 @@ class FileDataset(Dataset):
         return fileset.Fileset(
             os.path.join(self.directory, self.filenames))
 
+    def get_pyramid_dir(self):
+        """Return the directory of the pyramid.Pyramid of aggregates
+        of this FileDataset.
+        """
+        return nc_pyramid.get_pyramid_dir(
+            os.path.join(self.directory, self.filenames),
+            root=getattr(settings, 'PYRAMID_DIR', None))
+
     def get_netcdf_dataset(self):
         """Return the netcdf.NetCDFDataset corresponding to this
         FileDataset.
         """
         return netcdf.NetCDFDataset(
             os.path.join(self.directory, self.filenames),
-            self.get_start_time(), self.get_end_time())
+            self.get_start_time(), self.get_end_time(),
+            pyramid_dir=self.get_pyramid_dir())
 
     def get_variables(self):
         """Return the time series variable names of this dataset.
@@ -570,6 +615,18 @@ class FileDataset(Dataset):
 
         return ncdset.get_sites()
 
+    def get_metadata_generation(self):
+        """Return the generation of the variables, stations and sites
+        of this dataset, which changes whenever they change.
+
+        Raises:
+            exception.NoDataException
+        """
+
+        ncdset = self.get_netcdf_dataset()
+
+        return ncdset.get_metadata_generation()
+
     def get_series_tuples(
             self,
             series_name_fmt="",
@@ -11,23 +11,35 @@ The license and distribution terms for this file may be found in the
 file LICENSE in this package.
 """
 
+import collections
+import concurrent.futures
+import copy
+import multiprocessing
+import multiprocessing.resource_tracker
+import multiprocessing.shared_memory
 import os
 import sys
 import time
 from datetime import datetime, timezone
 import logging
-import threading
 import operator
 import hashlib
+import pickle
 import re
+import sqlite3
+import tempfile
+import threading
+import weakref
 
-from functools import reduce as reduce_
+from functools import reduce as reduce_, lru_cache
 
 import numpy as np
 import netCDF4
 
 from ncharts import exceptions as nc_exc
+from ncharts import cache as nc_cache
 from ncharts import fileset as nc_fileset
+from ncharts import pyramid as nc_pyramid
 
 # regular expression for extracting a site name from an ISFS variable
 _SITE_RE_PROG = re.compile("(\\.[0-9]+\\.?[0-9]*(c?m))?(\\.([^.]+))$")
@@ -41,6 +53,15 @@ _logger = logging.getLogger(__name__)   # pylint: disable=invalid-name
 
 STATION_DIMENSION_NAME = "station"
 
+# Times of the records in a NetCDF file, in the info of a dataset.
+# mtime is the modification time of the file when its times were read,
+# first_time and last_time are the first and last times in the file,
+# as UTC timestamps, and nrecs is the number of records. variables is
+# an int bitmap of the NetCDF variables in the file, whose bit numbers
+# are in the variable_bits of the dataset info.
+FileExtent = collections.namedtuple(
+    'FileExtent', ['mtime', 'first_time', 'last_time', 'nrecs', 'variables'])
+
 def get_file_modtime(path):
     """ Utility to get the modification time of a file. """
     try:
@@ -52,6 +73,29 @@ def get_file_modtime(path):
     return datetime.fromtimestamp(
         pstat.st_mtime, tz=timezone.utc)
 
+def get_file_status(path):
+    """Return a tuple of the inode, modification time in nanoseconds
+    and size of a file, which changes when it is replaced or modified,
+    or None if it can't be accessed."""
+    try:
+        pstat = os.stat(path)
+    except OSError:
+        return None
+    return (pstat.st_ino, pstat.st_mtime_ns, pstat.st_size)
+
+def copy_time_series(res_data):
+    """Return a copy of a dict of series returned by read_time_series(),
+    which can be modified by a caller without affecting the original,
+    as long as the numpy arrays, which are not copied, are replaced
+    rather than modified in place."""
+    return {
+        series_name: dict(
+            ser_data,
+            data=list(ser_data['data']),
+            **{key: copy.copy(ser_data[key])
+               for key in ('vmap', 'dim2', 'stnnames') if key in ser_data})
+        for (series_name, ser_data) in res_data.items()}
+
 def get_isfs_site(varname):
     """Use regular expression to extract a site name from an ISFS variable name.
 
@@ -83,6 +127,939 @@ def get_isfs_site(varname):
             pass
     return ''
 
+# regular expression for parsing CF time units, such as
+# "seconds since 2012-10-01 00:00:00 00:00"
+_TIME_UNITS_RE_PROG = re.compile(
+    r"^\s*([a-zA-Z]+)\s+since\s+"
+    r"([0-9]{1,4})-([0-9]{1,2})-([0-9]{1,2})"
+    r"(?:[T ]+([0-9]{1,2}):([0-9]{1,2})(?::([0-9]{1,2}(?:\.[0-9]*)?))?)?"
+    r"\s*(?:Z|UTC|([+-]?)([0-9]{1,2})(?::?([0-9]{2}))?)?\s*$")
+
+# number of seconds in each time unit
+_TIME_UNITS_SECONDS = {
+    "microseconds": 1.e-6, "microsecond": 1.e-6,
+    "milliseconds": 1.e-3, "millisecond": 1.e-3, "msec": 1.e-3,
+    "seconds": 1.0, "second": 1.0, "secs": 1.0, "sec": 1.0, "s": 1.0,
+    "minutes": 60.0, "minute": 60.0, "mins": 60.0, "min": 60.0,
+    "hours": 3600.0, "hour": 3600.0, "hrs": 3600.0, "hr": 3600.0, "h": 3600.0,
+    "days": 86400.0, "day": 86400.0, "d": 86400.0,
+}
+
+# calendars which are equivalent to the proleptic gregorian calendar
+# of python datetimes, for dates after 1582-10-15
+_GREGORIAN_CALENDARS = ("standard", "gregorian", "proleptic_gregorian")
+
+@lru_cache(maxsize=256)
+def get_time_conversion(units, calendar="standard"):
+    """Parse CF time units, returning an offset and scale which
+    convert a time value to a UTC timestamp.
+
+    The time in seconds since 1970-01-01 00:00 UTC of a value
+    in the given units is offset + value * scale.
+
+    Args:
+        units: A str, such as "seconds since 2012-10-01 00:00:00 00:00".
+        calendar: A str, value of the calendar attribute of the variable.
+
+    Returns:
+        A tuple of (offset, scale), or None if the units or calendar
+        are not supported, in which case netCDF4.num2date should
+        be used instead.
+    """
+
+    if calendar.lower() not in _GREGORIAN_CALENDARS:
+        return None
+
+    match = _TIME_UNITS_RE_PROG.match(units)
+    if not match:
+        return None
+
+    scale = _TIME_UNITS_SECONDS.get(match.group(1).lower())
+    if not scale:
+        return None
+
+    try:
+        year, month, day = [int(match.group(i)) for i in range(2, 5)]
+        hour = int(match.group(5) or 0)
+        minute = int(match.group(6) or 0)
+        second = float(match.group(7) or 0)
+        tzoff = int(match.group(9) or 0) * 3600 + int(match.group(10) or 0) * 60
+        if match.group(8) == '-':
+            tzoff = -tzoff
+
+        # standard and proleptic_gregorian calendars are not
+        # the same prior to the Gregorian reformation
+        if (year, month, day) < (1582, 10, 15):
+            return None
+
+        offset = datetime(
+            year, month, day, hour, minute,
+            tzinfo=timezone.utc).timestamp() + second - tzoff
+    except ValueError:
+        return None
+
+    return (offset, scale)
+
+class FileQuarantine(object):
+    """The NetCDF files which could not be opened, or which crashed
+    a reader process of a ReaderPool, so that they are skipped
+    until they are modified, rather than being tried again on every
+    request which includes them.
+
+    The files are kept with their status from get_file_status()
+    before the failure. A quarantined file is released when its
+    status changes, as when a file which was being written is
+    completed, or when it is released with the list_quarantine
+    management command.
+
+    If configured with the path of an SQLite database, the quarantine
+    is shared by the server processes. Otherwise each process has
+    its own, in memory.
+
+    A summary of the quarantine is logged every SUMMARY_INTERVAL
+    seconds in which reads are skipped.
+
+    Attributes:
+        path: Path of the SQLite database, or None.
+        local: threading.local holding the connection of each thread
+            to the database, as conn, and the pid which opened it.
+        entries: dict of (status, error, time) tuples by file path,
+            the in-memory quarantine used in place of the database
+            if path is None.
+        skipped: Number of reads skipped since the last summary.
+        summary_time: Time of the last summary.
+        lock: Mutex for entries and the counters.
+    """
+
+    __quarantine = None
+
+    __quarantine_lock = threading.Lock()
+
+    SUMMARY_INTERVAL = 3600
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS files ("
+        "path TEXT PRIMARY KEY, ino INTEGER, mtime_ns INTEGER, "
+        "size INTEGER, error TEXT, time REAL)",
+    )
+
+    def __init__(self, path):
+        """Construct a FileQuarantine.
+
+        Args:
+            path: Path of the SQLite database, which is created
+                if necessary, or None.
+        """
+        self.path = path
+        self.entries = {}
+        self.skipped = 0
+        self.summary_time = time.time()
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    @staticmethod
+    def configure(path):
+        """Set the database of the quarantine used by all processes.
+
+        Args:
+            path: Path of the SQLite database. If None, each process
+                keeps its own quarantine.
+        """
+        with FileQuarantine.__quarantine_lock:
+            FileQuarantine.__quarantine = FileQuarantine(path)
+
+    @staticmethod
+    def get():
+        """Return the configured FileQuarantine."""
+        with FileQuarantine.__quarantine_lock:
+            if not FileQuarantine.__quarantine:
+                FileQuarantine.__quarantine = FileQuarantine(None)
+            return FileQuarantine.__quarantine
+
+    def connection(self):
+        """Return a connection to the database for this thread.
+
+        sqlite3 connections should not be shared between
+        threads, or used in a child process after a fork.
+        """
+        conn = getattr(self.local, 'conn', None)
+        if conn is None or self.local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=60)
+            conn.execute("PRAGMA journal_mode=WAL")
+            with conn:
+                for sql in FileQuarantine.SCHEMA:
+                    conn.execute(sql)
+            self.local.conn = conn
+            self.local.pid = os.getpid()
+        return conn
+
+    def get_entry(self, ncpath):
+        """Return the (status, error, time) of a quarantined file,
+        or None.
+
+        Raises:
+            sqlite3.Error
+        """
+        if not self.path:
+            with self.lock:
+                return self.entries.get(ncpath)
+
+        row = self.connection().execute(
+            "SELECT ino, mtime_ns, size, error, time FROM files "
+            "WHERE path = ?", (ncpath,)).fetchone()
+        if not row:
+            return None
+        return (None if row[0] is None else tuple(row[0:3]), row[3], row[4])
+
+    def is_quarantined(self, ncpath, status):
+        """Return True if a file is quarantined, releasing it
+        if it has changed.
+
+        Args:
+            ncpath: Path of the file.
+            status: Current status of the file, from get_file_status().
+        """
+        try:
+            entry = self.get_entry(ncpath)
+            if entry and entry[0] != status:
+                _logger.info("%s: modified, released from quarantine", ncpath)
+                self.release(ncpath)
+                entry = None
+        except sqlite3.Error as exc:
+            _logger.error("%s: %s", self.path, exc)
+            return False
+
+        if not entry:
+            return False
+
+        _logger.debug("%s: quarantined, not read: %s", ncpath, entry[1])
+        now = time.time()
+        with self.lock:
+            self.skipped += 1
+            if now < self.summary_time + FileQuarantine.SUMMARY_INTERVAL:
+                return True
+            skipped = self.skipped
+            self.skipped = 0
+            self.summary_time = now
+        self.log_summary(skipped)
+        return True
+
+    def add(self, ncpath, status, error):
+        """Quarantine a file.
+
+        Args:
+            ncpath: Path of the file.
+            status: Status of the file from get_file_status(),
+                before it was read.
+            error: The exception, or a str description of the failure.
+        """
+        _logger.error("%s: %s, quarantined until modified", ncpath, error)
+        entry = (status, str(error), time.time())
+        if not self.path:
+            with self.lock:
+                self.entries[ncpath] = entry
+            return
+
+        fstat = status or (None, None, None)
+        try:
+            conn = self.connection()
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)",
+                    (ncpath,) + tuple(fstat) + entry[1:])
+        except sqlite3.Error as exc:
+            _logger.error("%s: %s", self.path, exc)
+
+    def release(self, ncpath=None):
+        """Release a file from the quarantine, or all files if
+        ncpath is None.
+
+        Raises:
+            sqlite3.Error
+        """
+        if not self.path:
+            with self.lock:
+                if ncpath is None:
+                    self.entries.clear()
+                else:
+                    self.entries.pop(ncpath, None)
+            return
+
+        conn = self.connection()
+        with conn:
+            if ncpath is None:
+                conn.execute("DELETE FROM files")
+            else:
+                conn.execute("DELETE FROM files WHERE path = ?", (ncpath,))
+
+    def get_files(self):
+        """Return a list of the (path, error, time) of the quarantined
+        files, sorted by path.
+
+        Raises:
+            sqlite3.Error
+        """
+        if not self.path:
+            with self.lock:
+                return sorted(
+                    (ncpath, entry[1], entry[2])
+                    for (ncpath, entry) in self.entries.items())
+
+        return self.connection().execute(
+            "SELECT path, error, time FROM files ORDER BY path").fetchall()
+
+    def log_summary(self, skipped):
+        """Log the number of quarantined files, and of skipped reads."""
+        try:
+            files = self.get_files()
+        except sqlite3.Error as exc:
+            _logger.error("%s: %s", self.path, exc)
+            return
+        _logger.warning(
+            "%d NetCDF files quarantined, %d reads skipped in the last "
+            "%d minutes, first: %s", len(files), skipped,
+            FileQuarantine.SUMMARY_INTERVAL // 60,
+            files[0][0] if files else None)
+
+class FilePool(object):
+    """A pool of open netCDF4.Datasets of a server process, so that
+    files which are read repeatedly, such as the newest file of a
+    real-time dataset polled by clients, are not opened, and their
+    headers parsed, on every read.
+
+    A file is checked out of the pool while it is in use, since
+    a netCDF4.Dataset can't be shared between threads. When it is
+    returned, it is kept with the inode, modification time and size
+    the file had before it was opened, and when it is checked out
+    again it is re-opened if any of them have changed, as when
+    records are appended. The least recently used are closed
+    when more than max_open are kept.
+
+    HDF5 locks the files it opens, so that a process writing a
+    NetCDF4 file, such as a data acquisition system appending to the
+    newest file of a real-time dataset, can't open it while it is
+    open for reading. NetCDF4 files are therefore only kept open if
+    HDF5 file locking is disabled, with HDF5_USE_FILE_LOCKING=FALSE
+    in the environment.
+
+    Open files are not shared with child processes, so each
+    process creates its own pool.
+
+    Attributes:
+        pid: Id of the process which created the pool.
+        files: nc_cache.LRUCache of (netCDF4.Dataset, file status)
+            tuples by path.
+        checked_out: dict of (path, file status) tuples of the files
+            in use, by id of their netCDF4.Dataset.
+        lock: Mutex for checked_out.
+    """
+
+    __pool = None
+    __max_open = 0
+    __pool_lock = threading.Lock()
+
+    # whether HDF5, the format of NetCDF4 files, locks the files
+    HDF5_FILE_LOCKING = \
+        os.environ.get('HDF5_USE_FILE_LOCKING', '').upper() != 'FALSE'
+
+    def __init__(self, max_open):
+        """Construct a FilePool.
+
+        Args:
+            max_open: The maximum number of files kept open.
+        """
+        self.pid = os.getpid()
+        self.files = nc_cache.LRUCache(
+            'netcdf_files', max_entries=max_open,
+            sizeof=lambda entry: 0, on_evict=FilePool.close_entry)
+        self.checked_out = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def configure(max_open):
+        """Set the maximum number of NetCDF files kept open
+        by each process.
+
+        Args:
+            max_open: If 0, files are closed after every use.
+        """
+        with FilePool.__pool_lock:
+            FilePool.__max_open = max_open or 0
+            pool = FilePool.__pool
+            FilePool.__pool = None
+        if pool and pool.pid == os.getpid():
+            # files which are checked out are closed by close_file()
+            pool.files.clear()
+
+    @staticmethod
+    def get():
+        """Return the FilePool of this process, or None if
+        files are not kept open."""
+        with FilePool.__pool_lock:
+            if FilePool.__max_open <= 0:
+                return None
+            pool = FilePool.__pool
+            if not pool or pool.pid != os.getpid():
+                pool = FilePool(FilePool.__max_open)
+                FilePool.__pool = pool
+            return pool
+
+    @staticmethod
+    def open_file(ncpath):
+        """Open a NetCDF file for reading, from the pool of this
+        process if there is one. The file must be returned with
+        close_file().
+
+        Args:
+            ncpath: Path name of the file.
+
+        Returns:
+            An opened netCDF4.Dataset.
+
+        Raises:
+            OSError
+            RuntimeError
+        """
+        pool = FilePool.get()
+        if not pool:
+            return netCDF4.Dataset(ncpath)
+        return pool.checkout(ncpath)
+
+    @staticmethod
+    def close_file(ncfile):
+        """Return a NetCDF file opened with open_file() to the pool
+        it came from, or close it."""
+        pool = FilePool.get()
+        if not pool or not pool.checkin(ncfile):
+            ncfile.close()
+
+    @staticmethod
+    def close_entry(entry):
+        """Close the netCDF4.Dataset of an entry in FilePool.files."""
+        if entry:
+            try:
+                entry[0].close()
+            except (OSError, RuntimeError) as exc:
+                _logger.warning("close: %s", exc)
+
+    def checkout(self, ncpath):
+        """Remove a file from the pool, or open it, if it isn't in
+        the pool or has been modified since it was opened.
+
+        Raises:
+            OSError
+            RuntimeError
+        """
+        fstat = get_file_status(ncpath)
+
+        entry = self.files.pop(ncpath)
+        if entry and fstat and entry[1] == fstat:
+            ncfile = entry[0]
+        else:
+            FilePool.close_entry(entry)
+            ncfile = netCDF4.Dataset(ncpath)
+
+        with self.lock:
+            self.checked_out[id(ncfile)] = (ncpath, fstat)
+        return ncfile
+
+    def checkin(self, ncfile):
+        """Return a file to the pool.
+
+        Returns:
+            False if the file is not checked out from this pool,
+            or can't be kept open, in which case it should be closed.
+        """
+        with self.lock:
+            try:
+                (ncpath, fstat) = self.checked_out.pop(id(ncfile))
+            except KeyError:
+                return False
+        if not fstat:
+            return False
+        if FilePool.HDF5_FILE_LOCKING and \
+                not ncfile.data_model.startswith('NETCDF3'):
+            return False
+        # a file of the same path, checked in by another thread,
+        # is closed by on_evict
+        self.files.put(ncpath, (ncfile, fstat))
+        return True
+
+class ReaderPool(object):
+    """A pool of processes which read NetCDF files for the server
+    processes.
+
+    A corrupt or truncated file can abort the process reading it from
+    within the NetCDF or HDF5 C libraries, rather than raising an
+    exception. With a pool, that only kills a reader process, which
+    is replaced, and the file is put in the FileQuarantine.
+    The NetCDF and HDF5 libraries are also not thread-safe, and
+    with a pool the files of a request are read in parallel,
+    on several cores.
+
+    The reader processes are started by a forkserver, rather than
+    forked from a server process, which may have other threads.
+    They return the data they read through shared memory.
+
+    Attributes:
+        max_processes: The maximum number of reader processes.
+        pid: Id of the process which created the pool.
+        executor: A concurrent.futures.ProcessPoolExecutor.
+        lock: Mutex for executor.
+        retry_lock: Mutex serializing the retries of calls in progress
+            when a reader process died.
+    """
+
+    __pool = None
+    __max_processes = 0
+    __pool_lock = threading.Lock()
+
+    def __init__(self, max_processes):
+        """Construct a ReaderPool.
+
+        Args:
+            max_processes: The maximum number of reader processes.
+        """
+        self.max_processes = max_processes
+        self.pid = os.getpid()
+        self.lock = threading.Lock()
+        self.retry_lock = threading.Lock()
+        self.executor = self.create_executor()
+
+    def create_executor(self, max_processes=None):
+        """Create a concurrent.futures.ProcessPoolExecutor.
+
+        Args:
+            max_processes: Number of processes, if not max_processes
+                of this pool.
+        """
+        return concurrent.futures.ProcessPoolExecutor(
+            max_workers=max_processes or self.max_processes,
+            mp_context=multiprocessing.get_context('forkserver'))
+
+    @staticmethod
+    def configure(max_processes):
+        """Set the number of reader processes of each server process.
+
+        Args:
+            max_processes: If 0, files are read by the server processes.
+        """
+        with ReaderPool.__pool_lock:
+            ReaderPool.__max_processes = max_processes or 0
+            pool = ReaderPool.__pool
+            ReaderPool.__pool = None
+        if pool and pool.pid == os.getpid():
+            pool.executor.shutdown(wait=False)
+
+    @staticmethod
+    def get():
+        """Return the ReaderPool of this process, or None if files
+        are read by the server process."""
+        with ReaderPool.__pool_lock:
+            if ReaderPool.__max_processes <= 0:
+                return None
+            pool = ReaderPool.__pool
+            if not pool or pool.pid != os.getpid():
+                pool = ReaderPool(ReaderPool.__max_processes)
+                ReaderPool.__pool = pool
+            return pool
+
+    def submit(self, func, args):
+        """Submit a call to a reader process, replacing the
+        executor if it is broken.
+
+        Returns:
+            A tuple of the concurrent.futures.Future and the executor.
+        """
+        with self.lock:
+            executor = self.executor
+        try:
+            return (executor.submit(func, *args), executor)
+        except concurrent.futures.process.BrokenProcessPool:
+            self.replace(executor)
+            with self.lock:
+                executor = self.executor
+            return (executor.submit(func, *args), executor)
+
+    def replace(self, executor):
+        """Replace a broken executor, unless it has been already."""
+        with self.lock:
+            if self.executor is not executor:
+                return
+            self.executor = self.create_executor()
+        executor.shutdown(wait=False)
+
+    def run(self, tasks):
+        """Run calls in the reader processes.
+
+        If a reader process dies, all the calls in progress in the
+        executor fail, from this and other threads. They are then
+        re-run one at a time, each alone in a new reader process, see
+        retry(), and a file whose call kills that reader is quarantined,
+        as is a file whose call raises nc_exc.UnreadableFileException.
+
+        Args:
+            tasks: A list of (ncpath, func, args) tuples, of the
+                NetCDF file read by each call of func(*args).
+                Files which are quarantined are not read.
+
+        Returns:
+            A list of the return values of the calls, or None for
+            calls which failed, in which case an error has been logged.
+
+        Raises:
+            nc_exc.TooMuchDataException from a call.
+        """
+        quarantine = FileQuarantine.get()
+        results = [None] * len(tasks)
+        statuses = [None] * len(tasks)
+        futures = []
+        for (itask, (ncpath, func, args)) in enumerate(tasks):
+            statuses[itask] = get_file_status(ncpath)
+            if quarantine.is_quarantined(ncpath, statuses[itask]):
+                continue
+            futures.append((itask, self.submit(func, args)))
+
+        crashed = []
+        for (itask, (future, executor)) in futures:
+            try:
+                results[itask] = future.result()
+            except concurrent.futures.process.BrokenProcessPool:
+                self.replace(executor)
+                crashed.append(itask)
+            except nc_exc.TooMuchDataException:
+                raise
+            except nc_exc.UnreadableFileException as exc:
+                quarantine.add(tasks[itask][0], statuses[itask], exc)
+            except Exception as exc:    # pylint: disable=broad-except
+                _logger.error("%s: %s", tasks[itask][0], exc)
+
+        for itask in crashed:
+            (ncpath, func, args) = tasks[itask]
+            try:
+                results[itask] = self.retry(func, args)
+            except concurrent.futures.process.BrokenProcessPool:
+                quarantine.add(
+                    ncpath, statuses[itask], "crashed a reader process")
+            except nc_exc.UnreadableFileException as exc:
+                quarantine.add(ncpath, statuses[itask], exc)
+            except Exception as exc:    # pylint: disable=broad-except
+                _logger.error("%s: %s", ncpath, exc)
+
+        return results
+
+    def retry(self, func, args):
+        """Re-run a call which was in progress when a reader process
+        died, in a new process of its own, so that if it dies again
+        the call was the cause, not another which ran with it.
+        Retries are run one at a time.
+
+        Returns:
+            The return value of func(*args).
+
+        Raises:
+            concurrent.futures.process.BrokenProcessPool if the call
+                kills the process.
+            Exceptions raised by the call.
+        """
+        with self.retry_lock:
+            executor = self.create_executor(1)
+            try:
+                return executor.submit(func, *args).result()
+            finally:
+                executor.shutdown(wait=False)
+
+    @staticmethod
+    def open_reader_file(ncpath):
+        """Open a NetCDF file in a reader process.
+
+        Raises:
+            nc_exc.UnreadableFileException
+        """
+        try:
+            return netCDF4.Dataset(ncpath)
+        except (OSError, RuntimeError) as exc:
+            raise nc_exc.UnreadableFileException(str(exc))
+
+    @staticmethod
+    def open_task(ncpath):
+        """Open and close a NetCDF file, in a reader process.
+
+        Returns:
+            True
+        """
+        ReaderPool.open_reader_file(ncpath).close()
+        return True
+
+    @staticmethod
+    def read_header_task(dspath, ncpath, time_name, time_names):
+        """Read the header and times of a NetCDF file for
+        NetCDFDataset.scan_files(), in a reader process.
+
+        Args:
+            dspath: path of the NetCDFDataset.
+            See NetCDFDataset.read_file_header() for the others.
+
+        Returns:
+            The dict returned by NetCDFDataset.read_file_header().
+        """
+        ncset = NetCDFDataset(
+            dspath, datetime.min.replace(tzinfo=timezone.utc),
+            datetime.max.replace(tzinfo=timezone.utc))
+        ncfile = ReaderPool.open_reader_file(ncpath)
+        try:
+            return ncset.read_file_header(
+                ncfile, ncpath, time_name, time_names)
+        finally:
+            ncfile.close()
+
+    @staticmethod
+    def read_times_task(dspath, dsinfo, ncpath, start_time, end_time, size_limit,
+                        mtime):
+        """Read the times of a NetCDF file, in a reader process.
+
+        Args:
+            dspath: path of the NetCDFDataset.
+            dsinfo: The dict of dataset info, with only the FileExtent
+                of ncpath.
+            See NetCDFDataset.read_times() for the others.
+
+        Returns:
+            A tuple of the time_slice and times from read_times(),
+            the new FileExtent of the file or None, and a list of the
+            names of the NetCDF variables in the file.
+        """
+        ncset = NetCDFDataset(dspath, start_time, end_time)
+        ncfile = ReaderPool.open_reader_file(ncpath)
+        try:
+            (time_slice, ftimes) = ncset.read_times(
+                ncfile, ncpath, start_time, end_time, size_limit,
+                mtime=mtime, dsinfo=dsinfo)
+            return (time_slice, ftimes, dsinfo['file_extents'].get(ncpath),
+                    list(ncfile.variables.keys()))
+        finally:
+            ncfile.close()
+
+    @staticmethod
+    def read_data_task(dspath, dsinfo, ncpath, time_slice, read_times,
+                       otime, odata, toffset, selectdim):
+        """Read the data of a NetCDF file into shared memory,
+        in a reader process.
+
+        Args:
+            dspath: path of the NetCDFDataset.
+            dsinfo: The dict of dataset info.
+            otime: A SharedArray of the times of the series.
+            odata: A dict of SharedArrays of the data of the series,
+                by variable name.
+            See NetCDFDataset.read_file_data() for the others.
+
+        Returns:
+            The value returned by NetCDFDataset.read_file_data().
+        """
+        ncset = NetCDFDataset(
+            dspath, datetime.min.replace(tzinfo=timezone.utc),
+            datetime.max.replace(tzinfo=timezone.utc))
+        shms = []
+        try:
+            otime = otime.attach(shms)
+            odata = {
+                exp_vname: sarr.attach(shms)
+                for (exp_vname, sarr) in odata.items()}
+            ncfile = ReaderPool.open_reader_file(ncpath)
+            try:
+                return ncset.read_file_data(
+                    ncfile, ncpath, dsinfo, time_slice, read_times,
+                    otime, odata, toffset, selectdim)
+            finally:
+                ncfile.close()
+        finally:
+            del otime, odata
+            for shm in shms:
+                try:
+                    shm.close()
+                except BufferError:
+                    # still referenced from a traceback
+                    pass
+
+class SharedArray(object):
+    """A numpy.ndarray in shared memory, which can be passed to
+    a reader process of a ReaderPool.
+
+    Attributes:
+        name: Name of the multiprocessing.shared_memory.SharedMemory.
+        shape: Shape of the array.
+        dtype: numpy.dtype of the array.
+        shm: The SharedMemory, in the process which created it.
+    """
+
+    def __init__(self, shape, dtype, fill_value):
+        """Create a shared array, filled with a value.
+
+        Raises:
+            OSError if the shared memory can't be allocated.
+        """
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        nbytes = reduce_(operator.mul, self.shape, 1) * self.dtype.itemsize
+        self.shm = multiprocessing.shared_memory.SharedMemory(
+            create=True, size=max(nbytes, 1))
+        self.name = self.shm.name
+        self.array()[...] = fill_value
+
+    def __getstate__(self):
+        return {'name': self.name, 'shape': self.shape, 'dtype': self.dtype,
+                'shm': None}
+
+    def array(self):
+        """Return the array, in the process which created it."""
+        return np.ndarray(self.shape, dtype=self.dtype, buffer=self.shm.buf)
+
+    def attach(self, shms):
+        """Return the array, in a reader process, appending the
+        SharedMemory to shms, to be closed when the array is released.
+        """
+        try:
+            shm = multiprocessing.shared_memory.SharedMemory(
+                name=self.name, track=False)
+        except TypeError:
+            # Before python 3.13 attaching also registers the memory
+            # with the resource tracker. The readers share the tracker
+            # of the server process, where it is already registered by
+            # the creator, so this does nothing, and the registration
+            # must be left for the creator to remove when it unlinks.
+            shm = multiprocessing.shared_memory.SharedMemory(name=self.name)
+        shms.append(shm)
+        return np.ndarray(self.shape, dtype=self.dtype, buffer=shm.buf)
+
+    def release(self):
+        """Return the array, and unlink the shared memory, which stays
+        mapped, without a copy, until the array is freed.
+        """
+        arr = self.array()
+        shm = self.shm
+        self.shm = None
+        shm.unlink()
+        # The SharedMemory is closed, unmapping it, when arr is freed.
+        weakref.finalize(arr, shm.close)
+        return arr
+
+class DatasetInfoStore(object):
+    """A directory of the cached info of NetCDFDatasets, shared
+    by the server processes.
+
+    Without a store, each process must open the headers of the
+    files of a dataset to assemble its variables the first time
+    the dataset is used, after every restart. With a store, a
+    process loads the info saved by another, including the
+    modification times of the files it was assembled from, and
+    only reads the files which have been modified since.
+
+    The info of each dataset is pickled to a file named by the
+    NetCDFDataset.cache_hash, which is replaced atomically when
+    the info changes.
+
+    Attributes:
+        path: Path of the directory.
+    """
+
+    __store = None
+
+    __store_lock = threading.Lock()
+
+    # version of the format of the files
+    VERSION = 5
+
+    def __init__(self, path):
+        """Construct a DatasetInfoStore.
+
+        Args:
+            path: Path of the directory, which is created
+                if necessary.
+        """
+        self.path = path
+
+    @staticmethod
+    def configure(path):
+        """Set the directory of the store used by all NetCDFDatasets.
+
+        Args:
+            path: Path of the directory. If None, a store is not used.
+        """
+        with DatasetInfoStore.__store_lock:
+            if path:
+                DatasetInfoStore.__store = DatasetInfoStore(path)
+            else:
+                DatasetInfoStore.__store = None
+
+    @staticmethod
+    def get():
+        """Return the configured DatasetInfoStore, or None."""
+        with DatasetInfoStore.__store_lock:
+            return DatasetInfoStore.__store
+
+    def get_filename(self, key):
+        """Return the path of the file of a cache_hash."""
+        return os.path.join(self.path, key.hex() + ".pickle")
+
+    def load(self, key, path):
+        """Load the info of a dataset.
+
+        Args:
+            key: The cache_hash of the NetCDFDataset.
+            path: The path of the NetCDFDataset, which is checked
+                against that in the file.
+
+        Returns:
+            The dict of the dataset info, or None if it isn't in the
+            store or can't be read.
+        """
+        try:
+            with open(self.get_filename(key), 'rb') as pfile:
+                # The version is checked before unpickling the info,
+                # whose classes may have changed.
+                header = pickle.load(pfile)
+                if not isinstance(header, dict) or \
+                        header.get('version') != DatasetInfoStore.VERSION or \
+                        header.get('path') != path:
+                    return None
+                return pickle.load(pfile)
+        except FileNotFoundError:
+            return None
+        except (OSError, EOFError, pickle.UnpicklingError,
+                AttributeError, ImportError, TypeError, ValueError) as exc:
+            _logger.warning("%s: %s", self.get_filename(key), exc)
+            return None
+
+    def save(self, key, path, dsinfo):
+        """Save the info of a dataset, replacing any previous version.
+
+        Args:
+            key: The cache_hash of the NetCDFDataset.
+            path: The path of the NetCDFDataset.
+            dsinfo: The dict of the dataset info.
+        """
+        tmpname = None
+        try:
+            os.makedirs(self.path, exist_ok=True)
+            (tmpfd, tmpname) = tempfile.mkstemp(
+                dir=self.path, prefix=".tmp", suffix=".pickle")
+            with os.fdopen(tmpfd, 'wb') as pfile:
+                pickle.dump(
+                    {'version': DatasetInfoStore.VERSION, 'path': path},
+                    pfile, protocol=pickle.HIGHEST_PROTOCOL)
+                pickle.dump(dsinfo, pfile, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmpname, self.get_filename(key))
+            tmpname = None
+        except (OSError, pickle.PicklingError) as exc:
+            _logger.warning("%s: %s", self.path, exc)
+        finally:
+            if tmpname:
+                try:
+                    os.unlink(tmpname)
+                except OSError:
+                    pass
+
 class NetCDFDataset(object):
     """A dataset consisting of NetCDF files, within a period of time.
 
@@ -135,24 +1112,62 @@ class NetCDFDataset(object):
         sites: dictionary of site long_name names by the site short names
             for every site short name found in variable names
             without a station dimension
+        generation: int, incremented whenever a scan of the files
+            changes any of the above.
+        file_extents: dict of FileExtents by file path, of the files
+            whose times have been read.
+        variable_bits: dict of the bit numbers in FileExtent.variables,
+            by NetCDF variable name.
+
+    A dataset whose end_time had passed by ARCHIVE_DELAY when it was
+    scanned is archival, and its files are not scanned again. Those
+    of other datasets, typically real-time, are re-checked at most
+    every metadata_ttl seconds, and then only the newest files,
+    starting with the last one scanned.
     """
     # pylint thinks this class is too big.
     # pylint: disable=too-many-instance-attributes
 
     MAX_NUM_FILES_TO_PRESCAN = 50
 
-    __cache_lock = threading.Lock()
+    # seconds after its end_time that a dataset is considered archival
+    ARCHIVE_DELAY = 86400
+
+    # reads in progress by all NetCDFDatasets
+    __reads = nc_cache.SingleFlight('netcdf_reads')
+
+    # seconds between checks for modified files of real-time datasets
+    __metadata_ttl = 60
+
+    # keys of the dataset info, whose changes increment its generation
+    METADATA_KEYS = (
+        'base_time', 'time_dim_name', 'time_name', 'nstations',
+        'station_dim', 'station_names', 'has_station_variables',
+        'sites', 'variables')
+
+    # keys of the dicts of the dataset info which are modified in
+    # place, and so are copied by get_dataset_info()
+    MODIFIED_KEYS = ('file_mod_times', 'file_extents', 'variable_bits')
 
-    # dictionary of attributes of a NetCDFDataset.
-    __cached_dataset_info = {}
+    # attributes of NetCDFDatasets, by cache_hash
+    __cached_dataset_info = nc_cache.LRUCache(
+        'dataset_info', max_entries=500, max_bytes=100 * 1000 * 1000)
 
-    def __init__(self, path, start_time, end_time):
+    def __init__(self, path, start_time, end_time, pyramid_dir=None):
         """Constructs NetCDFDataset with a path to a filesetFileset.
 
+        Args:
+            path: directory path and file name format.
+            start_time: start time of the dataset.
+            end_time: end time of the dataset.
+            pyramid_dir: directory of a nc_pyramid.Pyramid of aggregates
+                of this dataset, which is used if it has been built.
+
         Raises:
             none
         """
         self.path = path
+        self.pyramid_dir = pyramid_dir
         self.fileset = nc_fileset.Fileset.get(path)
         self.start_time = start_time
         self.end_time = end_time
@@ -164,12 +1179,59 @@ class NetCDFDataset(object):
 
         self.cache_hash = hasher.digest()
 
+    @staticmethod
+    def configure(metadata_ttl):
+        """Set the freshness policy of the dataset info.
+
+        Args:
+            metadata_ttl: Seconds after a scan of the files of a
+                real-time dataset before they are checked again for
+                modifications. If 0, they are checked on every call
+                of scan_files().
+        """
+        NetCDFDataset.__metadata_ttl = metadata_ttl
+
+    def is_current(self, dsinfo, now=None):
+        """Return True if the files of this dataset need not be
+        scanned again.
+
+        Args:
+            dsinfo: The dict of dataset info.
+            now: Current time, in seconds since the epoch.
+        """
+        if dsinfo['archival']:
+            return True
+        if dsinfo['scan_time'] is None:
+            return False
+        if now is None:
+            now = time.time()
+        return now - dsinfo['scan_time'] < NetCDFDataset.__metadata_ttl
+
     def get_dataset_info(self):
         """Fetch a copy of the cache of info for this dataset.
+
+        The dicts of MODIFIED_KEYS are also copied, so the cached
+        info is never modified, and can be read by other threads.
+        Modifications of the copy are cached by save_dataset_info().
+
+        If it is not cached in this process, it is loaded
+        from the DatasetInfoStore, if one is configured.
         """
-        with NetCDFDataset.__cache_lock:
-            if self.cache_hash in NetCDFDataset.__cached_dataset_info:
-                return NetCDFDataset.__cached_dataset_info[self.cache_hash].copy()
+        dsinfo = NetCDFDataset.__cached_dataset_info.get(self.cache_hash)
+        if dsinfo is None:
+            store = DatasetInfoStore.get()
+            if store:
+                dsinfo = store.load(self.cache_hash, self.path)
+                if dsinfo is not None:
+                    NetCDFDataset.__cached_dataset_info.put(
+                        self.cache_hash, dsinfo)
+
+        if dsinfo is not None:
+            dsinfo = dsinfo.copy()
+            for key in NetCDFDataset.MODIFIED_KEYS:
+                dsinfo[key] = dsinfo[key].copy()
+            return dsinfo
+
         dsinfo = {
             'file_mod_times': {},
             'base_time': None,
@@ -181,14 +1243,28 @@ class NetCDFDataset(object):
             'has_station_variables': False,
             'sites': {},
             'variables': {},
+            'generation': 0,
+            'scan_time': None,
+            'archival': False,
+            'last_file_time': None,
+            'file_extents': {},
+            'variable_bits': {},
         }
         return dsinfo
 
-    def save_dataset_info(self, dsinfo):
+    def save_dataset_info(self, dsinfo, modified=True):
         """Save a the info for this dataset.
+
+        Args:
+            dsinfo: The dict of dataset info, from get_dataset_info(),
+                which must not be modified after it is saved.
+            modified: If True, the info is also saved in the
+                DatasetInfoStore, if one is configured.
         """
-        with NetCDFDataset.__cache_lock:
-            NetCDFDataset.__cached_dataset_info[self.cache_hash] = dsinfo
+        NetCDFDataset.__cached_dataset_info.put(self.cache_hash, dsinfo)
+        store = DatasetInfoStore.get()
+        if store and modified:
+            store.save(self.cache_hash, self.path, dsinfo)
 
     def __str__(self):
         return "NetCDFDataset, path=" + str(self.path)
@@ -228,9 +1304,42 @@ class NetCDFDataset(object):
         """
         return [f.path for f in self.get_files(start_time, end_time)]
 
+    @staticmethod
+    def open_file(ncpath):
+        """Open a NetCDF file for reading.
+
+        The file might be in the process of being written, moved,
+        deleted, etc. If the open fails, the file is put in the
+        FileQuarantine, and is not opened again until it changes.
+
+        Args:
+            ncpath: Path name of the file.
+
+        Returns:
+            An opened netCDF4.Dataset, or None if the open failed,
+            or the file is quarantined. It must be closed with
+            close_file().
+        """
+        quarantine = FileQuarantine.get()
+        status = get_file_status(ncpath)
+        if quarantine.is_quarantined(ncpath, status):
+            return None
+        try:
+            return FilePool.open_file(ncpath)
+        except (OSError, RuntimeError) as exc:
+            quarantine.add(ncpath, status, exc)
+        return None
+
+    @staticmethod
+    def close_file(ncfile):
+        """Close a NetCDF file opened with open_file(), which may
+        keep it open for the next read."""
+        FilePool.close_file(ncfile)
+
     def scan_files(
             self,
-            time_names=('time', 'Time', 'time_offset')):
+            time_names=('time', 'Time', 'time_offset'),
+            force=False):
         """ Scan the set of files, accumulating information about the dataset in a dict,
         with the following keys:
             file_mod_times: dictionary of file modification times by file name, of each
@@ -245,10 +1354,24 @@ class NetCDFDataset(object):
                 names extracted from the exported names
                 of those variables not associated with a numbered station
             variables: dictionary of information for each variable.
+            generation: incremented when a scan changes any of the above.
+            scan_time: time of the last scan, in seconds since the epoch.
+            archival: True if the end_time of the dataset had passed
+                by ARCHIVE_DELAY at the last scan.
+            last_file_time: datetime of the newest file scanned.
+            file_extents: FileExtents of the files, by path. Those of
+                the files which are scanned are updated, others are
+                added as the files are read by read_time_series().
+            variable_bits: bit numbers of the NetCDF variables in
+                the FileExtents.
 
         If an element in file_mod_times exists for a file, that file is not scanned if
         its current modification time has not been updated.
 
+        Nothing is done unless force is True or the info is not
+        current, see is_current(). After the first scan, only the files
+        from last_file_time onward are checked.
+
         The names of the variables in the dataset are converted to an exported
         form. If a variable has a 'short_name' attribute, it is used for the
         variable name, otherwise the exported name is set to the NetCDF variable
@@ -259,6 +1382,7 @@ class NetCDFDataset(object):
 
         Args:
             time_names: List of allowed names for time variable.
+            force: If True, scan the files even if the info is current.
 
         Raises:
             OSError
@@ -267,20 +1391,29 @@ class NetCDFDataset(object):
 
         dsinfo = self.get_dataset_info()
 
-        # Note: dsinfo_vars is a reference. Modificatons to it
-        # are also modifications to dsinfo.
-        dsinfo_vars = dsinfo['variables']
+        now = time.time()
+        if not force and self.is_current(dsinfo, now):
+            return
 
-        sitedict = dsinfo['sites']
-
-        files = self.get_files(
-            start_time=self.start_time,
-            end_time=self.end_time)
+        # The metadata are modified in place, so they are replaced
+        # by copies, and the cached originals kept for comparison.
+        prev_metadata = {
+            key: dsinfo[key] for key in NetCDFDataset.METADATA_KEYS}
+        dsinfo.update(copy.deepcopy(prev_metadata))
 
         # typically get_files() also returns the file before start_time
         # We may want that in reading a period of data, but not
         # in assembling the variables for the dataset
-        filepaths = [f.path for f in files if f.time >= self.start_time and f.time < self.end_time]
+        files = []
+        if dsinfo['last_file_time'] and not force:
+            # earlier files have been scanned
+            scan_start = max(self.start_time, dsinfo['last_file_time'])
+            files = [f for f in self.get_files(scan_start, self.end_time)
+                     if f.time >= scan_start and f.time < self.end_time]
+        if not files:
+            files = [f for f in self.get_files(self.start_time, self.end_time)
+                     if f.time >= self.start_time and f.time < self.end_time]
+        filepaths = [f.path for f in files]
 
         skip = 1
         if len(filepaths) > NetCDFDataset.MAX_NUM_FILES_TO_PRESCAN:
@@ -292,274 +1425,374 @@ class NetCDFDataset(object):
 
         n_files_read = 0
 
+        # files whose headers are read, with their modification times
+        scans = []
+
         while pindex >= 0:
             ncpath = filepaths[int(pindex)]
             pindex -= skip
 
-            # The files might be in the process of being moved, deleted, etc,
-            # so if we get an exception in this open, try a few more times.
+            try:
+                curr_mod_time = get_file_modtime(ncpath)
+            except OSError:
+                continue
+            if ncpath in dsinfo['file_mod_times']:
+                prev_mod_time = dsinfo['file_mod_times'][ncpath]
+                if curr_mod_time <= prev_mod_time:
+                    n_files_read += 1
+                    continue
+            dsinfo['file_mod_times'][ncpath] = curr_mod_time
+            scans.append((ncpath, curr_mod_time))
+
+        # The files might be in the process of being written, moved,
+        # deleted, etc. A file which can't be opened is quarantined,
+        # and not tried again until it changes.
+
+        # Testing indicates that with a truncated file (artificially
+        # truncated with dd), the underlying C code will cause a crash
+        # of python from an assert() rather than raising an exception
+        # that could be caught.
+
+        # If the netcdf library is compiled with -DNDEBUG, then the
+        # the open and parse of the truncated header succeeds, but
+        # still no exception.
+
+        # If the file is artificially corrupted by removing an
+        # initial portion of the file:
+        #   dd if=test.nc of=bad.nc bs=1014 count=100 skip=1
+        # then an exception is raised (this was with -DNDEBUG):
+        # RuntimeError bad.nc: NetCDF: Unknown file format
+
+        # With a ReaderPool, the headers and times of the files are
+        # read in parallel by its reader processes, so that such a
+        # file only kills a reader.
+        pool = ReaderPool.get()
+        if pool:
+            headers = pool.run([
+                (ncpath, ReaderPool.read_header_task, (
+                    self.path, ncpath, dsinfo['time_name'], time_names))
+                for (ncpath, _) in scans])
+        else:
+            headers = []
+            for (ncpath, _) in scans:
+                ncfile = self.open_file(ncpath)
+                if not ncfile:
+                    headers.append(None)
+                    continue
+                try:
+                    headers.append(self.read_file_header(
+                        ncfile, ncpath, dsinfo['time_name'], time_names))
+                finally:
+                    self.close_file(ncfile)
 
-            # Testing indicates that with a truncated file (artificially
-            # truncated with dd), the underlying C code will cause a crash
-            # of python from an assert() rather than raising an exception
-            # that could be caught.
+        # number of files whose headers were read, rather than skipped
+        n_files_scanned = 0
 
-            # If the netcdf library is compiled with -DNDEBUG, then the
-            # the open and parse of the truncated header succeeds, but
-            # still no exception.
+        for ((ncpath, curr_mod_time), header) in zip(scans, headers):
+            if header is None:
+                continue
+            n_files_read += 1
+            n_files_scanned += 1
+            self.merge_file_header(
+                dsinfo, ncpath, curr_mod_time, header, time_names)
 
-            # If the file is artificially corrupted by removing an
-            # initial portion of the file:
-            #   dd if=test.nc of=bad.nc bs=1014 count=100 skip=1
-            # then an exception is raised (this was with -DNDEBUG):
-            # RuntimeError bad.nc: NetCDF: Unknown file format
+        if not n_files_read:
+            msg = self.path + ": No files found"
+            raise nc_exc.NoDataException(msg)
 
-            # To make this robust, it would be good to run a king's
-            # taster process on each file first to reduce the possibility
-            # of a server death. The king's taster would not use NDEBUG,
-            # but perhaps the python server would.  Complicated.
+        # Remove the station names if no variables have a station dimension
+        if not dsinfo['has_station_variables']:
+            dsinfo['station_names'] = []
+        else:
+            # create station names if a "station" variable is not found
+            # in NetCDF files. Names are S1, S2, etc for dimension index 0, 1
+            if dsinfo['nstations'] and not dsinfo['station_names']:
+                dsinfo['station_names'].extend(\
+                    ['S{}'.format(i+1) for i in range(dsinfo['nstations'])])
 
-            fileok = False
-            skip_file = False
-            exc = None
+        if n_files_scanned and prev_metadata != \
+                {key: dsinfo[key] for key in NetCDFDataset.METADATA_KEYS}:
+            dsinfo['generation'] += 1
 
-            siteset = set()
-            site_sn = []
-            site_ln = []
+        archival = now >= \
+            self.end_time.timestamp() + NetCDFDataset.ARCHIVE_DELAY
+        modified = n_files_scanned > 0 or archival != dsinfo['archival']
+        dsinfo['scan_time'] = now
+        dsinfo['archival'] = archival
+        dsinfo['last_file_time'] = files[-1].time
 
-            for itry in range(0, 3):
-                try:
-                    curr_mod_time = get_file_modtime(ncpath)
-                    if ncpath in dsinfo['file_mod_times']:
-                        prev_mod_time = dsinfo['file_mod_times'][ncpath]
-                        if curr_mod_time <= prev_mod_time:
-                            skip_file = True
-                            fileok = True
-                            break
-                    dsinfo['file_mod_times'][ncpath] = curr_mod_time
-                    # _logger.debug("ncpath=%s",ncpath)
-                    ncfile = netCDF4.Dataset(ncpath)
-                    fileok = True
-                    break
-                except (OSError, RuntimeError) as excx:
-                    exc = excx
-                    time.sleep(itry)
+        # cache dsinfo
+        self.save_dataset_info(dsinfo, modified=modified)
 
-            if not fileok:
-                _logger.error("%s: %s", ncpath, exc)
-                continue
+    def read_file_header(self, ncfile, ncpath, time_name, time_names):
+        """Read what scan_files() needs from a NetCDF file: its
+        dimensions, variables and sites, and its times.
 
-            n_files_read += 1
+        Args:
+            ncfile: An opened netCFD4.Dataset.
+            ncpath: Path to the dataset, for log messages.
+            time_name: Name of the time variable of the dataset, or
+                None if not yet known, in which case the first of
+                time_names in the file is used to read its times.
+            time_names: List of allowed names for time variable.
 
-            if skip_file:
-                continue
+        Returns:
+            A dict, which can be passed between processes, for
+            merge_file_header().
+        """
+        header = {
+            'base_time': 'base_time' in ncfile.variables,
+            'time_dim_name': None,
+            'nstations': None,
+            'station_names': None,
+            'time_vars': {},
+            'time_name': None,
+            'times': None,
+            'variables': [],
+            'sites': [],
+            'site_long_names': [],
+            'nc_vnames': list(ncfile.variables.keys()),
+        }
 
-            try:
-                if not dsinfo['base_time'] and 'base_time' in ncfile.variables:
-                    dsinfo['base_time'] = 'base_time'
-
-                tdim = None
-                # look for a time dimension
-                for tname in ['time', 'Time']:
-                    if tname in ncfile.dimensions:
-                        tdim = ncfile.dimensions[tname]
-                        break
-                if not tdim:
-                    continue
+        tdim = None
+        # look for a time dimension
+        for tname in ['time', 'Time']:
+            if tname in ncfile.dimensions:
+                tdim = ncfile.dimensions[tname]
+                break
+        if not tdim:
+            return header
+        header['time_dim_name'] = tdim.name
+
+        if STATION_DIMENSION_NAME in ncfile.dimensions:
+            header['nstations'] = len(ncfile.dimensions[STATION_DIMENSION_NAME])
+            if STATION_DIMENSION_NAME in ncfile.variables:
+                header['station_names'] = []
+                var = ncfile.variables[STATION_DIMENSION_NAME]
+                if var.datatype == np.dtype('S1'):
+                    header['station_names'] = [
+                        str(netCDF4.chartostring(v)) for v in var]
+
+        # whether the possible time variables have the time dimension
+        for tname in list(time_names) + [time_name]:
+            if tname in ncfile.variables:
+                header['time_vars'][tname] = \
+                    tdim.name in ncfile.variables[tname].dimensions
+
+        if not time_name:
+            time_name = next(
+                (tname for tname in time_names
+                 if header['time_vars'].get(tname)), None)
+        if not header['time_vars'].get(time_name):
+            return header
+
+        header['time_name'] = time_name
+        header['times'] = self.read_file_times(
+            ncfile, ncpath,
+            {'base_time': 'base_time' if header['base_time'] else None,
+             'time_name': time_name})
+
+        # pylint: disable=no-member
+        for (nc_vname, var) in ncfile.variables.items():
+
+            if nc_vname == "site_long_name" and \
+                var.datatype == np.dtype('S1'):
+                header['site_long_names'] = [
+                    str(netCDF4.chartostring(v)) for v in var]
+
+            if nc_vname == "sites" and \
+                var.datatype == np.dtype('S1'):
+                header['sites'] = [str(netCDF4.chartostring(v)) for v in var]
+
+            header['variables'].append((
+                nc_vname, var.shape, var.dimensions, var.dtype,
+                {att: getattr(var, att)
+                 for att in ('short_name', 'units', 'long_name')
+                 if hasattr(var, att)}))
+
+        return header
+
+    def merge_file_header(self, dsinfo, ncpath, mtime, header, time_names):
+        """Merge the header of a file from read_file_header() into
+        the dataset info, checking that its variables are consistent
+        with those of the other files, and saving its FileExtent.
 
-                # check for tdim.is_unlimited?
-                if not dsinfo['time_dim_name']:
-                    dsinfo['time_dim_name'] = tdim.name
-
-                if STATION_DIMENSION_NAME in ncfile.dimensions:
-                    if dsinfo['nstations'] is None:
-                        dsinfo['nstations'] = len(ncfile.dimensions[STATION_DIMENSION_NAME])
-                        dsinfo['station_dim'] = STATION_DIMENSION_NAME
-                        if STATION_DIMENSION_NAME in ncfile.variables:
-                            dsinfo['station_names'] = []
-                            var = ncfile.variables[STATION_DIMENSION_NAME]
-                            if var.datatype == np.dtype('S1'):
-
-                                snms = [str(netCDF4.chartostring(v)) for v in var]
-                                dsinfo['station_names'].extend(snms)
-                    elif not dsinfo['nstations'] == \
-                            len(ncfile.dimensions[STATION_DIMENSION_NAME]):
-                        _logger.warning(
-                            "%s: station dimension (%d) is "
-                            "different than that of other files (%d)",
-                            ncpath,
-                            len(ncfile.dimensions[STATION_DIMENSION_NAME]),
-                            dsinfo['nstations'])
-
-
-                # look for a time variable
-                if not dsinfo['time_name']:
-                    for tname in time_names:
-                        if tname in ncfile.variables:
-                            if tdim.name in ncfile.variables[tname].dimensions:
-                                dsinfo['time_name'] = tname
-                                break
-
-                if not dsinfo['time_name'] or \
-                    not dsinfo['time_name'] in ncfile.variables:
-                    # time variable not yet found or not in this file
-                    continue
+        Args:
+            dsinfo: The dict of dataset info.
+            ncpath: Path to the file.
+            mtime: Modification time of the file, from before it
+                was read.
+            header: The dict returned by read_file_header().
+            time_names: List of allowed names for time variable.
+        """
 
-                if not tdim.name in ncfile.variables[dsinfo['time_name']].dimensions:
-                    # time variable in this file doesn't have a time dimension
-                    continue
+        # Note: dsinfo_vars is a reference. Modificatons to it
+        # are also modifications to dsinfo.
+        dsinfo_vars = dsinfo['variables']
+
+        sitedict = dsinfo['sites']
+
+        siteset = set()
+
+        if not dsinfo['base_time'] and header['base_time']:
+            dsinfo['base_time'] = 'base_time'
+
+        if not header['time_dim_name']:
+            return
+
+        # check for tdim.is_unlimited?
+        if not dsinfo['time_dim_name']:
+            dsinfo['time_dim_name'] = header['time_dim_name']
+
+        if header['nstations'] is not None:
+            if dsinfo['nstations'] is None:
+                dsinfo['nstations'] = header['nstations']
+                dsinfo['station_dim'] = STATION_DIMENSION_NAME
+                if header['station_names'] is not None:
+                    dsinfo['station_names'] = list(header['station_names'])
+            elif not dsinfo['nstations'] == header['nstations']:
+                _logger.warning(
+                    "%s: station dimension (%d) is "
+                    "different than that of other files (%d)",
+                    ncpath, header['nstations'], dsinfo['nstations'])
+
+        # look for a time variable
+        if not dsinfo['time_name']:
+            for tname in time_names:
+                if header['time_vars'].get(tname):
+                    dsinfo['time_name'] = tname
+                    break
+
+        if not dsinfo['time_name'] or \
+            not dsinfo['time_name'] in header['time_vars']:
+            # time variable not yet found or not in this file
+            return
+
+        if not header['time_vars'][dsinfo['time_name']]:
+            # time variable in this file doesn't have a time dimension
+            return
+
+        # the times were read from another time variable if the
+        # dataset's was found in another file since the read
+        if header['time_name'] == dsinfo['time_name']:
+            self.save_file_extent(
+                dsinfo, ncpath, mtime, header['times'], header['nc_vnames'])
+
+        for (nc_vname, shape, dimensions, dtype, atts) in header['variables']:
+
+            # looking for time series variables
+            if not dsinfo['time_dim_name'] in dimensions:
+                continue
 
-                # pylint: disable=no-member
-                for (nc_vname, var) in ncfile.variables.items():
-
-                    if nc_vname == "site_long_name" and \
-                        var.datatype == np.dtype('S1'):
-                        site_ln = [str(netCDF4.chartostring(v)) for v in var]
-
-                    if nc_vname == "sites" and \
-                        var.datatype == np.dtype('S1'):
-                        site_sn = [str(netCDF4.chartostring(v)) for v in var]
-
-                    # looking for time series variables
-                    if not dsinfo['time_dim_name'] in var.dimensions:
-                        continue
-
-                    # time variable
-                    if nc_vname == dsinfo['time_name']:
-                        continue
-
-                    # exported variable name
-                    if hasattr(var, 'short_name'):
-                        exp_vname = getattr(var, 'short_name')
-                    else:
-                        exp_vname = nc_vname
-
-                    # var.dimensions is a tuple of dimension names
-                    time_index = var.dimensions.index(dsinfo['time_dim_name'])
-
-                    # Check if we have found this variable in a earlier file
-                    if not exp_vname in dsinfo_vars:
-
-                        # New variable
-                        varinfo = {}
-                        varinfo['netcdf_name'] = nc_vname
-                        varinfo['shape'] = var.shape
-                        varinfo['dimnames'] = var.dimensions
-                        varinfo['dtype'] = var.dtype
-                        varinfo['time_index'] = time_index
-
-                        # Grab certain attributes
-                        for att in ['units', 'long_name']:
-                            if hasattr(var, att):
-                                varinfo[att] = getattr(var, att)
-
-                        # Set default units to ''
-                        if 'units' not in varinfo:
-                            varinfo['units'] = ''
-
-                        # For non-station variables, parse the name to
-                        # determine the possible site
-                        if not dsinfo['station_dim'] or \
-                            not dsinfo['station_dim'] in var.dimensions:
-                            site = get_isfs_site(exp_vname)
-                            if site:
-                                varinfo['site'] = site
-                                siteset.add(site)
-                                # dsinfo['sites'].add(site)
-                        else:
-                            dsinfo['has_station_variables'] = True
-
-                        dsinfo_vars[exp_vname] = varinfo
-                        continue
-
-                    varinfo = dsinfo_vars[exp_vname]
-
-                    # variable has been found in an earlier ncfile
-                    # check for consistancy across files
-                    if varinfo['shape'][1:] != var.shape[1:]:
-                        # the above check works even if either shape
-                        # has length 1
-                        if len(varinfo['shape']) != \
-                                len(var.shape):
-                            # changing number of dimensions, punt
-                            _logger.error(
-                                "%s: %s: number of "
-                                "dimensions is not consistent: %d and %d. "
-                                "Skipping this variable.",
-                                ncpath, nc_vname, len(var.shape),
-                                len(varinfo['shape']))
-                            del dsinfo_vars[exp_vname]
-                            continue
-                        # here we know that shapes have same length and
-                        # they must have len > 1. Allow final dimension
-                        # to change.
-                        ndim = len(var.shape)
-                        if (varinfo['shape'][1:(ndim-1)] !=
-                                var.shape[1:(ndim-1)]):
-                            _logger.error(
-                                "%s: %s: incompatible shapes: "
-                                "%s and %s. Skipping this variable.",
-                                ncpath, nc_vname, repr(var.shape),
-                                repr(varinfo['shape']))
-                            del dsinfo_vars[exp_vname]
-                            continue
-                        # set shape to max shape (leaving the problem
-                        # for later...)
-                        varinfo['shape'] = tuple(
-                            [max(i, j) for (i, j) in zip(
-                                varinfo['shape'], var.shape)])
-
-                    if varinfo['dtype'] != var.dtype:
-                        _logger.error(
-                            "%s: %s: type=%s is different than "
-                            "in other files",
-                            ncpath, nc_vname, repr(var.dtype))
-
-                    if varinfo['time_index'] != time_index:
-                        _logger.error(
-                            "%s: %s: time_index=%d is different than "
-                            "in other files. Skipping this variable.",
-                            ncpath, nc_vname, time_index)
-                        del dsinfo_vars[exp_vname]
-
-                    for att in ['units', 'long_name']:
-                        if hasattr(var, att) and att in varinfo:
-                            if getattr(var, att) != varinfo[att]:
-                                _logger.info(
-                                    "%s: %s: %s=%s is different than previous value=%s",
-                                    ncpath, nc_vname, att, getattr(var, att),
-                                    varinfo[att])
-                                varinfo[att] = getattr(var, att)
+            # time variable
+            if nc_vname == dsinfo['time_name']:
+                continue
 
-            finally:
-                for site in siteset:
-                    try:
-                        i = site_sn.index(site)
-                        if i < len(site_ln):
-                            sitedict[site] = site_ln[i]
-                    except ValueError:
-                        pass
+            # exported variable name
+            exp_vname = atts.get('short_name', nc_vname)
+
+            # dimensions is a tuple of dimension names
+            time_index = dimensions.index(dsinfo['time_dim_name'])
+
+            # Check if we have found this variable in a earlier file
+            if not exp_vname in dsinfo_vars:
+
+                # New variable
+                varinfo = {}
+                varinfo['netcdf_name'] = nc_vname
+                varinfo['shape'] = shape
+                varinfo['dimnames'] = dimensions
+                varinfo['dtype'] = dtype
+                varinfo['time_index'] = time_index
+
+                # Grab certain attributes
+                for att in ['units', 'long_name']:
+                    if att in atts:
+                        varinfo[att] = atts[att]
+
+                # Set default units to ''
+                if 'units' not in varinfo:
+                    varinfo['units'] = ''
+
+                # For non-station variables, parse the name to
+                # determine the possible site
+                if not dsinfo['station_dim'] or \
+                    not dsinfo['station_dim'] in dimensions:
+                    site = get_isfs_site(exp_vname)
+                    if site:
+                        varinfo['site'] = site
+                        siteset.add(site)
+                else:
+                    dsinfo['has_station_variables'] = True
 
-                    if site not in sitedict:
-                        sitedict[site] = ''
-                ncfile.close()
+                dsinfo_vars[exp_vname] = varinfo
+                continue
 
-        if not n_files_read:
-            msg = self.path + ": No files found"
-            raise nc_exc.NoDataException(msg)
+            varinfo = dsinfo_vars[exp_vname]
 
-        # Remove the station names if no variables have a station dimension
-        if not dsinfo['has_station_variables']:
-            dsinfo['station_names'] = []
-        else:
-            # create station names if a "station" variable is not found
-            # in NetCDF files. Names are S1, S2, etc for dimension index 0, 1
-            if dsinfo['nstations'] and not dsinfo['station_names']:
-                dsinfo['station_names'].extend(\
-                    ['S{}'.format(i+1) for i in range(dsinfo['nstations'])])
+            # variable has been found in an earlier ncfile
+            # check for consistancy across files
+            if varinfo['shape'][1:] != shape[1:]:
+                # the above check works even if either shape
+                # has length 1
+                if len(varinfo['shape']) != len(shape):
+                    # changing number of dimensions, punt
+                    _logger.error(
+                        "%s: %s: number of "
+                        "dimensions is not consistent: %d and %d. "
+                        "Skipping this variable.",
+                        ncpath, nc_vname, len(shape),
+                        len(varinfo['shape']))
+                    del dsinfo_vars[exp_vname]
+                    continue
+                # here we know that shapes have same length and
+                # they must have len > 1. Allow final dimension
+                # to change.
+                ndim = len(shape)
+                if varinfo['shape'][1:(ndim-1)] != shape[1:(ndim-1)]:
+                    _logger.error(
+                        "%s: %s: incompatible shapes: "
+                        "%s and %s. Skipping this variable.",
+                        ncpath, nc_vname, repr(shape),
+                        repr(varinfo['shape']))
+                    del dsinfo_vars[exp_vname]
+                    continue
+                # set shape to max shape (leaving the problem
+                # for later...)
+                varinfo['shape'] = tuple(
+                    [max(i, j) for (i, j) in zip(varinfo['shape'], shape)])
+
+            if varinfo['dtype'] != dtype:
+                _logger.error(
+                    "%s: %s: type=%s is different than "
+                    "in other files",
+                    ncpath, nc_vname, repr(dtype))
+
+            if varinfo['time_index'] != time_index:
+                _logger.error(
+                    "%s: %s: time_index=%d is different than "
+                    "in other files. Skipping this variable.",
+                    ncpath, nc_vname, time_index)
+                del dsinfo_vars[exp_vname]
+
+            for att in ['units', 'long_name']:
+                if att in atts and att in varinfo:
+                    if atts[att] != varinfo[att]:
+                        _logger.info(
+                            "%s: %s: %s=%s is different than previous value=%s",
+                            ncpath, nc_vname, att, atts[att], varinfo[att])
+                        varinfo[att] = atts[att]
+
+        for site in siteset:
+            try:
+                i = header['sites'].index(site)
+                if i < len(header['site_long_names']):
+                    sitedict[site] = header['site_long_names'][i]
+            except ValueError:
+                pass
 
-        # cache dsinfo
-        self.save_dataset_info(dsinfo)
+            if site not in sitedict:
+                sitedict[site] = ''
 
     def get_variables(self, time_names=('time', 'Time', 'time_offset')):
         """Get the time series variables in a dataset.
@@ -581,11 +1814,25 @@ class NetCDFDataset(object):
             nc_exc.NoDataException
         """
 
-        # scan the dataset every time in case a file has been modified
+        # scan the dataset in case a file has been modified,
+        # if the info is not current
         self.scan_files(time_names=time_names)
         dsinfo = self.get_dataset_info()
         return dsinfo['variables'].copy()
 
+    def get_metadata_generation(self):
+        """Return the generation of the info of this dataset,
+        which changes whenever the variables, stations or sites of the
+        dataset change, for example to validate cached pages.
+
+        Raises:
+            OSError
+            nc_exc.NoDataException
+        """
+
+        self.scan_files()
+        return self.get_dataset_info()['generation']
+
     def get_station_names(
             self):
 
@@ -684,35 +1931,21 @@ class NetCDFDataset(object):
 
         return vshapes
 
-    def read_times(self, ncfile, ncpath, start_time, end_time, times,
-                   size_limit):
-        """Read values of the time variable from a NetCDF dataset.
+    def read_file_times(self, ncfile, ncpath, dsinfo, start=0):
+        """Read the values of the time variable from a NetCDF dataset.
 
         Args:
             ncfile: An opened netCFD4.Dataset.
-            ncpath: Path to the dataset. netCDF4.Dataset.filepath() is only
-                supported in netcdf version >= 4.1.2.
-            start_time: A datetime.datetme. Times greater than or equal
-                to start_time are read.
-            end_time: A datetime.datetme. Times less than end_time are read.
-            times: A list of UTC timestamps, the times read are
-                appended to this list.
-            size_limit: Raise an exception if size exceeds this value
+            ncpath: Path to the dataset, for log messages.
+            dsinfo: The dict of dataset info.
+            start: Index of the first record to read.
 
         Returns:
-            A built-in slice object, giving the start and stop indices of the
-            requested time period in the file. The times list argument is
-            also extended with the times read from the file.
-
-        Raises:
-            TODO: what exceptions can be raised when slicing a netcdf4 variable?
-            nc_exc.TooMuchDataException
+            A numpy.ndarray of float64 UTC timestamps, or None if the
+            file doesn't contain any times, or they can't be read,
+            in which case an error may have been logged.
         """
 
-        debug = False
-
-        dsinfo = self.get_dataset_info()
-
         base_time = None
 
         if dsinfo['base_time'] and \
@@ -721,126 +1954,320 @@ class NetCDFDataset(object):
             base_time = ncfile.variables[dsinfo['base_time']].getValue()
             # _logger.debug("base_time=%d",base_time)
 
-        if dsinfo['time_name'] in ncfile.variables:
-            var = ncfile.variables[dsinfo['time_name']]
+        if not dsinfo['time_name'] in ncfile.variables:
+            return None
 
-            if len(var) == 0:
-                return slice(0)
+        var = ncfile.variables[dsinfo['time_name']]
 
-            if hasattr(var, "units") and 'since' in var.units:
-                try:
-                    # times from netCDF4.num2date are timezone naive.
-                    # Use replace(tzinfo=timezone.utc) to assign a timezone,
-                    # which requires using python datetimes rather than cftime
-                    tvals = [
-                        d.replace(tzinfo=timezone.utc).timestamp() for d in
-                        netCDF4.num2date(var[:], var.units, 'standard',
-                                         only_use_python_datetimes=True,
-                                         only_use_cftime_datetimes=False)]
+        if len(var) <= start:
+            return None
+
+        tvals = None
 
+        if hasattr(var, "units") and 'since' in var.units:
+
+            # Fast path: the units and calendar can be converted
+            # to a scale and offset.
+            tconv = get_time_conversion(
+                var.units, getattr(var, "calendar", "standard"))
+            if tconv:
+                try:
+                    vals = var[start:]
                 except IndexError as exc:
                     # most likely has a dimension of 0
                     _logger.error(
                         "%s: %s: %s %s",
                         ncpath, dsinfo['time_name'], type(exc).__name__,
                         exc)
-                    return slice(0)
-                except TypeError as exc:
-                    if base_time:
-                        _logger.warning(
-                            "%s: %s: %s %s, units=%s "
-                            "Using base_time instead",
-                            ncpath, dsinfo['time_name'], type(exc).__name__,
-                            exc, var.units)
-                        tvals = [base_time + val for val in var[:]]
-                    else:
-                        _logger.error(
-                            "%s: %s: %s %s, units=%s",
-                            ncpath, dsinfo['time_name'], type(exc).__name__,
-                            exc, var.units)
-                        tvals = [val for val in var[:]]
-                except (ValueError, OverflowError) as exc:
-                    # saw this error happen once, perhaps
-                    # on a file that was being updated.
-                    # Give up rather than trying to salvage with:
-                    #   tvals = [base_time + val for val in var[:]]
-                    _logger.error(
-                            "%s: %s: %s %s",
-                        ncpath, dsinfo['time_name'], type(exc).__name__, exc)
-                    return slice(0)
-            else:
-                try:
-                    tvals = [base_time + val for val in var[:]]
-                except IndexError as exc:
-                    # most likely has a dimension of 0
+                    return None
+                # masked values are handled by num2date below
+                if not np.ma.is_masked(vals):
+                    tvals = np.ma.getdata(vals).astype(np.float64)
+                    tvals *= tconv[1]
+                    tvals += tconv[0]
+
+        if tvals is None and hasattr(var, "units") and 'since' in var.units:
+            # Fall back to netCDF4.num2date
+            try:
+                # times from netCDF4.num2date are timezone naive.
+                # Use replace(tzinfo=timezone.utc) to assign a timezone,
+                # which requires using python datetimes rather than cftime
+                tvals = [
+                    d.replace(tzinfo=timezone.utc).timestamp() for d in
+                    netCDF4.num2date(var[start:], var.units, 'standard',
+                                     only_use_python_datetimes=True,
+                                     only_use_cftime_datetimes=False)]
+
+            except IndexError as exc:
+                # most likely has a dimension of 0
+                _logger.error(
+                    "%s: %s: %s %s",
+                    ncpath, dsinfo['time_name'], type(exc).__name__,
+                    exc)
+                return None
+            except TypeError as exc:
+                if base_time:
+                    _logger.warning(
+                        "%s: %s: %s %s, units=%s "
+                        "Using base_time instead",
+                        ncpath, dsinfo['time_name'], type(exc).__name__,
+                        exc, var.units)
+                    tvals = [base_time + val for val in var[start:]]
+                else:
                     _logger.error(
-                        "%s: %s: cannot index variable %s",
-                        ncpath, exc, dsinfo['time_name'])
-                    return slice(0)
+                        "%s: %s: %s %s, units=%s",
+                        ncpath, dsinfo['time_name'], type(exc).__name__,
+                        exc, var.units)
+                    tvals = [val for val in var[start:]]
+            except (ValueError, OverflowError) as exc:
+                # saw this error happen once, perhaps
+                # on a file that was being updated.
+                # Give up rather than trying to salvage with:
+                #   tvals = [base_time + val for val in var[start:]]
+                _logger.error(
+                        "%s: %s: %s %s",
+                    ncpath, dsinfo['time_name'], type(exc).__name__, exc)
+                return None
+        elif tvals is None:
+            try:
+                tvals = base_time + np.ma.getdata(var[start:]).astype(np.float64)
+            except IndexError as exc:
+                # most likely has a dimension of 0
+                _logger.error(
+                    "%s: %s: cannot index variable %s",
+                    ncpath, exc, dsinfo['time_name'])
+                return None
 
-            # pylint: disable=pointless-string-statement
-            """
-            tvals = [
-                d.timestamp() for d in
-                netCDF4.num2date(var[:], var.units, 'standard')]
-            """
+        tvals = np.asarray(tvals, dtype=np.float64)
 
-            if len(tvals) == 0:
-                return slice(0)
+        if len(tvals) == 0:
+            return None
 
-            try:
-                istart = next(idx for idx, tval in enumerate(tvals) \
-                        if tval >= start_time.timestamp())
-                # _logger.debug("start_time=%s, file=%s,istart=%d",
-                #         start_time,ncpath,istart)
-                iend = next(idx for idx, tval in enumerate(reversed(tvals)) \
-                        if tval < end_time.timestamp())
-                iend = len(tvals) - iend
-                # _logger.debug("end_time=%s, file=%s,iend=%d",
-                #         end_time,ncpath,iend)
-            except StopIteration:
-                return slice(0)
-
-            if iend - istart == 0:
-                return slice(0)
-            elif iend - istart < 0:
-                _logger.warning(
-                    "%s: times in file are not ordered, start_time=%s,"
-                    "end_time=%s, file times=%s - %s, istart=%d, iend=%d",
-                    ncpath, start_time.isoformat(), end_time.isoformat(),
-                    datetime.fromtimestamp(tvals[0], tz=timezone.utc).isoformat(),
-                    datetime.fromtimestamp(tvals[-1], tz=timezone.utc).isoformat(),
-                    istart, iend)
-                return slice(0)
-            elif debug:
-                _logger.debug(
-                    "%s: tvals[%d]=%s, tvals[%d]=%s, "
-                    "start_time=%s, end_time=%s",
-                    ncpath, istart,
-                    datetime.fromtimestamp(
-                        tvals[istart], tz=timezone.utc).isoformat(),
-                    iend,
-                    datetime.fromtimestamp(
-                        tvals[iend-1], tz=timezone.utc).isoformat(),
-                    start_time.isoformat(),
-                    end_time.isoformat())
+        return tvals
+
+    def save_file_extent(
+            self, dsinfo, ncpath, mtime, tvals, nc_vnames, start=0):
+        """Save the FileExtent of a file in the dataset info, if its
+        times are ordered.
+
+        Args:
+            dsinfo: The dict of dataset info.
+            ncpath: Path to the file.
+            mtime: Modification time of the file, from before it was
+                opened.
+            tvals: The times read from the file, or None.
+            nc_vnames: The names of the NetCDF variables in the file.
+            start: Index in the file of tvals[0]. If not 0, the times
+                before it are those of the current FileExtent.
+        """
+        if tvals is None or len(tvals) == 0 or np.any(np.diff(tvals) < 0):
+            return
+
+        first_time = float(tvals[0])
+        if start:
+            first_time = dsinfo['file_extents'][ncpath].first_time
+
+        dsinfo['file_extents'][ncpath] = FileExtent(
+            mtime, first_time, float(tvals[-1]), start + len(tvals),
+            self.get_file_variable_bits(dsinfo, nc_vnames))
+
+    def get_file_variable_bits(self, dsinfo, nc_vnames):
+        """Return the bitmap of the NetCDF variables of a file,
+        for its FileExtent, adding bit numbers for new variables
+        to the dataset info.
+        """
+        # Bit numbers are only added, so that if another thread
+        # assigns the same number to another name, it can only
+        # result in a file being read unnecessarily.
+        var_bits = dsinfo['variable_bits']
+        vbits = 0
+        for nc_vname in nc_vnames:
+            vbit = var_bits.get(nc_vname)
+            if vbit is None:
+                vbit = var_bits.setdefault(nc_vname, len(var_bits))
+            vbits |= 1 << vbit
+        return vbits
+
+    def get_variable_bits(self, dsinfo, variables):
+        """Return the bitmap of some variables for comparison with
+        the FileExtent.variables of the files of this dataset.
+
+        Args:
+            dsinfo: The dict of dataset info.
+            variables: Exported names of variables in dsinfo.
+        """
+        var_bits = dsinfo['variable_bits']
+        vbits = 0
+        for exp_vname in variables:
+            vbit = var_bits.get(dsinfo['variables'][exp_vname]['netcdf_name'])
+            if vbit is not None:
+                vbits |= 1 << vbit
+        return vbits
+
+    def get_data_availability(self, variables):
+        """Return the periods of the files of this dataset known to
+        contain some variables, for example to show a timeline of the
+        data available. Only the files whose times have been read,
+        by scan_files() or read_time_series(), are known.
+
+        Args:
+            variables: Exported names of variables.
+
+        Returns:
+            A dict by variable name of time-ordered lists of
+            (first_time, last_time) tuples of UTC timestamps, of the
+            records of each file containing the variable.
+
+        Raises:
+            OSError
+            nc_exc.NoDataException
+        """
+
+        self.scan_files()
+        dsinfo = self.get_dataset_info()
+
+        extents = sorted(
+            dsinfo['file_extents'].values(), key=lambda ext: ext.first_time)
+
+        res = {}
+        for exp_vname in variables:
+            if exp_vname not in dsinfo['variables']:
+                res[exp_vname] = []
+                continue
+            vbits = self.get_variable_bits(dsinfo, [exp_vname])
+            res[exp_vname] = [
+                (ext.first_time, ext.last_time) for ext in extents
+                if ext.variables & vbits]
+        return res
+
+    def get_file_extent(self, dsinfo, ncpath, mtime):
+        """Return the FileExtent of a file in the dataset info,
+        or None if it is not known or the file has since been modified.
+        """
+        extent = dsinfo['file_extents'].get(ncpath)
+        if extent is None or mtime is None or extent.mtime != mtime:
+            return None
+        return extent
+
+    def read_times(
+            self, ncfile, ncpath, start_time, end_time, size_limit,
+            mtime=None, dsinfo=None):
+        """Read values of the time variable from a NetCDF dataset.
+
+        Args:
+            ncfile: An opened netCFD4.Dataset.
+            ncpath: Path to the dataset. netCDF4.Dataset.filepath() is only
+                supported in netcdf version >= 4.1.2.
+            start_time: A datetime.datetme. Times greater than or equal
+                to start_time are read.
+            end_time: A datetime.datetme. Times less than end_time are read.
+            size_limit: Raise an exception if size exceeds this value
+            mtime: Modification time of the file from before it was
+                opened. If not None, the FileExtent of the file is saved
+                in dsinfo.
+            dsinfo: The dict of dataset info. If None, a copy of that
+                of this dataset, in which case the FileExtent is not
+                kept.
+
+        Returns:
+            A tuple containing a built-in slice object, giving the start
+            and stop indices of the requested time period in the file,
+            and a numpy.ndarray of float64 UTC timestamps of the
+            times read from the file within that slice.
+
+        Raises:
+            TODO: what exceptions can be raised when slicing a netcdf4 variable?
+            nc_exc.TooMuchDataException
+        """
+
+        debug = False
 
-            time_slice = slice(istart, iend, 1)
-            tvals = tvals[time_slice]
+        no_times = (slice(0), np.empty(shape=(0,), dtype=np.float64))
 
-            tsize = sys.getsizeof(tvals)
-            if tsize > size_limit:
-                raise nc_exc.TooMuchDataException(
-                    "too many time values requested, size={0} MB".\
-                            format(tsize/(1000 * 1000)))
+        if dsinfo is None:
+            dsinfo = self.get_dataset_info()
 
-            times.extend(tvals)
-            return time_slice
+        # index in the file of tvals[0]
+        toffset = 0
+        tvals = None
+
+        extent = dsinfo['file_extents'].get(ncpath)
+        if mtime and extent and extent.last_time < start_time.timestamp():
+            # Only records appended since the file was last read
+            # can be in the period, as when polling the newest file
+            # of a real-time dataset. Read those, and the last record
+            # read before, to check that the file was appended to,
+            # rather than rewritten.
+            tail = self.read_file_times(
+                ncfile, ncpath, dsinfo, extent.nrecs - 1)
+            if tail is not None and tail[0] == extent.last_time and \
+                    not np.any(np.diff(tail) < 0):
+                self.save_file_extent(
+                    dsinfo, ncpath, mtime, tail, ncfile.variables.keys(),
+                    extent.nrecs - 1)
+                toffset = extent.nrecs
+                tvals = tail[1:]
+
+        if tvals is None:
+            tvals = self.read_file_times(ncfile, ncpath, dsinfo)
+
+            if tvals is None:
+                return no_times
+
+            if mtime:
+                self.save_file_extent(
+                    dsinfo, ncpath, mtime, tvals, ncfile.variables.keys())
+
+        # The times in a file should be ordered, so do binary searches
+        # for the first time >= start_time and the first
+        # time >= end_time.
+        istart = int(np.searchsorted(tvals, start_time.timestamp(), side='left'))
+        # _logger.debug("start_time=%s, file=%s,istart=%d",
+        #         start_time,ncpath,istart)
+        iend = int(np.searchsorted(tvals, end_time.timestamp(), side='left'))
+        # _logger.debug("end_time=%s, file=%s,iend=%d",
+        #         end_time,ncpath,iend)
+
+        if iend - istart == 0:
+            return no_times
+        elif iend - istart < 0:
+            _logger.warning(
+                "%s: times in file are not ordered, start_time=%s,"
+                "end_time=%s, file times=%s - %s, istart=%d, iend=%d",
+                ncpath, start_time.isoformat(), end_time.isoformat(),
+                datetime.fromtimestamp(tvals[0], tz=timezone.utc).isoformat(),
+                datetime.fromtimestamp(tvals[-1], tz=timezone.utc).isoformat(),
+                istart, iend)
+            return no_times
+        elif debug:
+            _logger.debug(
+                "%s: tvals[%d]=%s, tvals[%d]=%s, "
+                "start_time=%s, end_time=%s",
+                ncpath, istart,
+                datetime.fromtimestamp(
+                    tvals[istart], tz=timezone.utc).isoformat(),
+                iend,
+                datetime.fromtimestamp(
+                    tvals[iend-1], tz=timezone.utc).isoformat(),
+                start_time.isoformat(),
+                end_time.isoformat())
+
+        tvals = tvals[istart:iend]
+        time_slice = slice(istart + toffset, iend + toffset, 1)
+
+        tsize = tvals.nbytes
+        if tsize > size_limit:
+            raise nc_exc.TooMuchDataException(
+                "too many time values requested, size={0} MB".\
+                        format(tsize/(1000 * 1000)))
+
+        return (time_slice, tvals)
 
     def read_time_series_data(
-            self, ncfile, ncpath, exp_vname, time_slice, vshape,
-            selectdim, dim2, stnnames):
-        """ Read values of a time-series variable from a netCDF4 dataset.
+            self, ncfile, ncpath, exp_vname, time_slice, odata, toffset,
+            selectdim, dim2, stnnames, dsinfo=None):
+        """ Read values of a time-series variable from a netCDF4 dataset
+        into a preallocated array.
 
         Args:
             ncfile: An opened netCFD4.Dataset.
@@ -848,9 +2275,15 @@ class NetCDFDataset(object):
                 supported in netcdf version >= 4.1.2.
             exp_vname: Exported name of variable to read.
             time_slice: The slice() of time indices to read.
-            vshape: Shape of the variable, which is used to create a
-                filled array of missing values if the variable is not
-                found in the file.
+            odata: A numpy.ndarray, allocated for all the times being read,
+                whose non-time dimensions are the largest seen in the
+                dataset, and filled with missing values. The values read
+                are stored in odata, starting at index toffset of its
+                time dimension. If the non-time dimensions of the variable
+                in this file are smaller than those of odata, the extra
+                values are left as missing.
+            toffset: Index into the time dimension of odata where the
+                values read from this file are stored.
             selectdim: A dict containing for each dimension name of type
                 string, the indices of the dimension to read.
                 For example: {"station":[3,4,5]} to read indices 3,4 and 5
@@ -861,129 +2294,203 @@ class NetCDFDataset(object):
             stnnames: A list of the station names of the variable. Returned.
                 A list of length one containing an empty string indicates
                 the variable does not have a station dimension.
+            dsinfo: The dict of dataset info. If None, that of this
+                dataset.
 
         Returns:
-            A numpy.ma.array containing the data read.
+            True if the variable was read from the file. False if it was
+            not found, in which case the values in odata are left as missing.
         """
 
-        dsinfo = self.get_dataset_info()
+        if dsinfo is None:
+            dsinfo = self.get_dataset_info()
         dsinfo_vars = dsinfo['variables']
 
         debug = False
 
-        # which dimension is time?
-        time_index = dsinfo_vars[exp_vname]["time_index"]
+        nc_vname = dsinfo_vars[exp_vname]['netcdf_name']
+
+        if not nc_vname in ncfile.variables:
+            return False
+
+        var = ncfile.variables[nc_vname]
+
+        # indices of variable to be read
+        idx = ()
+        stnnums = []   # station numbers
+        otime_index = 0     # index of time dimension in odata
+        nsample = 0         # dimensions removed from odata
+        for idim, dim in enumerate(var.dimensions):
+            if dim == dsinfo['time_dim_name']:
+                otime_index = idim - nsample
+                idx += (time_slice,)
+            elif dim == "sample":
+                # high rate files with a sample dimension
+                # Add support for this eventually. For now
+                # just grab first value
+                idx += (0,)
+                nsample += 1
+            elif dim in selectdim:
+                # variable has a selected dimension
+                mdim = tuple(i for i in selectdim[dim])
+                # print("mdim=%s" % (str(mdim)))
+                if len(mdim) == 0:
+                    return False
+                idx += (tuple(mdim),)
+                if dim == STATION_DIMENSION_NAME:
+                    stnnums = [i for i in mdim]
+            else:
+                sized = len(ncfile.dimensions[dim])
+                idx += (slice(0, sized), )
+                if dim == STATION_DIMENSION_NAME:
+                    stnnums = [i for i in range(0, sized)]
+                elif not dim2:
+                    # dsinfo_vars[exp_vname]['shape'][idim] will
+                    # be the largest value for this dimension
+                    # in the set of files.
+                    sized = dsinfo_vars[exp_vname]['shape'][idim]
+                    dim2['data'] = [i for i in range(sized)]
+                    dim2['name'] = dim
+                    dim2['units'] = ''
+
+        if debug and time_slice.stop - time_slice.start > 0:
+            _logger.debug(
+                "%s: %s: time_slice.start,"
+                "time_slice.stop=%d,%d, idx[1:]=%s",
+                ncpath, nc_vname,
+                time_slice.start, time_slice.stop,
+                repr(idx[1:]))
+
+        # extract the data from var
+        vdata = var[idx]
+
+        if vdata.ndim != odata.ndim:
+            _logger.error(
+                "%s: %s: shape=%s is not compatible with shape=%s "
+                "of other files", ncpath, nc_vname, repr(vdata.shape),
+                repr(odata.shape))
+            return False
+
+        # Where to store vdata in odata. dsinfo_vars[exp_vname]['shape']
+        # is only the largest shape of the files that were scanned,
+        # so clip any larger dimensions.
+        oidx = ()
+        vidx = ()
+        for idim, vsize in enumerate(vdata.shape):
+            if idim == otime_index:
+                oidx += (slice(toffset, toffset + vsize),)
+                vidx += (slice(0, vsize),)
+            else:
+                vsize = min(vsize, odata.shape[idim])
+                oidx += (slice(0, vsize),)
+                vidx += (slice(0, vsize),)
+
+        vdata = vdata[vidx]
+        ovals = odata[oidx]
+
+        # Copy into odata, converting to its type if the type
+        # of the variable is different in this file.
+        if isinstance(vdata, np.ma.core.MaskedArray):
+            np.copyto(ovals, vdata.data, casting='unsafe')
+            if np.ma.is_masked(vdata):
+                fill_val = (
+                    0 if odata.dtype.kind == 'i' or
+                    odata.dtype.kind == 'u' else float('nan'))
+                ovals[np.ma.getmaskarray(vdata)] = fill_val
+        else:
+            np.copyto(ovals, vdata, casting='unsafe')
 
-        vdtype = dsinfo_vars[exp_vname]["dtype"]
+        if not stnnums:
+            stnnames.append('')
+        else:
+            dsinfo_stns = dsinfo['station_names']
+            stnnames.extend([dsinfo_stns[i] for i in stnnums])
 
-        nc_vname = dsinfo_vars[exp_vname]['netcdf_name']
+        return True
 
-        if nc_vname in ncfile.variables:
+    def read_file_data(
+            self, ncfile, ncpath, dsinfo, time_slice, read_times,
+            otime, odata, toffset, selectdim):
+        """Read the data of variables from a NetCDF file into
+        its portion of the preallocated arrays of a series.
 
-            var = ncfile.variables[nc_vname]
+        Args:
+            ncfile: An opened netCFD4.Dataset.
+            ncpath: Path to the dataset.
+            dsinfo: The dict of dataset info.
+            time_slice: The slice() of time indices to read.
+            read_times: If True, the times in time_slice are also read,
+                when they are known to be within the requested period
+                from the FileExtent of the file, and time_slice.start is 0.
+            otime: numpy.ndarray of the times of the series.
+            odata: dict of numpy.ndarrays of the data of the series,
+                by exported variable name.
+            toffset: Index in otime, and in the time dimension of odata,
+                of the values read from this file.
+            selectdim: A dict of the indices of dimensions to read,
+                see read_time_series().
 
-            skip = False
+        Returns:
+            A tuple of two dicts by variable name, of the dim2 and
+            stnnames of the variables found in the file, as returned
+            by read_time_series_data(), or None if read_times and the
+            file has changed since its FileExtent, in which case
+            nothing is read.
+        """
 
-            # indices of variable to be read
-            idx = ()
-            stnnums = []   # station numbers
-            for idim, dim in enumerate(var.dimensions):
-                if dim == dsinfo['time_dim_name']:
-                    idx += (time_slice,)
-                elif dim == "sample":
-                    # high rate files with a sample dimension
-                    # Add support for this eventually. For now
-                    # just grab first value
-                    idx += (0,)
-                elif dim in selectdim:
-                    # variable has a selected dimension
-                    mdim = tuple(i for i in selectdim[dim])
-                    # print("mdim=%s" % (str(mdim)))
-                    if len(mdim) == 0:
-                        skip = True
-                        continue
-                    idx += (tuple(mdim),)
-                    if dim == STATION_DIMENSION_NAME:
-                        stnnums = [i for i in mdim]
-                else:
-                    sized = len(ncfile.dimensions[dim])
-                    idx += (slice(0, sized), )
-                    if dim == STATION_DIMENSION_NAME:
-                        stnnums = [i for i in range(0, sized)]
-                    elif not dim2:
-                        # dsinfo_vars[exp_vname]['shape'][idim] will
-                        # be the largest value for this dimension
-                        # in the set of files.
-                        sized = dsinfo_vars[exp_vname]['shape'][idim]
-                        dim2['data'] = [i for i in range(sized)]
-                        dim2['name'] = dim
-                        dim2['units'] = ''
-
-            if skip:
-                # print("skipping %s" % (nc_vname))
+        ntime = time_slice.stop - time_slice.start
+        odim2 = {}
+        ostns = {}
+
+        if read_times:
+            # Records appended since the FileExtent are ignored.
+            ftimes = self.read_file_times(ncfile, ncpath, dsinfo)
+            if ftimes is None or len(ftimes) < ntime:
+                _logger.warning(
+                    "%s: file has changed, its data are missing", ncpath)
                 return None
+            otime[toffset:toffset + ntime] = ftimes[:ntime]
 
-            if debug and time_slice.stop - time_slice.start > 0:
-                _logger.debug(
-                    "%s: %s: time_slice.start,"
-                    "time_slice.stop=%d,%d, idx[1:]=%s",
-                    ncpath, nc_vname,
-                    time_slice.start, time_slice.stop,
-                    repr(idx[1:]))
-
-            # extract the data from var
-            vdata = var[idx]
-            fill_val = (
-                0 if vdata.dtype.kind == 'i' or
-                vdata.dtype.kind == 'u' else float('nan'))
-
-            if isinstance(vdata, np.ma.core.MaskedArray):
-                vdata = vdata.filled(fill_value=fill_val)
-
-            if vdata.dtype != vdtype:
-                vdata = np.ndarray.astype(vdtype)
-
-            if len(vshape) > 0 and tuple(vshape[1:]) != vdata.shape[1:]:
-                # _logger.debug("vshape[1:]=%d, vdata.shape[1:]=%d",
-                #     vshape[1:], vdata.shape[1:])
-                # changing shape. Add support for final dimension
-                # increasing. vshape should be the largest expected shape
-                shape = list(vdata.shape)
-                # how much to grow it by
-                shape[-1] = vshape[-1] - vdata.shape[-1]
-                vdata = np.append(
-                    vdata, np.ma.array(
-                        data=np.empty(
-                            shape=shape, dtype=vdata.dtype),
-                        mask=True, fill_value=fill_val).filled(),
-                    axis=-1)
-
-            if not stnnums:
-                stnnames.append('')
-            else:
-                dsinfo_stns = dsinfo['station_names']
-                stnnames.extend([dsinfo_stns[i] for i in stnnums])
+        for (exp_vname, vdata) in odata.items():
 
-        else:
-            # variable is not in file, create NaN filled array
-            # Determine shape of variable. Change the first, time dimension
-            # to match the selected period.  The remaining dimension
-            # in dsinfo_vars[exp_vname]['shape'] is the largest of those
-            # seen in the selected files.
-            shape = list(vshape)
-            shape[time_index] = time_slice.stop - time_slice.start
-
-            vdtype = dsinfo_vars[exp_vname]["dtype"]
-            fill_val = (
-                0 if vdtype.kind == 'i' or
-                vdtype.kind == 'u' else float('nan'))
-
-            vdata = np.ma.array(
-                data=np.empty(
-                    shape=shape, dtype=vdtype),
-                mask=True, fill_value=fill_val).filled()
-
-        return vdata
+            dim2 = {}
+            stnnames = []
+            if not self.read_time_series_data(
+                    ncfile, ncpath, exp_vname, time_slice, vdata, toffset,
+                    selectdim, dim2, stnnames, dsinfo=dsinfo):
+                continue
+
+            # dim2 will be empty if variable is not found in file
+            if dim2:
+                odim2[exp_vname] = dim2
+
+            # stnnames will be empty if variable is not found in file
+            if stnnames:
+                ostns[exp_vname] = stnnames
+
+        return (odim2, ostns)
+
+    def get_reader_dataset_info(self, dsinfo, ncpath, variables):
+        """Return the part of the dataset info needed by a reader
+        process of a ReaderPool to read a file.
+
+        Args:
+            dsinfo: The dict of dataset info.
+            ncpath: Path of the file.
+            variables: Exported names of the variables to be read.
+        """
+        rdsinfo = {
+            key: val for (key, val) in dsinfo.items() if key not in
+            ('file_mod_times', 'file_extents', 'variable_bits', 'variables')}
+        rdsinfo['file_mod_times'] = {}
+        rdsinfo['file_extents'] = {}
+        if ncpath in dsinfo['file_extents']:
+            rdsinfo['file_extents'][ncpath] = dsinfo['file_extents'][ncpath]
+        rdsinfo['variable_bits'] = {}
+        rdsinfo['variables'] = {
+            exp_vname: dsinfo['variables'][exp_vname]
+            for exp_vname in variables}
+        return rdsinfo
 
     def read_time_series(
             self,
@@ -993,7 +2500,8 @@ class NetCDFDataset(object):
             selectdim=None,
             size_limit=1000 * 1000 * 1000,
             series=None,
-            series_name_fmt=None):
+            series_name_fmt=None,
+            resolution=None):
         """ Read a list of time-series variables from this fileset.
 
         Args:
@@ -1021,10 +2529,23 @@ class NetCDFDataset(object):
                 on the time associated with the file.
                 If series_name_fmt is None, all data is put in a dictionary
                 element named ''.
+            resolution: Time resolution in seconds needed by the caller,
+                such as the time period divided by the number of points
+                in a plot. If not None, and a Pyramid of this dataset has
+                been built, the mean values from the coarsest level of the
+                Pyramid that meets the resolution are returned, followed by
+                any newer records from the files. The returned dict
+                then contains a 'resolution' element, the interval of
+                the level that was read.
 
         Returns:
             A dict containing, by series name:
-                'time' : list of UTC timestamps,
+                'time' : numpy.ndarray of float64 UTC timestamps.
+                    Files known from their FileExtents to contain none
+                    of the variables are not read, and are represented
+                    by records of missing values at their first and
+                    last times within the period, so that a plot shows
+                    a gap over them,
                 'data': list of numpy.ndarray containing the data for
                     each variable,
                 'vmap': dict by variable name,
@@ -1059,10 +2580,50 @@ class NetCDFDataset(object):
 
         The series names will not contain single quotes.
 
+        Concurrent calls for the same variables and times, from clients
+        polling a real-time dataset for example, are coalesced into one
+        read, whose result is shared. The numpy arrays of the result
+        should therefore not be modified in place.
+
+        """
+
+        if not selectdim:
+            selectdim = {}
+
+        key = (
+            self.cache_hash, tuple(variables),
+            start_time.timestamp(), end_time.timestamp(),
+            tuple(sorted(
+                (dim, tuple(indices)) for (dim, indices) in selectdim.items())),
+            size_limit, tuple(series) if series else None,
+            series_name_fmt, resolution)
+
+        return NetCDFDataset.__reads.do(
+            key,
+            lambda: self.do_read_time_series(
+                variables, start_time, end_time, selectdim, size_limit,
+                series, series_name_fmt, resolution),
+            copy=copy_time_series)
+
+    def do_read_time_series(
+            self, variables, start_time, end_time, selectdim, size_limit,
+            series, series_name_fmt, resolution):
+        """Read a list of time-series variables from this fileset,
+        without coalescing concurrent reads.
+
+        Args:
+            See read_time_series().
         """
 
         debug = False
 
+        if resolution and self.pyramid_dir and not series_name_fmt:
+            res_data = self.read_time_series_pyramid(
+                variables, start_time, end_time, selectdim,
+                size_limit, resolution)
+            if res_data:
+                return res_data
+
         dsinfo = self.get_dataset_info()
 
         if not dsinfo['time_name']:
@@ -1076,10 +2637,38 @@ class NetCDFDataset(object):
 
         vshapes = self.resolve_variable_shapes(variables, selectdim)
 
+        # Shapes of the arrays to be returned for each variable, with
+        # the length of the time dimension set to 0. The non-time
+        # dimensions are the largest found in the dataset, or the
+        # number of selected indices of a dimension in selectdim.
+        # A "sample" dimension is removed.
+        oshapes = {}
+        for exp_vname in variables:
+            # skip if variable is not a time series or
+            # doesn't have a selected dimension
+            if not exp_vname in dsinfo_vars or not exp_vname in vshapes:
+                continue
+            vshape = dsinfo_vars[exp_vname]["shape"]
+            oshape = []
+            otime_index = 0
+            for idim, dim in enumerate(dsinfo_vars[exp_vname]["dimnames"]):
+                if dim == dsinfo['time_dim_name']:
+                    otime_index = len(oshape)
+                    oshape.append(0)
+                elif dim == "sample":
+                    pass
+                elif dim in selectdim:
+                    oshape.append(len(selectdim[dim]))
+                else:
+                    oshape.append(vshape[idim])
+            # skip if a selected dimension is empty
+            if not all(oshape[:otime_index] + oshape[otime_index+1:]):
+                continue
+            oshapes[exp_vname] = (oshape, otime_index)
+
         res_data = {}
 
         total_size = 0
-        ntimes = 0
 
         files = self.get_files(start_time, end_time)
         if debug:
@@ -1093,6 +2682,28 @@ class NetCDFDataset(object):
         else:
             file_tuples = [("", f.path) for f in files]
 
+        # First pass, determine how many values will be read from
+        # each file. The arrays for the data can then be allocated
+        # once, rather than appending to them for each file.
+        # If the FileExtent of a file is known, it isn't opened
+        # if its times are outside of the requested period, or
+        # it has none of the variables, and its times are read
+        # in the second pass if they are all inside the period.
+        # Otherwise the times are read from the file.
+        # A file with none of the variables is put in file_reads
+        # with an ncpath of None, and the times of its gap records.
+        file_reads = []
+        new_extents = 0
+        # files whose times are read, which may update their FileExtents
+        read_extents = 0
+        tstart = start_time.timestamp()
+        tend = end_time.timestamp()
+        vbits = self.get_variable_bits(dsinfo, oshapes.keys())
+
+        # files whose times are read, with a ReaderPool
+        pool = ReaderPool.get()
+        time_reads = []
+
         for (series_name, ncpath) in file_tuples:
 
             if series and not series_name in series:
@@ -1102,123 +2713,220 @@ class NetCDFDataset(object):
                 _logger.debug("series=%s", str(series))
                 _logger.debug("series_name=%s ,ncpath=%s", series_name, ncpath)
 
-            # the files might be in the process of being moved, deleted, etc
-            fileok = False
-            exc = None
-            for itry in range(0, 3):
-                try:
-                    ncfile = netCDF4.Dataset(ncpath)
-                    fileok = True
-                    break
-                except (OSError, RuntimeError) as excx:
-                    exc = excx
-                    time.sleep(itry)
+            try:
+                mtime = get_file_modtime(ncpath)
+            except OSError:
+                mtime = None
 
-            if not fileok:
-                _logger.error("%s: %s", ncpath, exc)
+            extent = self.get_file_extent(dsinfo, ncpath, mtime)
+            if extent and (
+                    extent.last_time < tstart or extent.first_time >= tend):
                 continue
 
             if not series_name in res_data:
                 res_data[series_name] = {
-                    'time': [],
+                    'time': np.empty(shape=(0,), dtype=np.float64),
                     'data': [],
                     'vmap': {},
                     'dim2': {},
                     'stnnames': {},
                 }
 
-            otime = res_data[series_name]['time']
-            odata = res_data[series_name]['data']
-            ovmap = res_data[series_name]['vmap']
-            odim2 = res_data[series_name]['dim2']
-            ostns = res_data[series_name]['stnnames']
+            if extent and not extent.variables & vbits:
+                gtimes = [max(extent.first_time, tstart)]
+                if gtimes[0] < extent.last_time < tend:
+                    gtimes.append(extent.last_time)
+                file_reads.append(
+                    (series_name, None, slice(0, len(gtimes), 1),
+                     np.array(gtimes, dtype=np.float64)))
+                continue
 
-            try:
-                size1 = sys.getsizeof(otime)
+            if extent and extent.first_time >= tstart and \
+                    extent.last_time < tend:
+                tsize = extent.nrecs * np.dtype(np.float64).itemsize
+                if total_size + tsize > size_limit:
+                    raise nc_exc.TooMuchDataException(
+                        "too many time values requested, size={0} MB".\
+                                format(tsize/(1000 * 1000)))
+                total_size += tsize
+                file_reads.append(
+                    (series_name, ncpath, slice(0, extent.nrecs, 1), None))
+                continue
+
+            read_extents += 1
+            if ncpath not in dsinfo['file_extents']:
+                new_extents += 1
+
+            if pool:
+                time_reads.append((series_name, ncpath, mtime))
+                file_reads.append(None)
+                continue
+
+            ncfile = self.open_file(ncpath)
+            if not ncfile:
+                continue
 
-                # times are apended to otime
-                time_slice = self.read_times(
-                    ncfile, ncpath, start_time, end_time, otime,
-                    size_limit - total_size)
+            try:
+                (time_slice, ftimes) = self.read_times(
+                    ncfile, ncpath, start_time, end_time,
+                    size_limit - total_size, mtime=mtime, dsinfo=dsinfo)
 
                 # time_slice.start is None if nothing to read
                 if time_slice.start is None or \
                     time_slice.stop <= time_slice.start:
                     continue
 
-                total_size += sys.getsizeof(otime) - size1
-
-                for exp_vname in variables:
-
-                    # skip if variable is not a time series or
-                    # doesn't have a selected dimension
-                    if not exp_vname in dsinfo_vars or not exp_vname in vshapes:
-                        continue
-
-                    # selected shape of this variable
-                    vshape = vshapes[exp_vname]
-                    vsize = reduce_(
-                        operator.mul, vshape, 1) * \
-                        dsinfo_vars[exp_vname]["dtype"].itemsize
-
-                    if not vsize:
-                        continue
-
-                    if total_size + vsize > size_limit:
-                        raise nc_exc.TooMuchDataException(
-                            "too much data requested, will exceed {} mbytes".
-                            format(size_limit/(1000 * 1000)))
-
-                    dim2 = {}
-                    stnnames = []
-                    vdata = self.read_time_series_data(
-                        ncfile, ncpath, exp_vname, time_slice, vshape,
-                        selectdim, dim2, stnnames)
-
-                    if vdata is None:
-                        continue
-
-                    # dim2 will be empty if variable is not found in file
-                    if dim2 and not exp_vname in odim2:
-                        odim2[exp_vname] = dim2
+                total_size += ftimes.nbytes
+                file_reads.append((series_name, ncpath, time_slice, ftimes))
+            finally:
+                self.close_file(ncfile)
+
+        if time_reads:
+            # read the times in the reader processes, and put them
+            # in the places of the file_reads reserved for them
+            results = iter(pool.run([
+                (ncpath, ReaderPool.read_times_task, (
+                    self.path, self.get_reader_dataset_info(dsinfo, ncpath, ()),
+                    ncpath, start_time, end_time, size_limit, mtime))
+                for (series_name, ncpath, mtime) in time_reads]))
+            time_reads = iter(time_reads)
+            for (iread, file_read) in enumerate(file_reads):
+                if file_read is not None:
+                    continue
+                (series_name, ncpath, mtime) = next(time_reads)
+                result = next(results)
+                if result is None:
+                    continue
+                (time_slice, ftimes, extent, nc_vnames) = result
+                if extent and extent.mtime == mtime:
+                    dsinfo['file_extents'][ncpath] = extent._replace(
+                        variables=self.get_file_variable_bits(
+                            dsinfo, nc_vnames))
+                if time_slice.start is None or \
+                    time_slice.stop <= time_slice.start:
+                    continue
+                total_size += ftimes.nbytes
+                if total_size > size_limit:
+                    raise nc_exc.TooMuchDataException(
+                        "too many time values requested, size={0} MB".\
+                                format(total_size/(1000 * 1000)))
+                file_reads[iread] = (series_name, ncpath, time_slice, ftimes)
+            file_reads = [
+                file_read for file_read in file_reads if file_read is not None]
+
+        # cache the FileExtents of the files whose times were read,
+        # saving them in the store if some were read for the first
+        # time, unless the files have since been scanned again
+        if read_extents:
+            curr_dsinfo = self.get_dataset_info()
+            if curr_dsinfo['scan_time'] == dsinfo['scan_time']:
+                self.save_dataset_info(dsinfo, modified=new_extents > 0)
+
+        # number of times in each series
+        ntimes = {}
+        for (series_name, ncpath, time_slice, ftimes) in file_reads:
+            ntimes[series_name] = ntimes.get(series_name, 0) + \
+                time_slice.stop - time_slice.start
+
+        if not any(
+                ncpath and time_slice.stop > time_slice.start
+                for (_, ncpath, time_slice, _) in file_reads):
+            exc = nc_exc.NoDataException(
+                "No data between {} and {}".
+                format(
+                    start_time.isoformat(),
+                    end_time.isoformat()))
+            # _logger.warning("%s: %s", str(self), repr(exc))
+            raise exc
 
-                    # stnnames will be empty if variable is not found in file
-                    if stnnames and not exp_vname in ostns:
-                        ostns[exp_vname] = stnnames
+        for series_name, ntime in ntimes.items():
+            for exp_vname, (oshape, otime_index) in oshapes.items():
+                vsize = reduce_(
+                    operator.mul, oshape[:otime_index] +
+                    oshape[otime_index+1:], ntime) * \
+                    dsinfo_vars[exp_vname]["dtype"].itemsize
+                if total_size + vsize > size_limit:
+                    raise nc_exc.TooMuchDataException(
+                        "too much data requested, will exceed {} mbytes".
+                        format(size_limit/(1000 * 1000)))
+                total_size += vsize
+
+        # Allocate the time and data arrays of each series,
+        # in shared memory if they are read by a ReaderPool
+        if pool and not any(
+                dsinfo_vars[exp_vname]["dtype"].hasobject
+                for exp_vname in oshapes):
+            try:
+                failed = self.read_data_pool(
+                    pool, dsinfo, res_data, ntimes, oshapes, file_reads,
+                    selectdim)
+                self.fix_failed_reads(dsinfo, res_data, oshapes, failed)
+                return res_data
+            except OSError as exc:
+                _logger.warning("%s: shared memory: %s", self.path, exc)
+
+        for series_name, ntime in ntimes.items():
+            ser_data = res_data[series_name]
+            ser_data['time'] = np.empty(shape=(ntime,), dtype=np.float64)
+            for exp_vname, (oshape, otime_index) in oshapes.items():
+                vdtype = dsinfo_vars[exp_vname]["dtype"]
+                fill_val = (
+                    0 if vdtype.kind == 'i' or
+                    vdtype.kind == 'u' else float('nan'))
+                shape = list(oshape)
+                shape[otime_index] = ntime
+                ser_data['vmap'][exp_vname] = len(ser_data['data'])
+                ser_data['data'].append(
+                    np.full(shape=shape, fill_value=fill_val, dtype=vdtype))
+
+        # Second pass, read the data from each file into its
+        # portion of the arrays.
+        toffsets = {}
+        failed = []
+        for (series_name, ncpath, time_slice, ftimes) in file_reads:
+
+            ntime = time_slice.stop - time_slice.start
+            toffset = toffsets.get(series_name, 0)
+            toffsets[series_name] = toffset + ntime
 
-                    if not exp_vname in ovmap:
-                        size1 = 0
-                        vindex = len(odata)
-                        odata.append(vdata)
-                        ovmap[exp_vname] = vindex
-                    else:
-                        if debug:
-                            _logger.debug(
-                                "odata[%s].shape=%s, vdata.shape=%s",
-                                exp_vname, odata[vindex].shape, vdata.shape)
+            otime = res_data[series_name]['time']
+            odata = res_data[series_name]['data']
+            ovmap = res_data[series_name]['vmap']
+            odim2 = res_data[series_name]['dim2']
+            ostns = res_data[series_name]['stnnames']
 
-                        vindex = ovmap[exp_vname]
-                        size1 = sys.getsizeof(odata[vindex])
+            if ftimes is not None:
+                otime[toffset:toffset + ntime] = ftimes
 
-                        time_index = dsinfo_vars[exp_vname]["time_index"]
-                        odata[vindex] = np.append(
-                            odata[vindex], vdata, axis=time_index)
+            if ncpath is None:
+                # gap records of a file with none of the variables
+                continue
 
-                    total_size += sys.getsizeof(odata[vindex]) - size1
+            ncfile = self.open_file(ncpath)
+            if not ncfile:
+                failed.append((series_name, ncpath, toffset, ntime, ftimes))
+                continue
 
+            try:
+                # If ftimes is None, all times of the file are
+                # within the period, from its FileExtent.
+                result = self.read_file_data(
+                    ncfile, ncpath, dsinfo, time_slice, ftimes is None,
+                    otime,
+                    {exp_vname: odata[ovmap[exp_vname]] for exp_vname in ovmap},
+                    toffset, selectdim)
             finally:
-                ncfile.close()
+                self.close_file(ncfile)
 
-            ntimes += len(otime)
+            if result is None:
+                failed.append((series_name, ncpath, toffset, ntime, ftimes))
+                continue
 
-        if ntimes == 0:
-            exc = nc_exc.NoDataException(
-                "No data between {} and {}".
-                format(
-                    start_time.isoformat(),
-                    end_time.isoformat()))
-            # _logger.warning("%s: %s", str(self), repr(exc))
-            raise exc
+            (dim2s, stnnames) = result
+            for (exp_vname, dim2) in dim2s.items():
+                odim2.setdefault(exp_vname, dim2)
+            for (exp_vname, stns) in stnnames.items():
+                ostns.setdefault(exp_vname, stns)
 
         if debug:
             for series_name in res_data:
@@ -1232,4 +2940,222 @@ class NetCDFDataset(object):
             _logger.debug(
                 "total_size=%d", total_size)
 
+        self.fix_failed_reads(dsinfo, res_data, oshapes, failed)
+        return res_data
+
+    def read_data_pool(
+            self, pool, dsinfo, res_data, ntimes, oshapes, file_reads,
+            selectdim):
+        """Do the second pass of read_time_series() in the reader
+        processes of a ReaderPool, which read the data into arrays in
+        shared memory, which are then copied to res_data.
+
+        Returns:
+            A list of the reads which failed, see fix_failed_reads().
+
+        Raises:
+            OSError if the shared memory can't be allocated.
+        """
+        dsinfo_vars = dsinfo['variables']
+        shared = {}
+        try:
+            for series_name, ntime in ntimes.items():
+                otime = SharedArray((ntime,), np.float64, float('nan'))
+                shared[series_name] = (otime, {})
+                for exp_vname, (oshape, otime_index) in oshapes.items():
+                    vdtype = dsinfo_vars[exp_vname]["dtype"]
+                    fill_val = (
+                        0 if vdtype.kind == 'i' or
+                        vdtype.kind == 'u' else float('nan'))
+                    shape = list(oshape)
+                    shape[otime_index] = ntime
+                    shared[series_name][1][exp_vname] = SharedArray(
+                        shape, vdtype, fill_val)
+
+            tasks = []
+            task_reads = []
+            toffsets = {}
+            for (series_name, ncpath, time_slice, ftimes) in file_reads:
+                ntime = time_slice.stop - time_slice.start
+                toffset = toffsets.get(series_name, 0)
+                toffsets[series_name] = toffset + ntime
+                (otime, odata) = shared[series_name]
+                if ftimes is not None:
+                    otime.array()[toffset:toffset + ntime] = ftimes
+                if ncpath is None:
+                    continue
+                task_reads.append(
+                    (series_name, ncpath, toffset, ntime, ftimes))
+                tasks.append((ncpath, ReaderPool.read_data_task, (
+                    self.path,
+                    self.get_reader_dataset_info(dsinfo, ncpath, odata.keys()),
+                    ncpath, time_slice, ftimes is None, otime, odata,
+                    toffset, selectdim)))
+
+            results = pool.run(tasks)
+
+            failed = []
+            for (task_read, result) in zip(task_reads, results):
+                if result is None:
+                    failed.append(task_read)
+                    continue
+                series_name = task_read[0]
+                (dim2s, stnnames) = result
+                for (exp_vname, dim2) in dim2s.items():
+                    res_data[series_name]['dim2'].setdefault(exp_vname, dim2)
+                for (exp_vname, stns) in stnnames.items():
+                    res_data[series_name]['stnnames'].setdefault(
+                        exp_vname, stns)
+        except OSError:
+            for (otime, odata) in shared.values():
+                for sarr in [otime] + list(odata.values()):
+                    sarr.release()
+            raise
+
+        for (series_name, (otime, odata)) in shared.items():
+            ser_data = res_data[series_name]
+            ser_data['time'] = otime.release()
+            for (exp_vname, sarr) in odata.items():
+                ser_data['vmap'][exp_vname] = len(ser_data['data'])
+                ser_data['data'].append(sarr.release())
+
+        return failed
+
+    def fix_failed_reads(self, dsinfo, res_data, oshapes, failed):
+        """Fix the portions of the arrays of series in res_data of
+        the files whose reads failed in the second pass of
+        read_time_series(), so that the times remain sorted and
+        without NaNs.
+
+        The data of a failed read are set to missing. If its times
+        were to be read from the file, they are replaced by gap records
+        at the first and last times of its FileExtent, as is done for
+        files with none of the variables, and the other records are
+        removed from the series.
+
+        Args:
+            dsinfo: The dict of dataset info.
+            res_data: A dict by series name, as returned by
+                read_time_series().
+            oshapes: A dict by exported variable name, of the tuples
+                of the shape of the variable and index of its
+                time dimension.
+            failed: A list of (series_name, ncpath, toffset, ntime, ftimes)
+                tuples of the failed reads, where ftimes is None if
+                the times were to be read from the file.
+        """
+
+        if not failed:
+            return
+
+        dsinfo_vars = dsinfo['variables']
+        for (series_name, ncpath, toffset, ntime, ftimes) in failed:
+            ser_data = res_data[series_name]
+            for (exp_vname, var_index) in ser_data['vmap'].items():
+                vdtype = dsinfo_vars[exp_vname]["dtype"]
+                fill_val = (
+                    0 if vdtype.kind == 'i' or
+                    vdtype.kind == 'u' else float('nan'))
+                otime_index = oshapes[exp_vname][1]
+                idx = (slice(None),) * otime_index + \
+                    (slice(toffset, toffset + ntime),)
+                ser_data['data'][var_index][idx] = fill_val
+
+            if ftimes is None:
+                otime = ser_data['time']
+                extent = dsinfo['file_extents'][ncpath]
+                otime[toffset:toffset + ntime] = float('nan')
+                otime[toffset] = extent.first_time
+                if ntime > 1:
+                    otime[toffset + ntime - 1] = extent.last_time
+
+        for ser_data in res_data.values():
+            keep = ~np.isnan(ser_data['time'])
+            if keep.all():
+                continue
+            ser_data['time'] = ser_data['time'][keep]
+            for (exp_vname, var_index) in ser_data['vmap'].items():
+                ser_data['data'][var_index] = np.compress(
+                    keep, ser_data['data'][var_index],
+                    axis=oshapes[exp_vname][1])
+
+    def read_time_series_pyramid(
+            self, variables, start_time, end_time, selectdim,
+            size_limit, resolution):
+        """Read a list of time-series variables from the Pyramid
+        of this dataset, followed by any records in the files
+        which are newer than the last record in the Pyramid.
+
+        Args:
+            See read_time_series.
+
+        Returns:
+            A dict by series name, as returned by read_time_series,
+            or None if the Pyramid cannot satisfy the request,
+            in which case the data should be read from the files.
+
+        Raises:
+            nc_exc.TooMuchDataException
+        """
+
+        pyr = nc_pyramid.Pyramid(self.pyramid_dir)
+        pyr_read = pyr.read(
+            variables, start_time, end_time, resolution,
+            selectdim=selectdim, size_limit=size_limit)
+        if not pyr_read:
+            return None
+
+        (pyr_end, res_data) = pyr_read
+        ser_data = res_data['']
+
+        if pyr_end < end_time.timestamp():
+            # newer records, after the last one in the pyramid
+            tail_start = max(
+                start_time,
+                datetime.fromtimestamp(pyr_end + 0.001, tz=timezone.utc))
+            try:
+                tail = self.read_time_series(
+                    variables, start_time=tail_start, end_time=end_time,
+                    selectdim=selectdim,
+                    size_limit=size_limit - sum(
+                        [vdata.nbytes for vdata in ser_data['data']]))['']
+            except nc_exc.NoDataException:
+                tail = None
+
+            if tail:
+                if sorted(tail['vmap']) != sorted(ser_data['vmap']) or \
+                        any(tail['data'][tail['vmap'][vname]].shape[1:] != \
+                            ser_data['data'][vindex].shape[1:]
+                            for vname, vindex in ser_data['vmap'].items()):
+                    _logger.warning(
+                        "%s: variables in files differ from %s",
+                        str(self), str(pyr))
+                    return None
+
+                ntail = len(tail['time'])
+                ser_data['time'] = np.concatenate(
+                    (ser_data['time'], tail['time']))
+                for vname, vindex in ser_data['vmap'].items():
+                    tdata = tail['data'][tail['vmap'][vname]]
+                    ser_data['data'][vindex] = np.concatenate(
+                        (ser_data['data'][vindex], tdata))
+                    # a single record for each interval of the tail
+                    ser_data['min'][vindex] = np.concatenate(
+                        (ser_data['min'][vindex], tdata))
+                    ser_data['max'][vindex] = np.concatenate(
+                        (ser_data['max'][vindex], tdata))
+                    ser_data['count'][vindex] = np.concatenate(
+                        (ser_data['count'][vindex],
+                         np.isfinite(tdata).astype(np.int32)))
+                for vname, dim2 in tail['dim2'].items():
+                    ser_data['dim2'].setdefault(vname, dim2)
+                for vname, stnnames in tail['stnnames'].items():
+                    ser_data['stnnames'].setdefault(vname, stnnames)
+                _logger.debug(
+                    "%s: %d records from %s, %d newer from files",
+                    str(self), len(ser_data['time']) - ntail, str(pyr), ntail)
+
+        if len(ser_data['time']) == 0:
+            return None
+
         return res_data
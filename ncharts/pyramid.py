@@ -0,0 +1,634 @@
+# -*- mode: python; indent-tabs-mode: nil; c-basic-offset: 4; tab-width: 4; -*-
+# vim: set shiftwidth=4 softtabstop=4 expandtab:
+
+"""A multi-resolution store of time-series aggregates of a NetCDFDataset.
+
+Plotting a long period of a dataset, such as a year, does not need
+every record, but reading the raw files to decimate them is slow.
+A Pyramid holds, for a set of levels, such as 1 minute, 10 minutes,
+1 hour and 1 day, the mean, minimum, maximum and count of the
+non-missing values of each time-series variable in each interval.
+A request can then be satisfied from the coarsest level which still
+has the resolution needed for a plot.
+
+The aggregates are kept in a sidecar directory, by default next
+to the data files, as numpy .npz files. Each level is split into
+partitions of PARTITION_LEN intervals, so that an update of a
+real-time dataset only rewrites the last, small, partition of each
+level. Files are written to a temporary name and renamed,
+so readers never see a partially written partition.
+
+The store is updated by the build_pyramid management command. Updates
+are incremental, only the records after the last one that was
+aggregated are read, if the modification times of the data files
+show that nothing but the last file(s) have changed.
+Otherwise the store is rebuilt.
+
+2014 Copyright University Corporation for Atmospheric Research
+
+This file is part of the "django-ncharts" package.
+The license and distribution terms for this file may be found in the
+file LICENSE in this package.
+"""
+
+import os
+import json
+import fcntl
+import hashlib
+import logging
+import tempfile
+import shutil
+from datetime import datetime, timezone, timedelta
+
+import numpy as np
+
+from ncharts import exceptions as nc_exc
+
+_logger = logging.getLogger(__name__)   # pylint: disable=invalid-name
+
+# Default aggregation levels, in seconds: 1 minute, 10 minutes, 1 hour, 1 day
+LEVELS = (60, 600, 3600, 86400)
+
+# Number of intervals in a partition file of a level.
+PARTITION_LEN = 1440
+
+# Names of the aggregates of each variable
+AGGREGATES = ("mean", "min", "max", "count")
+
+def get_pyramid_dir(path, root=None):
+    """Return the sidecar directory of a Pyramid for a dataset.
+
+    Args:
+        path: The path of the NetCDFDataset, a directory and
+            file name format, possibly containing time descriptors.
+        root: Directory in which to create the sidecar directories.
+            If None, the sidecar is placed in a ".ncharts_pyramid"
+            directory in the part of path which does not contain
+            time descriptors.
+    """
+
+    key = hashlib.md5(bytes(path, 'utf-8')).hexdigest()[:16]
+    if root:
+        return os.path.join(root, key)
+
+    pdir = os.path.dirname(path)
+    while '%' in pdir:
+        pdir = os.path.dirname(pdir)
+    return os.path.join(pdir, ".ncharts_pyramid", key)
+
+def aggregate(times, data, level):
+    """Aggregate a time series over intervals of a fixed length.
+
+    Args:
+        times: 1-D numpy array of sorted float64 UTC timestamps.
+        data: numpy array of values, with time as its first dimension.
+        level: Length of the intervals, in seconds.
+
+    Returns:
+        A tuple of the start times of the intervals containing data,
+        and a dict of the "mean", "min", "max" and "count" of
+        the finite values of data in each interval.
+        Missing values in the mean, min and max are NaN.
+    """
+
+    btimes = np.floor(times / level) * level
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(btimes)) + 1))
+
+    vals = np.asarray(data, dtype=np.float64)
+    valid = np.isfinite(vals)
+
+    count = np.add.reduceat(valid.astype(np.int32), starts, axis=0)
+    sums = np.add.reduceat(np.where(valid, vals, 0.0), starts, axis=0)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.where(count > 0, sums / count, float('nan'))
+
+    # fmin and fmax ignore NaNs, and return NaN if all are NaN
+    return (btimes[starts], {
+        "mean": mean,
+        "min": np.fmin.reduceat(vals, starts, axis=0),
+        "max": np.fmax.reduceat(vals, starts, axis=0),
+        "count": count,
+    })
+
+def merge_aggregates(agg1, agg2):
+    """Combine the aggregates of the same interval from
+    two sets of data.
+
+    Args:
+        agg1, agg2: dicts of "mean", "min", "max", "count", for one
+            interval, as returned by aggregate().
+
+    Returns:
+        A dict of the combined aggregates.
+    """
+    count = agg1["count"] + agg2["count"]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.where(
+            count > 0,
+            (np.nan_to_num(agg1["mean"]) * agg1["count"] +
+             np.nan_to_num(agg2["mean"]) * agg2["count"]) / count,
+            float('nan'))
+    return {
+        "mean": mean,
+        "min": np.fmin(agg1["min"], agg2["min"]),
+        "max": np.fmax(agg1["max"], agg2["max"]),
+        "count": count,
+    }
+
+def _conform(data, shape):
+    """Pad with NaN, or clip, the non-time dimensions of data to shape.
+    """
+    shape = (data.shape[0],) + tuple(shape)
+    if data.shape == shape:
+        return data
+    res = np.full(shape, float('nan'))
+    idx = tuple(slice(0, min(n, m)) for n, m in zip(data.shape, shape))
+    res[idx] = data[idx]
+    return res
+
+class Pyramid(object):
+    """Multi-resolution aggregates of the time-series variables
+    of a NetCDFDataset, stored in a directory.
+
+    Files in the directory:
+        pyramid.json: the state of the store, a dict containing
+            'levels': list of the aggregation levels, in seconds,
+            'variables': dict by exported variable name of
+                'key': name of the variable in the .npz files,
+                'dimnames': names of the non-time dimensions,
+                'shape': lengths of the non-time dimensions,
+                'dim2' and 'stnnames': as returned by
+                    NetCDFDataset.read_time_series,
+            'skipped': variables which are not aggregated, because
+                time is not their first dimension,
+            'end_time': time of the last record that was aggregated,
+            'last_file_time': time of the last data file,
+            'dirty': True while an update is in progress.
+        files.json: modification times of the data files, by path.
+        L<level>/<partition>.npz: the aggregates of a level,
+            'time': start times of the intervals,
+            '<key>.<aggregate>': an aggregate of a variable.
+    """
+
+    STATE_FILE = "pyramid.json"
+
+    FILES_FILE = "files.json"
+
+    LOCK_FILE = "pyramid.lock"
+
+    def __init__(self, path):
+        """Construct a Pyramid stored in a directory.
+
+        Args:
+            path: Path of the sidecar directory of the store.
+        """
+        self.path = path
+
+    def __str__(self):
+        return "Pyramid, path=" + str(self.path)
+
+    def _read_json(self, name):
+        """Read a JSON file in the store, returning None if it
+        doesn't exist or cannot be read.
+        """
+        try:
+            with open(os.path.join(self.path, name), 'r') as fobj:
+                return json.load(fobj)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as exc:
+            _logger.error("%s: %s: %s", self, name, exc)
+            return None
+
+    def _write_file(self, name, writer):
+        """Write a file in the store to a temporary name,
+        then rename it.
+
+        Args:
+            name: Path of the file, relative to the store directory.
+            writer: function which writes the contents to a file object.
+        """
+        fpath = os.path.join(self.path, name)
+        os.makedirs(os.path.dirname(fpath), exist_ok=True)
+        (fd, tmppath) = tempfile.mkstemp(
+            dir=os.path.dirname(fpath), suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'wb') as fobj:
+                writer(fobj)
+            os.replace(tmppath, fpath)
+        except:
+            os.unlink(tmppath)
+            raise
+
+    def _write_json(self, name, obj):
+        """Write a JSON file in the store."""
+        self._write_file(
+            name, lambda fobj: fobj.write(bytes(json.dumps(obj), 'utf-8')))
+
+    def get_state(self):
+        """Return the state of the store, or None if it has
+        not been built, or an update is in progress.
+        """
+        state = self._read_json(Pyramid.STATE_FILE)
+        if not state or state['dirty']:
+            return None
+        return state
+
+    @staticmethod
+    def select_level(state, resolution):
+        """Return the coarsest level of a store whose interval is no
+        longer than the requested resolution, or None if no
+        level is fine enough.
+
+        Args:
+            state: state of the store, as returned by get_state().
+            resolution: Requested time resolution, in seconds.
+        """
+        levels = [lev for lev in state['levels'] if lev <= resolution]
+        if not levels:
+            return None
+        return max(levels)
+
+    def _partition_path(self, level, ipart):
+        return os.path.join("L{}".format(level), "{}.npz".format(ipart))
+
+    def _load_partition(self, level, ipart):
+        """Return the contents of a partition as a dict, or None
+        if it doesn't exist.
+        """
+        try:
+            with np.load(os.path.join(
+                    self.path, self._partition_path(level, ipart))) as npz:
+                return {key: npz[key] for key in npz.files}
+        except FileNotFoundError:
+            return None
+
+    def read(
+            self, variables, start_time, end_time, resolution,
+            selectdim=None, size_limit=1000 * 1000 * 1000):
+        """Read the mean values of variables within a time period,
+        at the coarsest level that meets the requested resolution.
+
+        Args:
+            variables: A list of exported variable names.
+            start_time: A timezone aware datetime, of the start
+                of the period to read.
+            end_time: A timezone aware datetime, of the end of the period.
+            resolution: Requested time resolution, in seconds.
+            selectdim: A dict of the indices to read of a dimension,
+                as passed to NetCDFDataset.read_time_series.
+            size_limit: Limit on the total size in bytes to read.
+
+        Returns:
+            None if the store cannot satisfy the request, because it
+            has not been built, no level is fine enough, or a variable
+            is not in the store. Otherwise a tuple of the time of
+            the last record in the store, and a dict for a series
+            named '', in the form returned by
+            NetCDFDataset.read_time_series, with these additional elements:
+                'resolution': the level that was read, in seconds,
+                'min', 'max', 'count': lists of the other aggregates
+                    of each variable, in the same order as 'data'.
+            The times are the middle of each interval.
+
+        Raises:
+            nc_exc.TooMuchDataException
+        """
+
+        state = self.get_state()
+        if not state:
+            return None
+
+        level = Pyramid.select_level(state, resolution)
+        if not level:
+            return None
+
+        pvars = state['variables']
+        if not all(vname in pvars for vname in variables):
+            return None
+
+        if not selectdim:
+            selectdim = {}
+
+        plen = level * PARTITION_LEN
+        tstart = np.floor(start_time.timestamp() / level) * level
+        tend = end_time.timestamp()
+
+        parts = []
+        for ipart in range(
+                int(np.floor(tstart / plen)), int(np.floor(tend / plen)) + 1):
+            part = self._load_partition(level, ipart)
+            if part:
+                parts.append(part)
+
+        btimes = np.concatenate(
+            [part['time'] for part in parts] + [np.empty(0)])
+        tslice = slice(
+            int(np.searchsorted(btimes, tstart, side='left')),
+            int(np.searchsorted(btimes, tend, side='left')))
+
+        # middle of the intervals, not beyond the last record
+        times = np.minimum(btimes[tslice] + level / 2., state['end_time'])
+
+        ser_data = {
+            'time': times,
+            'data': [],
+            'min': [],
+            'max': [],
+            'count': [],
+            'vmap': {},
+            'dim2': {},
+            'stnnames': {},
+            'resolution': level,
+        }
+
+        total_size = times.nbytes
+        for vname in variables:
+            pvar = pvars[vname]
+
+            # indices of the selected dimensions
+            idx = (slice(None),)
+            stnnames = pvar['stnnames']
+            for dim, dimlen in zip(pvar['dimnames'], pvar['shape']):
+                if dim in selectdim:
+                    sel = [i for i in selectdim[dim] if i < dimlen]
+                    if not sel:
+                        break
+                    idx += (sel,)
+                    if dim == "station" and stnnames:
+                        stnnames = [stnnames[i] for i in sel]
+                else:
+                    idx += (slice(None),)
+            else:
+                ser_data['vmap'][vname] = len(ser_data['data'])
+                for agg in AGGREGATES:
+                    key = pvar['key'] + "." + agg
+                    vals = np.concatenate(
+                        [part[key] for part in parts] +
+                        [np.empty((0,) + tuple(pvar['shape']))])[tslice]
+                    # select one dimension at a time, since numpy
+                    # indexes multiple lists together
+                    for idim, sel in enumerate(idx[1:], 1):
+                        if isinstance(sel, list):
+                            vals = np.take(vals, sel, axis=idim)
+                    total_size += vals.nbytes
+                    if total_size > size_limit:
+                        raise nc_exc.TooMuchDataException(
+                            "too much data requested, will exceed {} mbytes".
+                            format(size_limit/(1000 * 1000)))
+                    ser_data['data' if agg == "mean" else agg].append(vals)
+                if pvar['dim2']:
+                    ser_data['dim2'][vname] = pvar['dim2']
+                if stnnames:
+                    ser_data['stnnames'][vname] = stnnames
+
+        return (state['end_time'], {'': ser_data})
+
+    def update(
+            self, ncdset, levels=LEVELS, rebuild=False,
+            chunk=timedelta(days=1)):
+        """Update the store from the files of a NetCDFDataset.
+
+        If the modification times of the files in the dataset show
+        that only files containing data after the last record
+        aggregated have changed, such as a growing real-time
+        file, then only the new records are read and aggregated.
+        Otherwise the store is rebuilt from all the files.
+
+        Args:
+            ncdset: The NetCDFDataset.
+            levels: The aggregation levels, in seconds.
+            rebuild: If True, rebuild the store.
+            chunk: timedelta of data to read and aggregate at a time.
+
+        Returns:
+            The number of records aggregated.
+
+        Raises:
+            OSError
+            BlockingIOError: another update is in progress.
+        """
+
+        os.makedirs(self.path, exist_ok=True)
+
+        with open(os.path.join(self.path, Pyramid.LOCK_FILE), 'w') as lockf:
+            fcntl.flock(lockf, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return self._update(ncdset, sorted(levels), rebuild, chunk)
+
+    def _update(self, ncdset, levels, rebuild, chunk):
+        """Implementation of update(), while holding the lock."""
+
+        files = ncdset.get_files()
+        if not files:
+            return 0
+
+        mtimes = {}
+        for fset_file in files:
+            try:
+                mtimes[fset_file.path] = os.stat(fset_file.path).st_mtime
+            except OSError as exc:
+                _logger.warning("%s: %s", fset_file.path, exc)
+
+        state = self._read_json(Pyramid.STATE_FILE)
+        old_mtimes = self._read_json(Pyramid.FILES_FILE) or {}
+        variables = ncdset.get_variables()
+
+        reason = None
+        if rebuild:
+            reason = "rebuild requested"
+        elif not state:
+            reason = "new store"
+        elif state['dirty']:
+            reason = "previous update did not complete"
+        elif state['levels'] != levels:
+            reason = "levels changed"
+        elif sorted(variables) != sorted(
+                list(state['variables']) + state['skipped']):
+            reason = "variables changed"
+        elif any(path not in mtimes for path in old_mtimes):
+            reason = "files removed"
+        else:
+            for fset_file in files:
+                path = fset_file.path
+                if path in mtimes and old_mtimes.get(path) != mtimes[path] \
+                        and fset_file.time.timestamp() < state['last_file_time']:
+                    reason = "{} modified".format(path)
+                    break
+
+        if reason:
+            _logger.info("%s: rebuilding: %s", self, reason)
+            for level in levels + state['levels'] if state else levels:
+                shutil.rmtree(
+                    os.path.join(self.path, "L{}".format(level)),
+                    ignore_errors=True)
+            state = {
+                'levels': levels,
+                'variables': {},
+                'skipped': [],
+                'end_time': None,
+                'last_file_time': None,
+            }
+            start_time = max(files[0].time, ncdset.start_time)
+        else:
+            start_time = datetime.fromtimestamp(
+                state['end_time'], tz=timezone.utc)
+
+        end_time = min(datetime.now(timezone.utc), ncdset.end_time)
+
+        state['dirty'] = True
+        self._write_json(Pyramid.STATE_FILE, state)
+
+        nrecs = 0
+        tchunk = start_time
+        while tchunk < end_time:
+            tnext = min(tchunk + chunk, end_time)
+            nrecs += self._update_chunk(
+                ncdset, state, sorted(variables), tchunk, tnext)
+            tchunk = tnext
+
+        state['last_file_time'] = files[-1].time.timestamp()
+        state['dirty'] = False
+        self._write_json(Pyramid.FILES_FILE, mtimes)
+        self._write_json(Pyramid.STATE_FILE, state)
+
+        return nrecs
+
+    def _update_chunk(self, ncdset, state, variables, start_time, end_time):
+        """Read and aggregate the records of a period of time.
+
+        Returns:
+            The number of records aggregated.
+        """
+
+        try:
+            indata = ncdset.read_time_series(
+                variables, start_time=start_time, end_time=end_time)
+        except nc_exc.NoDataException:
+            return 0
+
+        ser_data = indata['']
+        times = ser_data['time']
+        ntimes = len(times)
+
+        def select_times(sel):
+            """Apply an index to the times and time series data."""
+            ser_data['data'] = [
+                (vdata[sel] if vdata.ndim > 0 and vdata.shape[0] == ntimes
+                 else vdata) for vdata in ser_data['data']]
+            return times[sel]
+
+        # skip records already in the store
+        if state['end_time'] is not None:
+            newer = times > state['end_time']
+            if not np.all(newer):
+                times = select_times(newer)
+                ntimes = len(times)
+
+        if ntimes == 0:
+            return 0
+
+        if np.any(np.diff(times) < 0):
+            times = select_times(np.argsort(times, kind='stable'))
+
+        dsinfo_vars = ncdset.get_dataset_info()['variables']
+
+        pvars = state['variables']
+        vdatas = {}
+        for vname, vindex in ser_data['vmap'].items():
+            vdata = ser_data['data'][vindex]
+            if vdata.ndim == 0 or vdata.shape[0] != len(times):
+                # time is not the first dimension
+                if vname not in state['skipped']:
+                    state['skipped'].append(vname)
+                continue
+            if vname not in pvars:
+                pvars[vname] = {
+                    'key': "v{}".format(len(pvars)),
+                    'dimnames': [
+                        dim for dim in dsinfo_vars[vname]['dimnames'][1:]
+                        if dim != "sample"],
+                    'shape': list(vdata.shape[1:]),
+                    'dim2': {},
+                    'stnnames': [],
+                }
+            pvar = pvars[vname]
+            if not pvar['dim2'] and vname in ser_data['dim2']:
+                pvar['dim2'] = ser_data['dim2'][vname]
+            if not pvar['stnnames'] and vname in ser_data['stnnames']:
+                pvar['stnnames'] = ser_data['stnnames'][vname]
+            vdatas[vname] = _conform(vdata, pvar['shape'])
+
+        # variables in the dataset which were not returned
+        for vname in variables:
+            if vname not in pvars and vname not in state['skipped']:
+                state['skipped'].append(vname)
+
+        for level in state['levels']:
+            self._update_level(level, times, vdatas, pvars)
+
+        state['end_time'] = float(times[-1])
+        return len(times)
+
+    def _update_level(self, level, times, vdatas, pvars):
+        """Aggregate new records into the partitions of a level."""
+
+        aggs = {}
+        btimes = None
+        for vname, vdata in vdatas.items():
+            (btimes, aggs[vname]) = aggregate(times, vdata, level)
+
+        plen = level * PARTITION_LEN
+        iparts = np.floor(btimes / plen).astype(np.int64)
+
+        for ipart in np.unique(iparts):
+            psel = iparts == ipart
+
+            new = {'time': btimes[psel]}
+            for vname, agg in aggs.items():
+                key = pvars[vname]['key']
+                for aname in AGGREGATES:
+                    new[key + "." + aname] = agg[aname][psel]
+
+            old = self._load_partition(level, ipart)
+            if old and len(old['time']) > 0:
+                # Variables which were not read are missing in the
+                # new intervals, and vice versa.
+                nold = len(old['time'])
+                nnew = len(new['time'])
+                for vname, pvar in pvars.items():
+                    for aname in AGGREGATES:
+                        key = pvar['key'] + "." + aname
+                        fill = 0 if aname == "count" else float('nan')
+                        shape = tuple(pvar['shape'])
+                        if key not in old:
+                            old[key] = np.full((nold,) + shape, fill)
+                        if key not in new:
+                            new[key] = np.full((nnew,) + shape, fill)
+
+                # first new interval is a continuation of the last old one
+                if old['time'][-1] == new['time'][0]:
+                    for vname, pvar in pvars.items():
+                        key = pvar['key']
+                        merged = merge_aggregates(
+                            {aname: old[key + "." + aname][-1]
+                             for aname in AGGREGATES},
+                            {aname: new[key + "." + aname][0]
+                             for aname in AGGREGATES})
+                        for aname in AGGREGATES:
+                            old[key + "." + aname][-1] = merged[aname]
+                    new = {key: vals[1:] for key, vals in new.items()}
+
+                new = {key: np.concatenate((old[key], new[key]))
+                       for key in new}
+
+            part = {'time': new['time']}
+            for key, vals in new.items():
+                if key.endswith(".count"):
+                    part[key] = vals.astype(np.int32)
+                elif key != 'time':
+                    part[key] = vals.astype(np.float32)
+
+            self._write_file(
+                self._partition_path(level, ipart),
+                lambda fobj, part=part: np.savez(fobj, **part))
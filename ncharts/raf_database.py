@@ -14,13 +14,14 @@ file LICENSE in this package.
 
 from datetime import datetime, timezone
 import logging
-import sys
 import threading
 import numpy as np
 
 import psycopg2
 
 from ncharts import exceptions as nc_exc
+from ncharts import cache as nc_cache
+from ncharts import netcdf as nc_netcdf
 
 if __name__ == '__main__':
     logging.basicConfig(level=logging.DEBUG)
@@ -34,6 +35,9 @@ class RAFDatabase(object):
     __cached_connections = {}
     __cache_lock = threading.Lock()
 
+    # reads in progress by all RAFDatabases
+    __reads = nc_cache.SingleFlight('raf_reads')
+
     @staticmethod
     def get_connection(
             database="real-time-GV",
@@ -193,6 +197,9 @@ class RAFDatabase(object):
             end_time=datetime.max.replace(tzinfo=timezone.utc)):
         """Read datetimes from the table within a range.
 
+        Returns:
+            A numpy.ndarray of float64 UTC timestamps.
+
         Raises:
             nc_exc.NoDataException
         """
@@ -207,12 +214,17 @@ class RAFDatabase(object):
         try:
             with self.conn as conn:
                 with conn.cursor() as cur:
-                # datetimes in database are returned to python as timezone naive.
+                # datetimes in database are timezone naive, in UTC.
+                # EXTRACT(EPOCH) of a timestamp without time zone is
+                # the number of seconds since 1970-01-01 00:00:00,
+                # without regard to timezone.
                     cur.execute(
-                        "SELECT {} FROM {} WHERE {} >= %s AND {} < %s;"
+                        "SELECT EXTRACT(EPOCH FROM {}) FROM {} WHERE {} >= %s AND {} < %s;"
                         .format(vname, self.table, vname, vname),
                         (start_time, end_time))
-                    return [x[0].replace(tzinfo=timezone.utc).timestamp() for x in cur]
+                    return np.fromiter(
+                        (float(x[0]) for x in cur), dtype=np.float64,
+                        count=cur.rowcount)
         except psycopg2.Error as exc:
             RAFDatabase.close_connection(conn)
             raise nc_exc.NoDataException(
@@ -268,7 +280,7 @@ class RAFDatabase(object):
             A one element dict, compatible with that returned by
             netcdf.read_time_series(), containing for a series_name of '':
             {
-                'time' : list of UTC timestamps,
+                'time' : numpy.ndarray of float64 UTC timestamps,
                 'data': lists of numpy.ndarray containing
                     the data for each variable,
                 'vmap': dict by variable name,
@@ -276,10 +288,32 @@ class RAFDatabase(object):
                 'dim2': dict by variable name, of values for second
                     dimension of the data, such as height.
             }
+            Concurrent calls for the same variables and times are
+            coalesced into one read, whose result is shared. The numpy
+            arrays of the result should not be modified in place.
+
         Raises:
             nc_exc.NoDataException
         """
 
+        key = (
+            self.database, self.host, self.port, self.table,
+            tuple(variables), start_time, end_time, size_limit)
+
+        return RAFDatabase.__reads.do(
+            key,
+            lambda: self.do_read_time_series(
+                variables, start_time, end_time, size_limit),
+            copy=nc_netcdf.copy_time_series)
+
+    def do_read_time_series(self, variables, start_time, end_time, size_limit):
+        """Read times and variables from the table within a time period,
+        without coalescing concurrent reads.
+
+        Args:
+            See read_time_series().
+        """
+
         total_size = 0
 
         start_time = start_time.replace(tzinfo=None)
@@ -288,7 +322,7 @@ class RAFDatabase(object):
         vtime = self.read_times(start_time=start_time, end_time=end_time)
         # _logger.debug("read_times, len=%d", len(vtime))
 
-        total_size += sys.getsizeof(vtime)
+        total_size += vtime.nbytes
         if total_size > size_limit:
             raise nc_exc.TooMuchDataException(
                 "too many time values requested, size={0} MB".\
@@ -341,7 +375,7 @@ class RAFDatabase(object):
                             # _logger.debug("is MaskedArray")
                             cdata = cdata.filled(fill_value=float('nan'))
 
-                        total_size += sys.getsizeof(cdata)
+                        total_size += cdata.nbytes
                         if total_size > size_limit:
                             raise nc_exc.TooMuchDataException(
                                 "too many values requested, size={0} MB".\
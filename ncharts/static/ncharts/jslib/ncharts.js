@@ -877,6 +877,14 @@
             var ser_data = plot_data[sname];
             var ser_stn_names = plot_stns[sname];
 
+            // Means read from aggregates are plotted over the
+            // range of their minimums and maximums.
+            var ser_envelope = null;
+            if (window.plot_envelope !== undefined && sname in plot_envelope) {
+                ser_envelope = plot_envelope[sname];
+            }
+            var colors = Highcharts.getOptions().colors;
+
             for (var iv = 0; iv < vnames.length; iv++ ) {
                 var vname = vnames[iv];
                 if (!(vname in plot_vmap[sname])) continue;
@@ -938,7 +946,50 @@
 
                     // which axis does this one belong to? Will always be 0
                     vseries['yAxis'] = unique_units.indexOf(vunit);
-                    series.push(vseries);
+
+                    if (ser_envelope !== null) {
+                        var var_min = ser_envelope['min'][var_index];
+                        var var_max = ser_envelope['max'][var_index];
+                        var var_count = ser_envelope['count'][var_index];
+                        var rdata = [];
+                        var rcount = [];
+                        for (idata = 0; idata < ser_times.length; idata++) {
+                            var vmin = var_min[idata];
+                            var vmax = var_max[idata];
+                            var vcount = var_count[idata];
+                            if (stn_name.length > 0) {
+                                vmin = vmin[stn_index];
+                                vmax = vmax[stn_index];
+                                vcount = vcount[stn_index];
+                            }
+                            rdata.push([(ser_time0 + ser_times[idata])*1000,
+                                    vmin, vmax]);
+                            rcount.push(vcount);
+                        }
+                        var color = colors[series.length / 2 % colors.length];
+                        vseries['color'] = color;
+                        vseries['zIndex'] = 1;
+                        series.push(vseries);
+
+                        var rname = plotvname + ' range';
+                        local_ns.long_name_dict[rname] =
+                            local_ns.long_name_dict[plotvname];
+                        series.push({
+                            name: rname,
+                            type: 'arearange',
+                            data: rdata,
+                            counts: rcount,
+                            linkedTo: ':previous',
+                            color: color,
+                            fillOpacity: 0.3,
+                            lineWidth: 0,
+                            zIndex: 0,
+                            yAxis: vseries['yAxis'],
+                        });
+                    }
+                    else {
+                        series.push(vseries);
+                    }
                     if (local_ns.debug_level > 1) {
                         console.log("initial, plotvname=",plotvname,", series[",iv,"].length=",
                                 series[iv].data.length);
@@ -1041,7 +1092,16 @@
                     formatter: function() {
                         s = '<span style="font-size: 10px"><b>' + Highcharts.dateFormat('%Y-%m-%d %H:%M:%S.%L %Z',this.x) + '</b></span><br/>';
                         $.each(this.points, function(i, point) {
-                            s += '<span style="color:' + point.series.color + '">\u25CF</span>' + local_ns.long_name_dict[point.series.name] + ',' + point.series.name + ': <b>' + point.y + '</b><br/>';
+                            var value = point.y;
+                            if (point.point.low !== undefined) {
+                                // envelope of a mean, and its number of records
+                                value = point.point.low + ' to ' + point.point.high;
+                                var counts = point.series.options.counts;
+                                if (counts) {
+                                    value += ', n=' + counts[point.point.index];
+                                }
+                            }
+                            s += '<span style="color:' + point.series.color + '">\u25CF</span>' + local_ns.long_name_dict[point.series.name] + ',' + point.series.name + ': <b>' + value + '</b><br/>';
                         });
                         return s;
                     },
@@ -1436,7 +1496,9 @@
             } 
             // mean delta-t of data
             local_ns.ajaxTimeout = 10 * 1000;   // 10 seconds
-            if ('' in plot_times && plot_times[''].length > 1) {
+            // decimated times don't give the data deltat
+            if ('' in plot_times && plot_times[''].length > 1 &&
+                    !(window.plot_decimated !== undefined && plot_decimated[''])) {
                 // set ajax update period to 1/2 the data deltat
                 local_ns.ajaxTimeout = Math.max(local_ns.ajaxTimeout, Math.ceil((plot_times[''][plot_times[''].length-1] - plot_times[''][0]) / (plot_times[''].length - 1) * 1000 / 2));
             }
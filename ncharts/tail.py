@@ -0,0 +1,391 @@
+# -*- mode: python; indent-tabs-mode: nil; c-basic-offset: 4; tab-width: 4; -*-
+# vim: set shiftwidth=4 softtabstop=4 expandtab:
+
+"""Buffers of the newest records of the variables of real-time
+datasets, shared by the clients which poll them.
+
+Every client plotting a real-time dataset polls it for the records
+after the last one it has received, and without a buffer each poll
+reads the files, or database, from that time. A TailBuffer keeps the
+records of a variable from the last length seconds. It is updated by
+the first poll which asks for times after its last read, by reading
+only the records after its last non-missing value, and the other
+polls are answered by slicing it, without any reads. The buffers
+of the variables of a poll are updated with one read.
+
+The records of a buffer are kept in arrays with room for more, and
+those of an update are appended, so that it costs the number of new
+records, not the length of the buffer. The records returned to
+clients are not modified by later updates, so their slices remain
+valid: only the records after the last non-missing value are re-read,
+and those are copied when returned, and the arrays are reallocated
+if other records returned to clients would be replaced.
+
+2014 Copyright University Corporation for Atmospheric Research
+
+This file is part of the "django-ncharts" package.
+The license and distribution terms for this file may be found in the
+file LICENSE in this package.
+"""
+
+import contextlib
+import logging
+import threading
+from datetime import datetime, timezone
+
+import numpy as np
+
+from ncharts import exceptions as nc_exc
+from ncharts import cache as nc_cache
+
+_logger = logging.getLogger(__name__)   # pylint: disable=invalid-name
+
+def get_last_ok(data):
+    """Return the index of the last time of an array of data, whose
+    first dimension is time, which has a non-missing value,
+    or -1 if all are missing."""
+    if data.dtype.kind not in 'fc':
+        return len(data) - 1
+    iok = np.where(~np.isnan(data))[0]
+    return int(iok[-1]) if len(iok) else -1
+
+class TailBuffer(object):
+    """The records of one variable of a dataset, from start
+    up to end.
+
+    Attributes:
+        vname: Name of the variable.
+        start: UTC timestamp. All records at or after start, and
+            before end, are in the buffer.
+        end: UTC timestamp, end of the last read.
+        ser_data: The dict of the series of the variable from
+            read_time_series(), or None if no records have been read.
+            Its arrays are views of times and values.
+        times: numpy array of the times of the buffer, with room for more.
+        values: numpy array of the values of the buffer, whose first
+            dimension is time.
+        first: Index in times and values of the first record.
+        nrecs: Index in times and values after the last record.
+        fixed: Index in times and values after the last record
+            with a non-missing value. Later records may be replaced.
+        shared: Index in times and values after the records which
+            have been returned to clients, and must not be modified.
+        lock: Mutex for the buffer, held during updates.
+    """
+
+    __length = 0
+
+    __buffers = nc_cache.LRUCache(
+        'tail_buffers', max_entries=1000, max_bytes=500 * 1000 * 1000,
+        sizeof=lambda buf: buf.approx_size())
+
+    def __init__(self, vname):
+        """Construct an empty TailBuffer.
+
+        Args:
+            vname: Name of the variable.
+        """
+        self.vname = vname
+        self.start = None
+        self.end = None
+        self.ser_data = None
+        self.times = None
+        self.values = None
+        self.first = 0
+        self.nrecs = 0
+        self.fixed = 0
+        self.shared = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def configure(length):
+        """Set the length of the buffers.
+
+        Args:
+            length: Seconds of records kept in a buffer. If 0,
+                buffers are not used.
+        """
+        TailBuffer.__length = length or 0
+        TailBuffer.__buffers.clear()
+
+    @staticmethod
+    def read(source, read_func, start_times, end_time):
+        """Return the records of variables of a dataset, from a start
+        time for each variable, to an end time. Those of variables
+        whose start times are within the length of the buffers are
+        returned from their buffers, which are updated if necessary.
+
+        The variables are read together, by one call of read_func
+        from the earliest time needed, for those read from the
+        dataset, and one for those whose buffers need updating.
+
+        Args:
+            source: A hashable value identifying a dataset, and any
+                selection of its dimensions.
+            read_func: Function of a list of variable names, and a
+                start and end datetime.datetime, which reads the
+                variables as read_time_series().
+            start_times: dict of datetime.datetime by variable name,
+                start of the records needed of each variable.
+            end_time: datetime.datetime, end of the period.
+
+        Returns:
+            A dict by variable name of the series of the variables
+            which have records, each as a series of read_time_series()
+            of the one variable. Their numpy arrays must not be
+            modified in place.
+
+        Raises:
+            OSError
+            nc_exc.TooMuchDataException
+        """
+        length = TailBuffer.__length
+        tend = end_time.timestamp()
+
+        res_data = {}
+
+        direct = sorted(
+            vname for (vname, start_time) in start_times.items()
+            if length <= 0 or start_time.timestamp() < tend - length)
+        if direct:
+            indata = TailBuffer.read_variables(
+                read_func, direct,
+                min(start_times[vname] for vname in direct), end_time)
+            for vname in direct:
+                ser_data = TailBuffer.slice_series(
+                    TailBuffer.get_series(indata, vname),
+                    start_times[vname].timestamp(), tend)
+                if ser_data:
+                    res_data[vname] = ser_data
+
+        buffered = sorted(
+            vname for vname in start_times if vname not in direct)
+        if not buffered:
+            return res_data
+
+        bufs = [
+            TailBuffer.__buffers.get_or_create(
+                (source, vname), lambda vname=vname: TailBuffer(vname))
+            for vname in buffered]
+
+        # Buffers are locked in order of variable name, which
+        # is the same for all calls with this source.
+        with contextlib.ExitStack() as stack:
+            for buf in bufs:
+                stack.enter_context(buf.lock)
+
+            from_times = {}
+            for buf in bufs:
+                from_time = buf.get_read_start(
+                    start_times[buf.vname].timestamp(), tend)
+                if from_time is not None:
+                    from_times[buf.vname] = from_time
+
+            if from_times:
+                indata = TailBuffer.read_variables(
+                    read_func, sorted(from_times),
+                    datetime.fromtimestamp(
+                        min(from_times.values()), tz=timezone.utc),
+                    end_time)
+                for buf in bufs:
+                    if buf.vname in from_times:
+                        buf.update(
+                            TailBuffer.get_series(indata, buf.vname),
+                            from_times[buf.vname], tend)
+
+            for buf in bufs:
+                buf.trim(tend - length)
+                ser_data = buf.slice(start_times[buf.vname].timestamp(), tend)
+                if ser_data:
+                    res_data[buf.vname] = ser_data
+
+        for vname in buffered:
+            TailBuffer.__buffers.resize((source, vname))
+
+        return res_data
+
+    @staticmethod
+    def read_variables(read_func, vnames, start_time, end_time):
+        """Call read_func, returning an empty dict if there are
+        no records."""
+        try:
+            return read_func(vnames, start_time, end_time)
+        except nc_exc.NoDataException:
+            return {}
+
+    @staticmethod
+    def get_series(indata, vname):
+        """Return the series of one variable, from the dict returned
+        by read_time_series(), or None if it has no records of it."""
+        ser_data = indata.get('')
+        if not ser_data or vname not in ser_data['vmap'] or \
+                not len(ser_data['time']):
+            return None
+        return {
+            'time': ser_data['time'],
+            'data': [ser_data['data'][ser_data['vmap'][vname]]],
+            'vmap': {vname: 0},
+            'dim2': {
+                key: val for (key, val) in ser_data['dim2'].items()
+                if key == vname},
+            'stnnames': {
+                key: val for (key, val) in
+                ser_data.get('stnnames', {}).items() if key == vname},
+        }
+
+    def get_read_start(self, tstart, tend):
+        """Return the timestamp from which the variable must be read
+        for the records from tstart to tend, or None if they are all in
+        the buffer. The lock must be held."""
+        if self.start is None or tstart < self.start:
+            return tstart
+        if tend <= self.end:
+            return None
+        # Re-read from after the last non-missing value, as the
+        # clients did, in case records are written after their times.
+        if self.ser_data and self.fixed > self.first:
+            return float(self.times[self.fixed - 1]) + 0.001
+        return self.start
+
+    def update(self, new_data, from_time, tend):
+        """Replace the records at and after from_time with those
+        read from from_time to tend. The lock must be held.
+
+        Args:
+            new_data: A series of the variable from get_series(),
+                which may start before from_time, or None if it
+                has no records.
+        """
+        if self.start is None or from_time < self.start:
+            self.start = from_time
+        self.end = tend
+
+        new_data = TailBuffer.slice_series(new_data, from_time, tend)
+        iend = self.first
+        if self.ser_data:
+            iend += int(np.searchsorted(
+                self.ser_data['time'], from_time, side='left'))
+
+        if new_data:
+            ntime = len(new_data['time'])
+            vdata = new_data['data'][0]
+            if self.ser_data and vdata.shape[1:] != self.values.shape[1:]:
+                # the other dimensions of the variable have changed
+                _logger.warning(
+                    "tail buffer %s: shape of records changed from %s to %s",
+                    self.vname, self.values.shape[1:], vdata.shape[1:])
+                self.start = from_time
+                self.ser_data = None
+                iend = self.first
+
+            if not self.ser_data:
+                iend = self.allocate(iend, 2 * ntime, vdata.dtype, vdata.shape)
+            elif iend < self.shared or iend + ntime > len(self.times) or \
+                    np.result_type(self.values, vdata) != self.values.dtype:
+                iend = self.allocate(
+                    iend, 2 * (iend - self.first + ntime),
+                    np.result_type(self.values, vdata), vdata.shape)
+
+            self.times[iend:iend + ntime] = new_data['time']
+            self.values[iend:iend + ntime] = vdata
+            self.nrecs = iend + ntime
+            ilast = get_last_ok(vdata)
+            self.fixed = iend + ilast + 1 if ilast >= 0 else \
+                min(self.fixed, iend)
+            self.publish(new_data)
+        elif self.ser_data:
+            self.nrecs = iend
+            self.fixed = min(self.fixed, iend)
+            self.publish(self.ser_data)
+
+    def allocate(self, iend, size, dtype, shape):
+        """Move the records of the buffer before index iend to new
+        arrays with room for size records. The lock must be held.
+
+        Returns:
+            The index of iend in the new arrays.
+        """
+        nkeep = iend - self.first if self.ser_data else 0
+        times = np.empty((size,), dtype=np.float64)
+        values = np.empty((size,) + tuple(shape[1:]), dtype=dtype)
+        if nkeep > 0:
+            times[:nkeep] = self.times[self.first:iend]
+            values[:nkeep] = self.values[self.first:iend]
+        self.times = times
+        self.values = values
+        self.fixed = min(max(self.fixed - self.first, 0), nkeep)
+        self.first = 0
+        self.shared = 0
+        return nkeep
+
+    def publish(self, ser_data):
+        """Set ser_data to views of the records of the buffer,
+        with the other elements of a series. The lock must be held."""
+        self.ser_data = dict(
+            ser_data, time=self.times[self.first:self.nrecs],
+            data=[self.values[self.first:self.nrecs]])
+
+    def trim(self, cut):
+        """Remove the records before cut. The lock must be held."""
+        if self.start is None or cut <= self.start:
+            return
+        self.start = cut
+        if self.ser_data:
+            self.first += int(np.searchsorted(
+                self.ser_data['time'], cut, side='left'))
+            self.fixed = max(self.fixed, self.first)
+            self.publish(self.ser_data)
+
+    def slice(self, tstart, tend):
+        """Return a series of the records of the buffer between two
+        timestamps, as slice_series(). If it has records after the
+        last non-missing value, which may be replaced by an update,
+        its arrays are copies, otherwise views. The lock must be held.
+        """
+        if not self.ser_data:
+            return None
+        times = self.ser_data['time']
+        istart = self.first + int(np.searchsorted(times, tstart, side='left'))
+        iend = self.first + int(np.searchsorted(times, tend, side='left'))
+        if iend <= istart:
+            return None
+        time = self.times[istart:iend]
+        vdata = self.values[istart:iend]
+        if iend > self.fixed:
+            time = time.copy()
+            vdata = vdata.copy()
+        else:
+            self.shared = max(self.shared, iend)
+        return {
+            'time': time,
+            'data': [vdata],
+            'vmap': dict(self.ser_data['vmap']),
+            'dim2': dict(self.ser_data['dim2']),
+            'stnnames': dict(self.ser_data['stnnames']),
+        }
+
+    @staticmethod
+    def slice_series(ser_data, tstart, tend):
+        """Return a series of the records of a one variable series
+        between two timestamps, or None if there are none."""
+        if not ser_data:
+            return None
+        times = ser_data['time']
+        istart = int(np.searchsorted(times, tstart, side='left'))
+        iend = int(np.searchsorted(times, tend, side='left'))
+        if iend <= istart:
+            return None
+        return {
+            'time': times[istart:iend],
+            'data': [ser_data['data'][0][istart:iend]],
+            'vmap': dict(ser_data['vmap']),
+            'dim2': dict(ser_data['dim2']),
+            'stnnames': dict(ser_data['stnnames']),
+        }
+
+    def approx_size(self):
+        """Return the approximate size of the buffer in bytes,
+        including the room for more records."""
+        if not self.ser_data:
+            return 1000
+        return 1000 + self.times.nbytes + self.values.nbytes
@@ -0,0 +1,111 @@
+# -*- mode: python; indent-tabs-mode: nil; c-basic-offset: 4; tab-width: 4; -*-
+# vim: set shiftwidth=4 softtabstop=4 expandtab:
+
+"""Benchmark of the enumeration of a fileset directory tree.
+
+Compares Dir.glob(), which makes one os.scandir pass through
+each directory, with the previous enumeration, which used
+glob.iglob and then an os.stat of every match to determine
+whether it was a directory.
+
+Usage:
+    python -m ncharts.tests.bench_fileset [nfiles [tmpdir]]
+
+A synthetic tree of nfiles, default 50000, is created in a
+temporary directory, in tmpdir if given, which is removed
+afterwards. Give a tmpdir on an NFS mount to see the effect
+of the extra stats on a network file system.
+
+2014 Copyright University Corporation for Atmospheric Research
+
+This file is part of the "django-ncharts" package.
+The license and distribution terms for this file may be found in the
+file LICENSE in this package.
+"""
+
+import glob
+import os
+import stat
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+from ncharts import fileset as nc_fileset
+
+PATHREM = os.path.join('%Y', '%m', 'f_%Y%m%d_%H%M.nc')
+
+def make_tree(rootdir, nfiles):
+    """Create nfiles empty files, every 10 minutes, in year and
+    month sub-directories of rootdir."""
+
+    ftime = datetime(2014, 1, 1, tzinfo=timezone.utc)
+    for _ in range(nfiles):
+        path = ftime.strftime(os.path.join(rootdir, PATHREM))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        open(path, 'w').close()
+        ftime += timedelta(minutes=10)
+
+def glob_stat(path, pathdesc, pathrem):
+    """Enumerate a tree as Dir.glob() did before scandir,
+    returning the number of files and stat calls."""
+
+    (nextpath, pathrem) = nc_fileset.pathsplit(pathrem)
+    pathdesc = os.path.join(pathdesc, nextpath)
+    nfiles = 0
+    nstats = 0
+    globpath = nc_fileset.globify_time_descriptors(nextpath)
+    for subpath in glob.iglob(os.path.join(path, globpath)):
+        pstat = os.stat(subpath)
+        nstats += 1
+        if stat.S_ISDIR(pstat.st_mode):
+            (nsub, nsubstats) = glob_stat(subpath, pathdesc, pathrem)
+            nfiles += nsub
+            nstats += nsubstats
+        else:
+            nc_fileset.File(subpath, pathdesc)
+            nfiles += 1
+    return (nfiles, nstats)
+
+def scandir(path, pathdesc, pathrem):
+    """Enumerate a tree with Dir.glob(), returning the number of files."""
+
+    (files, subdirs) = nc_fileset.Dir(path, pathdesc, pathrem).glob()
+    nfiles = len(files)
+    for pdir in subdirs:
+        nfiles += scandir(pdir.path, pdir.pathdesc, pdir.pathrem)
+    return nfiles
+
+def best_time(func, *args, repeat=5):
+    """Return the minimum elapsed time of repeated calls of func,
+    and its result."""
+
+    elapsed = []
+    for _ in range(repeat):
+        tstart = time.perf_counter()
+        result = func(*args)
+        elapsed.append(time.perf_counter() - tstart)
+    return (min(elapsed), result)
+
+def main():
+    """Create a tree and time its enumeration."""
+
+    nfiles = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    tmpdir = sys.argv[2] if len(sys.argv) > 2 else None
+
+    with tempfile.TemporaryDirectory(dir=tmpdir) as rootdir:
+        make_tree(rootdir, nfiles)
+
+        (tglob, (nglob, nstats)) = best_time(
+            glob_stat, rootdir, rootdir, PATHREM)
+        (tscan, nscan) = best_time(
+            scandir, rootdir, rootdir, PATHREM)
+        assert nglob == nscan == nfiles
+
+        print("%d files in %s" % (nfiles, rootdir))
+        print("iglob + stat: %8.3f s, %d stats" % (tglob, nstats))
+        print("scandir:      %8.3f s, %.1f times faster" % \
+            (tscan, tglob / tscan))
+
+if __name__ == '__main__':
+    main()
@@ -9,18 +9,31 @@ The license and distribution terms for this file may be found in the
 file LICENSE in this package.
 """
 
+import concurrent.futures
 import os
+import shutil
+import tempfile
+import threading
+import time
 
 from django import test
 
 from ncharts import models as nc_models
 from ncharts import forms as nc_forms
 from ncharts import netcdf as nc_netcdf
+from ncharts import fileset as nc_fileset
+from ncharts import decimate as nc_decimate
+from ncharts import pyramid as nc_pyramid
+from ncharts import cache as nc_cache
+from ncharts import tail as nc_tail
+from ncharts import exceptions as nc_exc
 
 from datetime import datetime, timedelta, timezone
 
 from django.conf import settings
 
+import numpy as np
+import netCDF4
 import numpy.testing as ntp
 
 class ModelTestCase(test.TestCase):
@@ -28,6 +41,16 @@ class ModelTestCase(test.TestCase):
     def setUp(self):
         """Create some models. """
 
+        # the fileset index, dataset info store and quarantine
+        # of the tests are kept in a temporary directory
+        self.tmpdir = tempfile.mkdtemp()
+        self.fileset_index = os.path.join(self.tmpdir, 'fileset_index.sqlite3')
+        self.dataset_info_dir = os.path.join(self.tmpdir, 'dataset_info')
+        self.quarantine = os.path.join(self.tmpdir, 'netcdf_quarantine.sqlite3')
+        nc_fileset.FilesetIndex.configure(self.fileset_index)
+        nc_netcdf.DatasetInfoStore.configure(self.dataset_info_dir)
+        nc_netcdf.FileQuarantine.configure(self.quarantine)
+
         utctz = nc_models.TimeZone.objects.create(tz='UTC')
         mtntz = nc_models.TimeZone.objects.create(tz='US/Mountain')
 
@@ -58,6 +81,11 @@ class ModelTestCase(test.TestCase):
             end_time=datetime(2012, 10, 11, 0, 0, 0, tzinfo=timezone.utc),
             project=nc_models.Project.objects.get(name="SCP"))
 
+    def tearDown(self):
+        nc_fileset.FilesetIndex.configure(settings.FILESET_INDEX)
+        nc_netcdf.DatasetInfoStore.configure(settings.DATASET_INFO_DIR)
+        nc_netcdf.FileQuarantine.configure(settings.NETCDF_QUARANTINE)
+        shutil.rmtree(self.tmpdir)
 
     def test_models(self):
 
@@ -196,8 +224,9 @@ class ModelTestCase(test.TestCase):
         # check some data values for a given time
         xtime = datetime(2012, 10, 2, 0, 7, 30, tzinfo=timezone.utc).timestamp()
 
+        self.assertEqual(tsd['']['time'].dtype, np.float64)
         self.assertTrue(xtime in tsd['']['time'])
-        ixtime = tsd['']['time'].index(xtime)
+        ixtime = np.where(tsd['']['time'] == xtime)[0][0]
 
         ixtime_expected = int((xtime-start_time.timestamp()) / (5*60))
         self.assertEqual(ixtime, ixtime_expected)
@@ -210,3 +239,810 @@ class ModelTestCase(test.TestCase):
         ntp.assert_allclose(tsd['']['data'][vmap['w.1m']][ixtime], -0.02494044)
         ntp.assert_allclose(tsd['']['data'][vmap['counts_2m_C']][ixtime], 6000)
 
+    def test_dataset_info_store(self):
+
+        dset = nc_models.FileDataset.objects.get(name='scp_geo_tilt_cor')
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            nc_netcdf.DatasetInfoStore.configure(tmpdir)
+            try:
+                # a period which isn't cached by other tests
+                ncset = nc_netcdf.NetCDFDataset(
+                    os.path.join(dset.directory, dset.filenames),
+                    datetime(2012, 10, 3, 12, tzinfo=timezone.utc),
+                    datetime(2012, 10, 4, 12, tzinfo=timezone.utc))
+                ncvars = ncset.get_variables()
+
+                store = nc_netcdf.DatasetInfoStore.get()
+                self.assertTrue(os.path.exists(
+                    store.get_filename(ncset.cache_hash)))
+                dsinfo = store.load(ncset.cache_hash, ncset.path)
+                self.assertEqual(dsinfo['variables'].keys(), ncvars.keys())
+                self.assertTrue(dsinfo['file_mod_times'])
+                self.assertIsNone(store.load(ncset.cache_hash, '/other'))
+            finally:
+                nc_netcdf.DatasetInfoStore.configure(self.dataset_info_dir)
+
+
+    def test_file_extents(self):
+
+        dset = nc_models.FileDataset.objects.get(name='scp_geo_tilt_cor')
+        ncset = dset.get_netcdf_dataset()
+
+        start_time = datetime(2012, 10, 1, 12, tzinfo=timezone.utc)
+        end_time = datetime(2012, 10, 3, 12, tzinfo=timezone.utc)
+
+        tsd1 = ncset.read_time_series(['w.1m'], start_time, end_time)
+
+        extents = ncset.get_dataset_info()['file_extents']
+        ncpath = os.path.join(dset.directory, 'isfs_qc_gtc_20121002.nc')
+        extent = extents[ncpath]
+        self.assertEqual(extent.nrecs, 86400 / 300)
+        self.assertEqual(
+            extent.first_time,
+            datetime(2012, 10, 2, 0, 2, 30, tzinfo=timezone.utc).timestamp())
+        self.assertEqual(extent.last_time, extent.first_time + 86400 - 300)
+
+        # using the extents
+        tsd2 = ncset.read_time_series(['w.1m'], start_time, end_time)
+        ntp.assert_array_equal(tsd1['']['time'], tsd2['']['time'])
+        ntp.assert_array_equal(tsd1['']['data'][0], tsd2['']['data'][0])
+
+        # counts_1m_19 is only in the file of Oct 3, so the others
+        # are not read, and are gaps of missing values at their
+        # first and last times in the period
+        ncvars = ncset.get_variables()
+        self.assertIn('counts_1m_19', ncvars)
+        tsd = ncset.read_time_series(['counts_1m_19'], start_time, end_time)
+        self.assertEqual(len(tsd['']['time']), 4 + 86400 / 2 / 300)
+        ntp.assert_array_equal(
+            tsd['']['time'][:4],
+            [start_time.timestamp(), extents[ncpath].first_time - 300,
+             extents[ncpath].first_time, extents[ncpath].last_time])
+        gdata = tsd['']['data'][0][:4]
+        if gdata.dtype.kind in 'iu':
+            ntp.assert_array_equal(gdata, 0)
+        else:
+            self.assertTrue(np.all(np.isnan(gdata)))
+        self.assertEqual(
+            tsd['']['time'][4],
+            datetime(2012, 10, 3, 0, 2, 30, tzinfo=timezone.utc).timestamp())
+
+        avail = ncset.get_data_availability(['counts_1m_19', 'xyz'])
+        self.assertEqual(avail['xyz'], [])
+        self.assertEqual(len(avail['counts_1m_19']), 1)
+        self.assertEqual(avail['counts_1m_19'][0][0], tsd['']['time'][4])
+
+    def test_failed_reads(self):
+
+        dset = nc_models.FileDataset.objects.get(name='scp_geo_tilt_cor')
+        start_time = datetime(2012, 10, 1, 12, tzinfo=timezone.utc)
+        end_time = datetime(2012, 10, 3, 12, tzinfo=timezone.utc)
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            for day in ('20121001', '20121002', '20121003'):
+                shutil.copy(
+                    os.path.join(dset.directory, 'isfs_qc_gtc_%s.nc' % day),
+                    tmpdir)
+            path = os.path.join(tmpdir, dset.filenames)
+            ncset = nc_netcdf.NetCDFDataset(path, start_time, end_time)
+            tsd1 = ncset.read_time_series(['w.1m'], start_time, end_time)
+            ncpath = os.path.join(tmpdir, 'isfs_qc_gtc_20121002.nc')
+            extent = ncset.get_dataset_info()['file_extents'][ncpath]
+
+            # replaced by an unreadable file with the same modification
+            # time, so that its times are taken from its FileExtent
+            fstat = os.stat(ncpath)
+            with open(ncpath + '.tmp', 'w') as ncfile:
+                ncfile.write("not netcdf")
+            os.replace(ncpath + '.tmp', ncpath)
+            os.utime(ncpath, ns=(fstat.st_atime_ns, fstat.st_mtime_ns))
+
+            for nproc in (0, 2):
+                nc_netcdf.ReaderPool.configure(nproc)
+                try:
+                    ncset = nc_netcdf.NetCDFDataset(path, start_time, end_time)
+                    tsd2 = ncset.read_time_series(
+                        ['w.1m'], start_time, end_time)
+                finally:
+                    nc_netcdf.ReaderPool.configure(
+                        settings.NETCDF_READER_PROCESSES)
+
+                # a gap at the first and last times of the file
+                times = tsd2['']['time']
+                self.assertFalse(np.any(np.isnan(times)))
+                self.assertTrue(np.all(np.diff(times) > 0))
+                igap = np.searchsorted(times, extent.first_time)
+                self.assertEqual(times[igap + 1], extent.last_time)
+                self.assertTrue(np.all(np.isnan(
+                    tsd2['']['data'][0][igap:igap + 2])))
+                self.assertEqual(len(times), len(tsd1['']['time']) -
+                                 extent.nrecs + 2)
+                ntp.assert_array_equal(times[:igap], tsd1['']['time'][:igap])
+
+    def test_reader_pool(self):
+
+        dset = nc_models.FileDataset.objects.get(name='scp_geo_tilt_cor')
+        start_time = datetime(2012, 10, 1, 12, tzinfo=timezone.utc)
+        end_time = datetime(2012, 10, 3, 12, tzinfo=timezone.utc)
+
+        ncset = dset.get_netcdf_dataset()
+        tsd1 = ncset.read_time_series(
+            ['w.1m', 'counts_1m_19'], start_time, end_time)
+
+        # headers scanned by this process
+        iset = nc_netcdf.NetCDFDataset(ncset.path, start_time, end_time)
+        iset.get_variables()
+
+        dsinfo = ncset.get_dataset_info()
+        dsinfo['file_extents'].clear()
+        ncset.save_dataset_info(dsinfo, modified=False)
+        nc_netcdf.ReaderPool.configure(2)
+        try:
+            # times read by the readers, then from the FileExtents
+            for _ in range(2):
+                ncset = dset.get_netcdf_dataset()
+                tsd2 = ncset.read_time_series(
+                    ['w.1m', 'counts_1m_19'], start_time, end_time)
+                ntp.assert_array_equal(tsd1['']['time'], tsd2['']['time'])
+                self.assertEqual(tsd1['']['vmap'], tsd2['']['vmap'])
+                for (data1, data2) in zip(
+                        tsd1['']['data'], tsd2['']['data']):
+                    ntp.assert_array_equal(data1, data2)
+
+            # headers scanned by the readers, of the same files
+            pset = nc_netcdf.NetCDFDataset(
+                ncset.path, start_time - timedelta(seconds=1), end_time)
+            self.assertEqual(pset.get_variables(), iset.get_variables())
+            pinfo = pset.get_dataset_info()
+            iinfo = iset.get_dataset_info()
+            self.assertEqual(pinfo['station_names'], iinfo['station_names'])
+            self.assertEqual(pinfo['file_extents'], iinfo['file_extents'])
+        finally:
+            nc_netcdf.ReaderPool.configure(settings.NETCDF_READER_PROCESSES)
+
+    def test_reader_crash(self):
+
+        dset = nc_models.FileDataset.objects.get(name='scp_geo_tilt_cor')
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            ncpaths = []
+            for day in ('20121001', '20121002', '20121003'):
+                ncpaths.append(shutil.copy(
+                    os.path.join(dset.directory, 'isfs_qc_gtc_%s.nc' % day),
+                    tmpdir))
+
+            nc_netcdf.FileQuarantine.configure(
+                os.path.join(tmpdir, 'quarantine.sqlite3'))
+            nc_netcdf.ReaderPool.configure(2)
+            try:
+                pool = nc_netcdf.ReaderPool.get()
+                quarantine = nc_netcdf.FileQuarantine.get()
+
+                # the reader of the first file dies
+                tasks = [(ncpaths[0], os._exit, (1,))] + [
+                    (ncpath, nc_netcdf.ReaderPool.open_task, (ncpath,))
+                    for ncpath in ncpaths[1:]]
+                self.assertEqual(pool.run(tasks), [None, True, True])
+                self.assertEqual(
+                    [entry[0] for entry in quarantine.get_files()],
+                    [ncpaths[0]])
+
+                # the quarantined file is not read again
+                self.assertEqual(pool.run(tasks), [None, True, True])
+                self.assertEqual(len(quarantine.get_files()), 1)
+
+                # a retry is not affected by a crash in the shared readers
+                (future, _) = pool.submit(os._exit, (1,))
+                self.assertTrue(pool.retry(
+                    nc_netcdf.ReaderPool.open_task, (ncpaths[1],)))
+                with self.assertRaises(
+                        concurrent.futures.process.BrokenProcessPool):
+                    future.result()
+            finally:
+                nc_netcdf.ReaderPool.configure(settings.NETCDF_READER_PROCESSES)
+                nc_netcdf.FileQuarantine.configure(self.quarantine)
+
+    def test_file_quarantine(self):
+
+        dset = nc_models.FileDataset.objects.get(name='scp_geo_tilt_cor')
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            ncpath = os.path.join(tmpdir, 'isfs_qc_gtc_20121001.nc')
+            with open(ncpath, 'w') as ncfile:
+                ncfile.write("not netcdf")
+
+            nc_netcdf.FileQuarantine.configure(
+                os.path.join(tmpdir, 'quarantine.sqlite3'))
+            try:
+                quarantine = nc_netcdf.FileQuarantine.get()
+                self.assertIsNone(nc_netcdf.NetCDFDataset.open_file(ncpath))
+                self.assertTrue(quarantine.is_quarantined(
+                    ncpath, nc_netcdf.get_file_status(ncpath)))
+                self.assertIsNone(nc_netcdf.NetCDFDataset.open_file(ncpath))
+                files = quarantine.get_files()
+                self.assertEqual(len(files), 1)
+                self.assertEqual(files[0][0], ncpath)
+
+                # released when modified
+                shutil.copy(
+                    os.path.join(dset.directory, 'isfs_qc_gtc_20121001.nc'),
+                    ncpath)
+                os.utime(ncpath, (time.time() + 10, time.time() + 10))
+                ncfile = nc_netcdf.NetCDFDataset.open_file(ncpath)
+                self.assertIsNotNone(ncfile)
+                nc_netcdf.NetCDFDataset.close_file(ncfile)
+                self.assertEqual(quarantine.get_files(), [])
+            finally:
+                nc_netcdf.FileQuarantine.configure(self.quarantine)
+
+    def test_file_pool(self):
+
+        dset = nc_models.FileDataset.objects.get(name='scp_geo_tilt_cor')
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            ncpaths = []
+            for day in ('20121001', '20121002'):
+                ncpaths.append(shutil.copy(
+                    os.path.join(dset.directory, 'isfs_qc_gtc_%s.nc' % day),
+                    tmpdir))
+
+            nc_netcdf.FilePool.configure(1)
+            try:
+                ncfile = nc_netcdf.FilePool.open_file(ncpaths[0])
+                nc_netcdf.FilePool.close_file(ncfile)
+                self.assertTrue(ncfile.isopen())
+                self.assertIs(nc_netcdf.FilePool.open_file(ncpaths[0]), ncfile)
+                nc_netcdf.FilePool.close_file(ncfile)
+
+                # re-opened after a modification
+                os.utime(ncpaths[0], (time.time() + 10, time.time() + 10))
+                ncfile2 = nc_netcdf.FilePool.open_file(ncpaths[0])
+                self.assertIsNot(ncfile2, ncfile)
+                self.assertFalse(ncfile.isopen())
+                nc_netcdf.FilePool.close_file(ncfile2)
+
+                # least recently used is closed
+                ncfile = nc_netcdf.FilePool.open_file(ncpaths[1])
+                nc_netcdf.FilePool.close_file(ncfile)
+                self.assertFalse(ncfile2.isopen())
+            finally:
+                nc_netcdf.FilePool.configure(settings.NETCDF_OPEN_FILES)
+            self.assertFalse(ncfile.isopen())
+
+    def test_tail_read(self):
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            ncpath = os.path.join(tmpdir, 'rt_20121001.nc')
+
+            def append(ncfile, times):
+                nrec = len(ncfile.dimensions['time'])
+                ncfile.variables['time'][nrec:] = times
+                ncfile.variables['x'][nrec:] = times / 10.
+
+            ncfile = netCDF4.Dataset(ncpath, 'w')
+            ncfile.createDimension('time', None)
+            tvar = ncfile.createVariable('time', 'f8', ('time',))
+            tvar.units = 'seconds since 2012-10-01 00:00:00 +00:00'
+            ncfile.createVariable('x', 'f4', ('time',))
+            append(ncfile, np.arange(0., 1000.))
+            ncfile.close()
+
+            t0 = datetime(2012, 10, 1, tzinfo=timezone.utc)
+            ncset = nc_netcdf.NetCDFDataset(
+                os.path.join(tmpdir, 'rt_%Y%m%d.nc'), t0,
+                t0 + timedelta(days=1))
+            ncset.get_variables()
+
+            tsd = ncset.read_time_series(
+                ['x'], t0 + timedelta(seconds=990), t0 + timedelta(days=1))
+            self.assertEqual(len(tsd['']['time']), 10)
+
+            ncfile = netCDF4.Dataset(ncpath, 'a')
+            append(ncfile, np.arange(1000., 1005.))
+            ncfile.close()
+            os.utime(ncpath, (time.time() + 10, time.time() + 10))
+
+            # only the appended records are in the period
+            tsd = ncset.read_time_series(
+                ['x'], t0 + timedelta(seconds=1000), t0 + timedelta(days=1))
+            ntp.assert_array_equal(
+                tsd['']['time'], t0.timestamp() + np.arange(1000., 1005.))
+            ntp.assert_array_equal(
+                tsd['']['data'][0],
+                (np.arange(1000., 1005.) / 10.).astype(np.float32))
+            extent = ncset.get_dataset_info()['file_extents'][ncpath]
+            self.assertEqual(extent.nrecs, 1005)
+            self.assertEqual(extent.first_time, t0.timestamp())
+            self.assertEqual(extent.last_time, t0.timestamp() + 1004)
+
+    def test_metadata_freshness(self):
+
+        dset = nc_models.FileDataset.objects.get(name='scp_geo_tilt_cor')
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            for day in ('20121001', '20121002'):
+                shutil.copy(
+                    os.path.join(dset.directory, 'isfs_qc_gtc_%s.nc' % day),
+                    tmpdir)
+            path = os.path.join(tmpdir, dset.filenames)
+            start_time = datetime(2012, 10, 1, tzinfo=timezone.utc)
+
+            nc_netcdf.DatasetInfoStore.configure(None)
+            try:
+                # real-time
+                ncset = nc_netcdf.NetCDFDataset(
+                    path, start_time,
+                    datetime.now(timezone.utc) + timedelta(days=1))
+                self.assertTrue(ncset.get_variables())
+                self.assertEqual(ncset.get_metadata_generation(), 1)
+                dsinfo = ncset.get_dataset_info()
+                self.assertFalse(dsinfo['archival'])
+                self.assertEqual(
+                    dsinfo['last_file_time'],
+                    datetime(2012, 10, 2, tzinfo=timezone.utc))
+
+                # not checked again within the TTL
+                scan_time = dsinfo['scan_time']
+                ncset.get_variables()
+                self.assertEqual(
+                    ncset.get_dataset_info()['scan_time'], scan_time)
+
+                # a modification which doesn't change the variables
+                nc_netcdf.NetCDFDataset.configure(0)
+                ncpath = os.path.join(tmpdir, 'isfs_qc_gtc_20121002.nc')
+                os.utime(ncpath, (time.time() + 10, time.time() + 10))
+                ncset.get_variables()
+                dsinfo = ncset.get_dataset_info()
+                self.assertGreater(dsinfo['scan_time'], scan_time)
+                self.assertEqual(dsinfo['generation'], 1)
+
+                # archival
+                ncset = nc_netcdf.NetCDFDataset(
+                    path, start_time,
+                    datetime(2012, 10, 3, tzinfo=timezone.utc))
+                ncset.get_variables()
+                dsinfo = ncset.get_dataset_info()
+                self.assertTrue(dsinfo['archival'])
+                ncset.get_variables()
+                self.assertEqual(
+                    ncset.get_dataset_info()['scan_time'], dsinfo['scan_time'])
+            finally:
+                nc_netcdf.NetCDFDataset.configure(settings.DATASET_INFO_TTL)
+                nc_netcdf.DatasetInfoStore.configure(self.dataset_info_dir)
+
+    def test_decimate(self):
+
+        times = np.arange(10000, dtype=np.float64)
+        data = np.sin(times / 100.)
+        data[5000:5100] = float('nan')
+        spike = 7777
+        data[spike] = 10.
+
+        for method in ("lttb", "minmax"):
+            ser_data = {
+                'time': times,
+                'data': [data.copy()],
+                'vmap': {'x': 0},
+                'dim2': {},
+            }
+            self.assertTrue(nc_decimate.decimate_series(
+                ser_data, 200, method=method))
+            dtimes = ser_data['time']
+            self.assertLessEqual(len(dtimes), 210)
+            # end points, extreme values and the start of the gap are kept
+            self.assertEqual(dtimes[0], times[0])
+            self.assertEqual(dtimes[-1], times[-1])
+            self.assertTrue(spike in dtimes)
+            self.assertTrue(5000 in dtimes)
+            ntp.assert_array_equal(
+                ser_data['data'][0], data[dtimes.astype(int)])
+
+        # the envelope and counts of a Pyramid read cover all records
+        ser_data = {
+            'time': times,
+            'data': [data.copy()],
+            'min': [data - 1.],
+            'max': [data + 1.],
+            'count': [np.ones(len(times), dtype=np.int32)],
+            'vmap': {'x': 0},
+            'dim2': {},
+        }
+        self.assertTrue(nc_decimate.decimate_series(ser_data, 200))
+        ndec = len(ser_data['time'])
+        for key in ('min', 'max', 'count'):
+            self.assertEqual(len(ser_data[key][0]), ndec)
+        self.assertEqual(np.nanmax(ser_data['max'][0]), 11.)
+        self.assertEqual(np.nanmin(ser_data['min'][0]), np.nanmin(data) - 1.)
+        self.assertEqual(ser_data['count'][0].sum(), len(times))
+
+        ser_data = {'time': times[:100], 'data': [data[:100]], 'vmap': {'x': 0}}
+        self.assertFalse(nc_decimate.decimate_series(ser_data, 200))
+        self.assertEqual(len(ser_data['time']), 100)
+
+    def test_pyramid(self):
+
+        dset = nc_models.FileDataset.objects.get(name='scp_geo_tilt_cor')
+
+        start_time = datetime(2012, 10, 1, 0, 0, 0, tzinfo=timezone.utc)
+        end_time = start_time + timedelta(days=2)
+        variables = ['w.1m', 'counts_2m_C']
+        selectdim = {"station": [4]}
+
+        with tempfile.TemporaryDirectory() as pdir:
+            ncdset = nc_netcdf.NetCDFDataset(
+                os.path.join(dset.directory, dset.filenames),
+                dset.get_start_time(), dset.get_end_time(), pyramid_dir=pdir)
+
+            # not built, data is read from the files
+            tsd = ncdset.read_time_series(
+                variables, start_time=start_time, end_time=end_time,
+                selectdim=selectdim, resolution=3600)
+            self.assertFalse('resolution' in tsd[''])
+
+            pyr = nc_pyramid.Pyramid(pdir)
+            self.assertTrue(pyr.update(ncdset) > 0)
+            # nothing new
+            self.assertEqual(pyr.update(ncdset), 0)
+
+            ptsd = ncdset.read_time_series(
+                variables, start_time=start_time, end_time=end_time,
+                selectdim=selectdim, resolution=3600)
+
+        self.assertEqual(ptsd['']['resolution'], 3600)
+        self.assertEqual(len(ptsd['']['time']), 48)
+        self.assertEqual(ptsd['']['stnnames'], tsd['']['stnnames'])
+
+        for vname in variables:
+            (btimes, agg) = nc_pyramid.aggregate(
+                tsd['']['time'], tsd['']['data'][tsd['']['vmap'][vname]], 3600)
+            ntp.assert_allclose(
+                ptsd['']['data'][ptsd['']['vmap'][vname]], agg['mean'],
+                rtol=1.e-5)
+            ntp.assert_array_equal(
+                ptsd['']['count'][ptsd['']['vmap'][vname]], agg['count'])
+
+    def test_fileset_index(self):
+
+        dset = nc_models.FileDataset.objects.get(name='scp_geo_tilt_cor')
+        path = os.path.join(dset.directory, dset.filenames)
+
+        start_time = datetime(2012, 10, 1, 12, 0, 0, tzinfo=timezone.utc)
+        end_time = start_time + timedelta(days=2)
+
+        index = nc_fileset.FilesetIndex.get()
+        try:
+            nc_fileset.FilesetIndex.configure(None)
+            files = nc_fileset.Fileset(path).scan(start_time, end_time)
+
+            with tempfile.TemporaryDirectory() as tmpdir:
+                nc_fileset.FilesetIndex.configure(
+                    os.path.join(tmpdir, "index.sqlite3"))
+                ifiles = nc_fileset.Fileset(path).scan(start_time, end_time)
+                # snapshot from the index
+                ifiles2 = nc_fileset.Fileset(path).scan(start_time, end_time)
+        finally:
+            nc_fileset.FilesetIndex.configure(index.path if index else None)
+
+        # includes the file previous to start_time
+        self.assertEqual(len(files), 3)
+        self.assertEqual(
+            [(f.path, f.time) for f in files],
+            [(f.path, f.time) for f in ifiles])
+        self.assertEqual(
+            [(f.path, f.time) for f in files],
+            [(f.path, f.time) for f in ifiles2])
+
+    def test_fileset_subdirs(self):
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            # files every 12 hours, in year and month directories
+            ftime = datetime(2013, 12, 1, 0, 0, 0, tzinfo=timezone.utc)
+            while ftime < datetime(2014, 2, 1, tzinfo=timezone.utc):
+                fdir = ftime.strftime(os.path.join(tmpdir, '%Y', '%m'))
+                os.makedirs(fdir, exist_ok=True)
+                open(ftime.strftime(os.path.join(fdir, 'f_%d_%H.nc')), 'w').close()
+                ftime += timedelta(hours=12)
+
+            self.assertEqual(
+                nc_fileset.get_time_interval(
+                    os.path.join(tmpdir, '2013', '12'),
+                    os.path.join(tmpdir, '%Y', '%m')),
+                (datetime(2013, 12, 1, tzinfo=timezone.utc),
+                 datetime(2014, 1, 1, tzinfo=timezone.utc)))
+
+            fset = nc_fileset.Fileset(
+                os.path.join(tmpdir, '%Y', '%m', 'f_%d_%H.nc'))
+
+            self.assertEqual(len(fset.scan()), 124)
+
+            # previous file is in the December directory
+            files = fset.scan(
+                datetime(2014, 1, 1, 0, 0, 0, tzinfo=timezone.utc) -
+                timedelta(seconds=1),
+                datetime(2014, 1, 2, 0, 0, 0, tzinfo=timezone.utc))
+            self.assertEqual(
+                [f.time.isoformat() for f in files],
+                ['2013-12-31T12:00:00+00:00', '2014-01-01T00:00:00+00:00',
+                 '2014-01-01T12:00:00+00:00'])
+
+            # names predicted from the hourly period of the path,
+            # without scanning directories
+            start_time = datetime(2014, 1, 1, 1, 30, 0, tzinfo=timezone.utc)
+            end_time = datetime(2014, 1, 2, 0, 0, 0, tzinfo=timezone.utc)
+            pfiles = fset.predict(start_time, end_time)
+            self.assertEqual(
+                [(f.path, f.time) for f in pfiles],
+                [(f.path, f.time) for f in fset.pdir.scan(
+                    start_time, end_time)])
+
+            # previous file is too many periods before start
+            self.assertIsNone(fset.predict(
+                datetime(2014, 1, 1, 0, 0, 0, tzinfo=timezone.utc) -
+                timedelta(seconds=1),
+                datetime(2014, 1, 2, 0, 0, 0, tzinfo=timezone.utc)))
+
+            # period of a second is too short
+            self.assertIsNone(nc_fileset.Fileset(
+                os.path.join(tmpdir, '%Y', '%m', 'f_%d_%H%M%S.nc')).predict(
+                    start_time, start_time + timedelta(seconds=60)))
+
+            # too many names to predict
+            self.assertIsNone(fset.predict(
+                datetime(2013, 1, 1, 0, 0, 0, tzinfo=timezone.utc),
+                datetime(2014, 1, 2, 0, 0, 0, tzinfo=timezone.utc)))
+
+            # sub-directories scanned in parallel, with and without an index
+            index = nc_fileset.FilesetIndex.get()
+            start_time = datetime(2013, 12, 20, tzinfo=timezone.utc)
+            end_time = datetime(2014, 1, 20, tzinfo=timezone.utc)
+            files = fset.pdir.scan(start_time, end_time)
+            try:
+                nc_fileset.ScanPool.configure(4)
+                nc_fileset.FilesetIndex.configure(None)
+                pfiles = fset.pdir.scan(start_time, end_time)
+                nc_fileset.FilesetIndex.configure(
+                    os.path.join(tmpdir, "index.sqlite3"))
+                ifiles = fset.scan(start_time, end_time)
+            finally:
+                nc_fileset.ScanPool.configure(1)
+                nc_fileset.FilesetIndex.configure(index.path if index else None)
+            self.assertEqual(len(files), 62)
+            for res in (pfiles, ifiles):
+                self.assertEqual(
+                    [(f.path, f.time) for f in files],
+                    [(f.path, f.time) for f in res])
+
+    def test_fileset_watch(self):
+
+        nc_fileset.DirWatcher.configure(True)
+        try:
+            watcher = nc_fileset.DirWatcher.get()
+            if not watcher:
+                self.skipTest("inotify not available")
+
+            with tempfile.TemporaryDirectory() as tmpdir:
+                if not watcher.is_local(tmpdir):
+                    self.skipTest("{} is not local".format(tmpdir))
+
+                for day in (1, 2):
+                    open(os.path.join(
+                        tmpdir, 'f_201401{:02d}.nc'.format(day)), 'w').close()
+                # old enough that a double check is not needed
+                mtime = time.time() - 3600
+                os.utime(tmpdir, (mtime, mtime))
+
+                fset = nc_fileset.Fileset(os.path.join(tmpdir, 'f_%Y%m%d.nc'))
+                self.assertEqual(len(fset.scan()), 2)
+                pdir = nc_fileset.Dir.get(tmpdir, tmpdir, 'f_%Y%m%d.nc')
+                self.assertIs(pdir.watcher, watcher)
+
+                open(os.path.join(tmpdir, 'f_20140103.nc'), 'w').close()
+                for _ in range(100):
+                    if pdir.watcher is None:
+                        break
+                    time.sleep(0.01)
+                self.assertIsNone(pdir.watcher)
+                self.assertEqual(len(fset.scan()), 3)
+        finally:
+            nc_fileset.DirWatcher.configure(False)
+
+    def test_fileset_filelist(self):
+
+        times = [datetime(2014, 1, day, tzinfo=timezone.utc).timestamp()
+                 for day in (3, 1, 2)]
+        flist = nc_fileset.FileList(
+            '/data', '/data/f_%Y%m%d.nc',
+            ['f_20140103.nc', 'f_20140101.nc', 'f_20140102.nc'], times)
+        self.assertEqual(
+            flist.paths(),
+            ['/data/f_20140101.nc', '/data/f_20140102.nc',
+             '/data/f_20140103.nc'])
+
+        # previous, first and stop indices
+        self.assertEqual(
+            flist.select(
+                datetime(2014, 1, 1, 12, tzinfo=timezone.utc),
+                datetime(2014, 1, 3, tzinfo=timezone.utc)), (0, 1, 2))
+        self.assertEqual(
+            flist.select(
+                datetime(2014, 1, 1, tzinfo=timezone.utc),
+                datetime(2014, 1, 5, tzinfo=timezone.utc)), (0, 1, 3))
+        self.assertEqual(
+            flist.select(
+                datetime(2013, 1, 1, tzinfo=timezone.utc),
+                datetime(2013, 1, 2, tzinfo=timezone.utc)), (-1, 0, 0))
+
+        files = flist.files(1, 3)
+        self.assertEqual(
+            [(f.path, f.pathdesc, f.time) for f in files],
+            [(f.path, f.pathdesc, f.time) for f in (
+                nc_fileset.File('/data/f_20140102.nc', '/data/f_%Y%m%d.nc'),
+                nc_fileset.File('/data/f_20140103.nc', '/data/f_%Y%m%d.nc'))])
+
+    def test_lru_cache(self):
+
+        evicted = []
+        cache = nc_cache.LRUCache(
+            'test', max_entries=3, sizeof=lambda val: val,
+            on_evict=evicted.append)
+
+        for key in 'abc':
+            cache.put(key, 10)
+        self.assertEqual(cache.get('a'), 10)
+        # least recently used is 'b'
+        cache.put('d', 10)
+        self.assertNotIn('b', cache)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(evicted, [10])
+
+        # byte limit
+        cache.set_limits(max_bytes=25)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.get_or_create('e', lambda: 20), 20)
+        self.assertEqual(len(cache), 1)
+
+        stats = cache.stats()
+        self.assertEqual(
+            (stats['entries'], stats['bytes'], stats['hits'],
+             stats['misses'], stats['evictions']),
+            (1, 20, 1, 2, 4))
+
+        # limits from settings, by name
+        nc_cache.LRUCache.configure({'test': {'entries': 1}})
+        cache = nc_cache.LRUCache('test', max_entries=3)
+        self.assertEqual(cache.max_entries, 1)
+        nc_cache.LRUCache.configure(settings.NCHARTS_CACHE_LIMITS)
+
+    def test_single_flight(self):
+
+        flight = nc_cache.SingleFlight('test')
+        ncalls = []
+
+        def read():
+            ncalls.append(1)
+            # wait for the other thread to join the call
+            for _ in range(1000):
+                if flight.shared:
+                    break
+                time.sleep(0.01)
+            return {'': {'time': np.arange(3.), 'data': [], 'vmap': {}}}
+
+        results = [None, None]
+        def run(ires):
+            results[ires] = flight.do(
+                'key', read, copy=nc_netcdf.copy_time_series)
+
+        threads = [threading.Thread(target=run, args=(i,)) for i in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(ncalls), 1)
+        self.assertEqual((flight.calls, flight.shared), (1, 1))
+        self.assertIsNot(results[0][''], results[1][''])
+        self.assertIs(results[0]['']['time'], results[1]['']['time'])
+
+        # not coalesced once complete
+        flight.do('key', read)
+        self.assertEqual(len(ncalls), 2)
+
+    def test_tail_buffer(self):
+
+        # real-time variables with a record every 10 seconds, up to
+        # last, whose last value of x is written after its time
+        t0 = datetime(2012, 10, 1, tzinfo=timezone.utc)
+        last = [t0.timestamp() + 600]
+        reads = []
+
+        def read(vnames, start_time, end_time):
+            reads.append((vnames, start_time))
+            times = np.arange(t0.timestamp(), last[0] + 1, 10.)
+            times = times[(times >= start_time.timestamp()) &
+                          (times < end_time.timestamp())]
+            if not len(times):
+                raise nc_exc.NoDataException("no data")
+            xdata = times / 10.
+            xdata[times == last[0]] = float('nan')
+            return {'': {
+                'time': times, 'data': [xdata, times / 100.],
+                'vmap': {'x': 0, 'y': 1}, 'dim2': {}, 'stnnames': {}}}
+
+        nc_tail.TailBuffer.configure(3600)
+        try:
+            def poll(stimes, etime):
+                return nc_tail.TailBuffer.read(
+                    'test', read,
+                    {vname: t0 + timedelta(seconds=stime)
+                     for (vname, stime) in stimes.items()},
+                    t0 + timedelta(seconds=etime))
+
+            vdata = poll({'x': 300, 'y': 500}, 601)
+            self.assertEqual(reads, [(['x', 'y'], t0 + timedelta(seconds=300))])
+            self.assertEqual(len(vdata['x']['time']), 31)
+            self.assertEqual(vdata['y']['time'][0], t0.timestamp() + 500)
+            self.assertEqual(vdata['y']['vmap'], {'y': 0})
+            ytime0 = vdata['y']['time']
+            # another client, answered from the buffers
+            vdata = poll({'x': 500}, 601)
+            self.assertEqual(vdata['x']['time'][0], t0.timestamp() + 500)
+            self.assertEqual(len(reads), 1)
+
+            # the last value of x is filled in, and new records are
+            # appended, which are read from after the last valid values
+            last[0] += 100
+            xdata0 = vdata['x']['data'][0]
+            xvals0 = xdata0.copy()
+            vdata = poll({'x': 590.001, 'y': 600.001}, 702)
+            self.assertEqual(len(reads), 2)
+            self.assertEqual(
+                reads[-1][1].timestamp(), t0.timestamp() + 590.001)
+            ntp.assert_array_equal(
+                vdata['x']['time'],
+                t0.timestamp() + np.arange(600., 701., 10.))
+            self.assertEqual(
+                vdata['x']['data'][0][0], (t0.timestamp() + 600) / 10.)
+            self.assertTrue(np.isnan(vdata['x']['data'][0][-1]))
+            ntp.assert_array_equal(
+                vdata['y']['time'],
+                t0.timestamp() + np.arange(610., 701., 10.))
+            # appended in place, without modifying the previous slices
+            self.assertIs(vdata['y']['time'].base, ytime0.base)
+            ntp.assert_array_equal(xdata0, xvals0)
+
+            # older than the length of the buffers
+            vdata = poll({'x': 0}, 4000)
+            self.assertEqual(reads[-1], (['x'], t0))
+            self.assertEqual(len(vdata['x']['time']), 71)
+        finally:
+            nc_tail.TailBuffer.configure(settings.TAIL_BUFFER_LENGTH)
+
+    def test_fileset_parse_time(self):
+
+        # repeated descriptors
+        pathdesc = '/data/%Y/%m/f_%Y%m%d_%H.nc'
+        path = '/data/2014/07/f_20140715_03.nc'
+        self.assertEqual(
+            nc_fileset.parse_time(path, pathdesc),
+            datetime(2014, 7, 15, 3, tzinfo=timezone.utc).timestamp())
+        self.assertEqual(
+            nc_fileset.File(path, pathdesc).time,
+            datetime(2014, 7, 15, 3, tzinfo=timezone.utc))
+
+        for path in ('/data/2014/07/f_20150715_03.nc',
+                     '/data/2014/13/f_20141315_03.nc',
+                     '/data/2014/07/f_20140715_03.nc.gz'):
+            with self.assertRaises(ValueError):
+                nc_fileset.parse_time(path, pathdesc)
+
+        # same as strptime
+        pathdesc = '/data/x_%y%j.%H%M%S'
+        path = '/data/x_16366.235959'
+        self.assertEqual(
+            nc_fileset.parse_time(path, pathdesc),
+            datetime.strptime(path, pathdesc).replace(
+                tzinfo=timezone.utc).timestamp())
+
+        # unsupported descriptor
+        self.assertIsNone(nc_fileset.parse_time('/data/Jul', '/data/%b'))
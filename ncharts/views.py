@@ -38,6 +38,8 @@ from django.core import exceptions as dj_exc
 from ncharts import models as nc_models
 from ncharts import forms as nc_forms
 from ncharts import exceptions as nc_exc
+from ncharts import decimate as nc_decimate
+from ncharts import tail as nc_tail
 from ncharts.version import get_version
 
 _version = get_version()
@@ -756,6 +758,19 @@ class DatasetView(View):
 
         stndims = {"station": [int(stn) for stn in sel_stns]}
 
+        # Maximum number of points per plotted line. The browser
+        # requests a number based on its width, which is limited
+        # by the configured maximum for the dataset, if any.
+        max_points = form.cleaned_data['max_points']
+        if dset.max_points and (not max_points or max_points > dset.max_points):
+            max_points = dset.max_points
+
+        # Time resolution needed for the plot. Aggregates at this
+        # resolution are read, if they have been built for the dataset.
+        resolution = None
+        if max_points:
+            resolution = (end_time - start_time).total_seconds() / max_points
+
         try:
             if isinstance(dset, nc_models.FileDataset):
                 ncdset = dset.get_netcdf_dataset()
@@ -763,7 +778,8 @@ class DatasetView(View):
                     sel_vars, start_time=start_time, end_time=end_time,
                     selectdim=stndims,
                     series=sel_soundings,
-                    series_name_fmt=series_name_fmt)
+                    series_name_fmt=series_name_fmt,
+                    resolution=resolution)
             else:
                 dbcon = dset.get_connection()
                 indata = dbcon.read_time_series(
@@ -803,6 +819,7 @@ class DatasetView(View):
 
         time0 = {}
         vsizes = {}
+        decimated = {}
 
         for series_name in indata:
             ser_data = indata[series_name]
@@ -817,7 +834,7 @@ class DatasetView(View):
                         vsizes[series_name][vname] = ser_data['data'][vindex].size
                         lastok = np.where(~np.isnan(
                             ser_data['data'][vindex]))[0][-1]
-                        time_last_ok = ser_data['time'][lastok]
+                        time_last_ok = float(ser_data['time'][lastok])
                     except IndexError:  # all data is nan
                         time_last_ok = (start_time - \
                             datetime.timedelta(seconds=0.001)).timestamp()
@@ -825,27 +842,50 @@ class DatasetView(View):
                         continue
 
                     try:
-                        time_last = ser_data['time'][-1]
+                        time_last = float(ser_data['time'][-1])
                     except IndexError:  # no data
                         time_last = time_last_ok
 
                     client_state.save_data_times(vname, time_last_ok, time_last)
 
+            # Decimate time series after saving the data times above,
+            # so that real-time updates continue from the last time read.
+            # Variables with a second dimension are plotted as heatmaps
+            # and are not used to select the decimated times.
+            # Means read from a Pyramid are also marked as decimated,
+            # since their times are those of its intervals.
+            decimated[series_name] = 'resolution' in ser_data
+            if max_points and series_name == "":
+                try:
+                    if nc_decimate.decimate_series(
+                            ser_data, max_points, method=dset.decimation,
+                            skip=ser_data['dim2']):
+                        decimated[series_name] = True
+                except ValueError as exc:
+                    _logger.error("%s, %s: %s", project_name, dataset_name, exc)
+
             # A simple compression, subtract first time from all times,
             # reducing the number of characters sent.
             time0[series_name] = 0
-            if ser_data['time']:
-                time0[series_name] = ser_data['time'][0]
+            if len(ser_data['time']) > 0:
+                time0[series_name] = float(ser_data['time'][0])
 
             # subtract off time0
-            ser_data['time'] = [x - time0[series_name] for \
-                    x in ser_data['time']]
+            ser_data['time'] = ser_data['time'] - time0[series_name]
 
         json_time0 = mark_safe(json.dumps(time0))
-        json_time = mark_safe(json.dumps({sn: indata[sn]['time'] for sn in indata}))
+        json_decimated = mark_safe(json.dumps(decimated))
+        json_time = mark_safe(json.dumps(
+            {sn: indata[sn]['time'].tolist() for sn in indata}))
         json_data = mark_safe(json.dumps(
             {sn: indata[sn]['data'] for sn in indata},
             cls=NChartsJSONEncoder))
+        # The minimum, maximum and number of the records of the means
+        # read from a Pyramid, which are plotted as an envelope.
+        json_envelope = mark_safe(json.dumps(
+            {sn: {key: indata[sn][key] for key in ('min', 'max', 'count')}
+             for sn in indata if 'resolution' in indata[sn]},
+            cls=NChartsJSONEncoder))
         json_vmap = mark_safe(json.dumps(
             {sn: indata[sn]['vmap'] for sn in indata},
             cls=NChartsJSONEncoder).replace("'", r"\u0027"))
@@ -998,7 +1038,9 @@ class DatasetView(View):
                 'plot_groups': plot_groups,
                 'time0': json_time0,
                 'time': json_time,
+                'decimated': json_decimated,
                 'data': json_data,
+                'envelope': json_envelope,
                 'vmap': json_vmap,
                 'dim2': json_dim2,
                 'stations': json_stns,
@@ -1092,8 +1134,16 @@ class DataView(View):
 
         stndims = {"station": [int(stn) for stn in sel_stns]}
 
-        for vname in sel_vars:
+        # Rounded up to the second, so that the reads of clients
+        # polling concurrently are the same, and are coalesced.
+        etime = tnow.replace(microsecond=0) + \
+            datetime.timedelta(seconds=1)
 
+        # Start of the new data of each variable, after the timetag
+        # of its last non-nan sample sent to the client
+        data_times = {}
+        stimes = {}
+        for vname in sel_vars:
             # timetag of last non-nan sample for this variable sent to client
             # timetag of last sample for this variable sent to client
             [time_last_ok, time_last] = client_state.get_data_times(vname)
@@ -1103,92 +1153,100 @@ class DataView(View):
                     "variable=%s",
                     project_name, dataset_name, client_state.id, vname)
                 continue
-
-            stime = datetime.datetime.fromtimestamp(
+            data_times[vname] = (time_last_ok, time_last)
+            stimes[vname] = datetime.datetime.fromtimestamp(
                 time_last_ok + 0.001, tz=timezone)
 
-            etime = tnow
-
-            try:
-                if isinstance(dset, nc_models.FileDataset):
-                    indata = ncdset.read_time_series(
-                        [vname], start_time=stime, end_time=etime,
-                        selectdim=stndims,
-                        )
-                else:
-                    indata = dbcon.read_time_series(
-                        [vname], start_time=stime, end_time=etime)
+        # The variables are read together, from the earliest start.
+        # The newest records are shared by all clients of the
+        # dataset, in TailBuffers.
+        try:
+            if isinstance(dset, nc_models.FileDataset):
+                vdata = nc_tail.TailBuffer.read(
+                    (ncdset.cache_hash, tuple(stndims['station'])),
+                    lambda vnames, stime, etime: ncdset.read_time_series(
+                        vnames, start_time=stime, end_time=etime,
+                        selectdim=stndims),
+                    stimes, etime)
+            else:
+                vdata = nc_tail.TailBuffer.read(
+                    (dbcon.database, dbcon.host, dbcon.port, dbcon.table),
+                    lambda vnames, stime, etime: dbcon.read_time_series(
+                        vnames, start_time=stime, end_time=etime),
+                    stimes, etime)
+        except OSError as exc:
+            _logger.error("%s, %s: %s", project_name, dataset_name, exc)
+            vdata = {}
+        except nc_exc.TooMuchDataException as exc:
+            _logger.warning("%s, %s: %s", project_name, dataset_name, exc)
+            vdata = {}
 
-                # one series
-                ser_data = indata['']
-                if not vname in ser_data['vmap']:
-                    continue
-                vindex = ser_data['vmap'][vname]
+        for vname in sel_vars:
 
-                try:
-                    lastok = np.where(~np.isnan(ser_data['data'][vindex]))[0][-1]
-                    time_last_ok = ser_data['time'][lastok]
-                    if debug:
-                        _logger.debug(
-                            "Dataview Get, %s, %s: variable=%s, last_time_ok=%s"
-                            "stime=%s, etime=%s",
-                            project_name, dataset_name, vname,
-                            datetime.datetime.fromtimestamp(
-                                time_last_ok, tz=timezone).isoformat(),
-                            stime.isoformat(), etime.isoformat())
-                except IndexError:
-                    # All data nan. Only send those after time_last.
-                    if debug:
-                        _logger.debug(
-                            "Dataview Get, %s, %s: variable=%s, all data nan, " \
-                            "stime=%s, etime=%s",
-                            project_name, dataset_name, vname,
-                            stime.isoformat(), etime.isoformat())
-
-                    # index of first time > time_last
-                    idx = next((i for i, t in enumerate(ser_data['time']) \
-                        if t > time_last), -1)
-                    if idx >= 0:
-                        ser_data['time'] = ser_data['time'][idx:]
-                        ser_data['data'][vindex] = ser_data['data'][vindex][idx:]
-                        time_last = ser_data['time'][-1]
-                    else:
-                        if debug:
-                            _logger.debug(
-                                "Dataview Get, %s, %s: variable=%s, no new data, "
-                                "stime=%s, etime=%s, time_last=%s",
-                                project_name, dataset_name, vname,
-                                stime.isoformat(), etime.isoformat(),
-                                datetime.datetime.fromtimestamp(
-                                    time_last, tz=timezone).isoformat())
-                        # ser_data['time'] = []
-                        # ser_data['data'][vindex] = []
-                        continue
-            except OSError as exc:
-                _logger.error("%s, %s: %s", project_name, dataset_name, exc)
+            if vname not in data_times:
                 continue
-            except nc_exc.TooMuchDataException as exc:
-                _logger.warning("%s, %s: %s", project_name, dataset_name, exc)
-                continue
-            except (nc_exc.NoDataException, KeyError) as exc:
-                # KeyError: variable not found in data
+            (time_last_ok, time_last) = data_times[vname]
+            stime = stimes[vname]
+
+            # one series, of this variable
+            ser_data = vdata.get(vname)
+            if not ser_data:
                 if debug:
                     _logger.debug(
-                        "Dataview Get: %s, %s ,%s: variable=%s, "
-                        ", time_last=%s, exc=%s",
-                        project_name, dataset_name, exc, vname,
+                        "Dataview Get: %s, %s: variable=%s, no data, "
+                        "time_last=%s",
+                        project_name, dataset_name, vname,
                         datetime.datetime.fromtimestamp(
-                            time_last, tz=timezone).isoformat(),
-                        exc)
+                            time_last, tz=timezone).isoformat())
                 continue
+            vindex = ser_data['vmap'][vname]
+
+            try:
+                lastok = np.where(~np.isnan(ser_data['data'][vindex]))[0][-1]
+                time_last_ok = float(ser_data['time'][lastok])
+                if debug:
+                    _logger.debug(
+                        "Dataview Get, %s, %s: variable=%s, last_time_ok=%s"
+                        "stime=%s, etime=%s",
+                        project_name, dataset_name, vname,
+                        datetime.datetime.fromtimestamp(
+                            time_last_ok, tz=timezone).isoformat(),
+                        stime.isoformat(), etime.isoformat())
+            except IndexError:
+                # All data nan. Only send those after time_last.
+                if debug:
+                    _logger.debug(
+                        "Dataview Get, %s, %s: variable=%s, all data nan, " \
+                        "stime=%s, etime=%s",
+                        project_name, dataset_name, vname,
+                        stime.isoformat(), etime.isoformat())
+
+                # index of first time > time_last
+                idx = np.searchsorted(ser_data['time'], time_last, side='right')
+                if idx < len(ser_data['time']):
+                    ser_data['time'] = ser_data['time'][idx:]
+                    ser_data['data'][vindex] = ser_data['data'][vindex][idx:]
+                    time_last = float(ser_data['time'][-1])
+                else:
+                    if debug:
+                        _logger.debug(
+                            "Dataview Get, %s, %s: variable=%s, no new data, "
+                            "stime=%s, etime=%s, time_last=%s",
+                            project_name, dataset_name, vname,
+                            stime.isoformat(), etime.isoformat(),
+                            datetime.datetime.fromtimestamp(
+                                time_last, tz=timezone).isoformat())
+                    # ser_data['time'] = []
+                    # ser_data['data'][vindex] = []
+                    continue
 
             client_state.save_data_times(vname, time_last_ok, time_last)
 
             # A simple compression, subtract first time from all times,
             # reducing the number of characters sent.
             time0 = 0
-            if ser_data['time']:
-                time0 = ser_data['time'][0]
+            if len(ser_data['time']) > 0:
+                time0 = float(ser_data['time'][0])
 
             # dim2 are floats, so we encode them to strings with
             # the NChartsJSONEncoder
@@ -1210,7 +1268,7 @@ class DataView(View):
                 'variable': vname,  # need to replace apostrophes?
                 'time0': time0,
                 'time': mark_safe(json.dumps(
-                    [x - time0 for x in ser_data['time']])),
+                    (ser_data['time'] - time0).tolist())),
                 'data': dout,
                 'stations': stns,
                 'dim2': dim2